@@ -0,0 +1,21 @@
+"""Synthetic corpora shared by the benchmarks.
+
+The benchmarks are run as scripts, from which this module is imported as
+a sibling:
+
+    from corpora import corpus
+"""
+import random
+
+
+def corpus(messages, words, vocabulary=5000, s=1, seed=0):
+    """Generate *messages* sentences of *words* words.
+
+    Words are drawn from a vocabulary of *vocabulary* words following a
+    Zipfian distribution of exponent *s*.
+    """
+    rng = random.Random(seed)
+    vocabulary = ["word{}".format(i) for i in range(vocabulary)]
+    weights = [1 / rank ** s for rank in range(1, len(vocabulary) + 1)]
+    for _ in range(messages):
+        yield " ".join(rng.choices(vocabulary, weights, k=words))
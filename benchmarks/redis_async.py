@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+"""Compare the throughput of the asynchronous redis backends.
+
+`RedisDatabaseAsync` relies on the legacy aioredis 1.x client, while
+`RedisAsyncioDatabase` relies on `redis.asyncio`, along with hiredis when it
+is installed. This script runs the same workload on both backends against a
+redis server, from several concurrent tasks, and reports the number of
+operations per second of each.
+
+The database given by ``--db`` is flushed before each run.
+
+Usage:
+    python benchmarks/redis_async.py [--host HOST] [--port PORT] [--db N]
+        [--messages N] [--operations N] [--concurrency N] [--weighted]
+"""
+import argparse
+import asyncio
+import time
+
+from corpora import corpus
+from redis.utils import HIREDIS_AVAILABLE
+
+from chattymarkov import ChattyMarkovAsync
+from chattymarkov.database.databases import _SCRIPT_SHAS
+
+
+BACKENDS = {
+    "aioredis": "aioredis://{host}:{port};db={db};weighted={weighted}",
+    "redis.asyncio": "redis_async://{host}:{port};db={db};weighted={weighted}",
+}
+
+
+async def timed(operation, count, concurrency):
+    """Run *operation* *count* times from *concurrency* tasks.
+
+    Returns:
+        The number of operations per second.
+    """
+    remaining = iter(range(count))
+
+    async def worker():
+        for _ in remaining:
+            await operation()
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return count / (time.perf_counter() - start)
+
+
+async def run(connect_string, messages, args):
+    """Run the workload on *connect_string*, return ops/sec per operation."""
+    markov = ChattyMarkovAsync(connect_string)
+    await markov.connect()
+    db = markov.db
+    # Scripts are loaded beforehand, so that no timed operation loads them.
+    if hasattr(db, "handle"):
+        await db.handle.flushdb()
+        for script in _SCRIPT_SHAS:
+            await db.handle.script_load(script)
+    else:
+        async with db.connection() as conn:
+            await conn.execute("FLUSHDB")
+            for script in _SCRIPT_SHAS:
+                await conn.execute("SCRIPT", "LOAD", script)
+
+    batches = iter(
+        [messages[i:i + 16] for i in range(0, len(messages), 16)]
+    )
+    keys = [markov._make_key("", "\x01")] * 32
+    results = {
+        "learn_many (16 messages)": await timed(
+            lambda: markov.learn_many(next(batches)),
+            len(messages) // 16,
+            args.concurrency,
+        ),
+        "random": await timed(
+            lambda: db.random(keys[0]), args.operations, args.concurrency
+        ),
+        "random_many (32 keys)": await timed(
+            lambda: db.random_many(keys),
+            args.operations // 10,
+            args.concurrency,
+        ),
+        "generate": await timed(
+            markov.generate, args.operations // 10, args.concurrency
+        ),
+        "generate_many (16)": await timed(
+            lambda: markov.generate_many(16),
+            args.operations // 100,
+            args.concurrency,
+        ),
+    }
+    await db.close()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--host", default="localhost")
+    parser.add_argument("--port", type=int, default=6379)
+    parser.add_argument("--db", type=int, default=15)
+    parser.add_argument("--messages", type=int, default=16000)
+    parser.add_argument("--words", type=int, default=20)
+    parser.add_argument("--operations", type=int, default=20000)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--weighted", action="store_true")
+    args = parser.parse_args()
+
+    messages = list(corpus(args.messages, args.words))
+    results = {}
+    for name, connect_string in BACKENDS.items():
+        connect_string = connect_string.format(
+            host=args.host,
+            port=args.port,
+            db=args.db,
+            weighted=int(args.weighted),
+        )
+        results[name] = asyncio.run(run(connect_string, messages, args))
+
+    print("hiredis: {}".format("yes" if HIREDIS_AVAILABLE else "no"))
+    print("{:<26}{:>14}{:>16}{:>9}".format(
+        "ops/sec", "aioredis", "redis.asyncio", "gain"))
+    for operation, legacy in results["aioredis"].items():
+        current = results["redis.asyncio"][operation]
+        print("{:<26}{:>14.0f}{:>16.0f}{:>8.2f}x".format(
+            operation, legacy, current, current / legacy))
+
+
+if __name__ == "__main__":
+    main()
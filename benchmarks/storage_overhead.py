@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+"""Measure the write volume and storage of learning sentences.
+
+Before `_split_message` became a pure tokenizer, learning a message wrote
+each transition twice: once from `_split_message`, under the extra prefix,
+and once more from `learn`, under a key that `generate` never reads. This
+script replays both algorithms over the same synthetic corpus and reports
+the number of writes and stored keys and successors of each.
+
+Usage:
+    python benchmarks/storage_overhead.py [--messages N] [--words N]
+"""
+import argparse
+
+from corpora import corpus
+
+from chattymarkov import ChattyMarkov
+from chattymarkov.database import MemoryDatabase
+
+
+class CountingDatabase(MemoryDatabase):
+    """Memory database counting the writes it receives."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.writes = 0
+
+    def add(self, key, element, count=1):
+        self.writes += 1
+        return super().add(key, element, count)
+
+
+def legacy_learn(markov, msg, extra_prefix):
+    """Learn *msg* the way `ChattyMarkov.learn` used to."""
+    words = msg.split(" ")
+    lastword = ""
+    previous = ""
+    for word in words:
+        state = markov.separator.join([previous, lastword])
+        markov.db.add(markov._make_key(extra_prefix, state), word)
+        markov.db.add(markov._make_key(state, ""), word)
+        previous = lastword
+        lastword = word
+
+
+def measure(learn, messages):
+    """Learn *messages* with *learn*, return the resulting statistics."""
+    markov = ChattyMarkov("memory://")
+    markov.db = CountingDatabase()
+    for msg in messages:
+        learn(markov, msg)
+    successors = sum(len(value) for value in markov.db.db.values())
+    return markov.db.writes, len(markov.db.db), successors
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--messages", type=int, default=10000)
+    parser.add_argument("--words", type=int, default=20)
+    parser.add_argument("--extra-prefix", default="channel")
+    args = parser.parse_args()
+
+    messages = list(corpus(args.messages, args.words))
+    results = {
+        "legacy": measure(
+            lambda markov, msg: legacy_learn(markov, msg, args.extra_prefix),
+            messages,
+        ),
+        "current": measure(
+            lambda markov, msg: markov.learn(msg, args.extra_prefix),
+            messages,
+        ),
+    }
+
+    print("{:<10}{:>12}{:>12}{:>14}".format(
+        "", "writes", "keys", "successors"))
+    for name, (writes, keys, successors) in results.items():
+        print("{:<10}{:>12}{:>12}{:>14}".format(
+            name, writes, keys, successors))
+    legacy, current = results["legacy"][0], results["current"][0]
+    print("writes per message: {:.1f} -> {:.1f} ({:.0%})".format(
+        legacy / args.messages, current / args.messages, current / legacy))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,249 @@
+#!/usr/bin/env python3
+"""Benchmark learning and generating sentences on every database.
+
+Each database learns the same synthetic corpus, made of sentences of words
+drawn from a Zipfian vocabulary, one message at a time, then generates
+sentences out of it. Every backend runs in its own process, so that the peak
+resident set size reported for it is its own. For each operation, the suite
+reports the number of operations per second along with the median and 99th
+percentile latencies.
+
+Redis databases run on fakeredis unless ``--redis HOST:PORT`` is given, in
+which case the database given by ``;db=N`` (15 by default) of that server is
+flushed and used.
+
+Results may be exported as JSON with ``--output``, and compared to
+previously exported ones with ``--compare``, which exits with status 1 if
+any operation got slower than ``--tolerance`` allows.
+
+Usage:
+    python benchmarks/suite.py [--messages N] [--words N] [--vocabulary N]
+        [--zipf S] [--generate N] [--backends NAME...] [--redis ADDRESS]
+        [--output FILE] [--compare FILE] [--tolerance RATIO]
+"""
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import resource
+import sys
+import tempfile
+import time
+
+from corpora import corpus
+
+from chattymarkov import ChattyMarkov, ChattyMarkovAsync
+
+
+try:
+    import fakeredis
+except ImportError:
+    fakeredis = None
+
+
+BACKENDS = (
+    "memory",
+    "memory_async",
+    "compact",
+    "json",
+    "sqlite",
+    "redis",
+    "redis_async",
+)
+ASYNC_BACKENDS = ("memory_async", "redis_async")
+
+
+def percentile(latencies, ratio):
+    """Return the *ratio* percentile of sorted *latencies*."""
+    return latencies[min(len(latencies) - 1, int(len(latencies) * ratio))]
+
+
+def summarize(latencies):
+    """Summarize the *latencies* of an operation, in seconds."""
+    latencies = sorted(latencies)
+    return {
+        "operations": len(latencies),
+        "ops_per_sec": len(latencies) / sum(latencies),
+        "p50_us": percentile(latencies, 0.50) * 1e6,
+        "p99_us": percentile(latencies, 0.99) * 1e6,
+    }
+
+
+def measure(operation, arguments):
+    """Call *operation* with each of *arguments*, return its latencies."""
+    latencies = []
+    clock = time.perf_counter
+    for argument in arguments:
+        start = clock()
+        operation(argument)
+        latencies.append(clock() - start)
+    return latencies
+
+
+async def measure_async(operation, arguments):
+    """Await *operation* with each of *arguments*, return its latencies."""
+    latencies = []
+    clock = time.perf_counter
+    for argument in arguments:
+        start = clock()
+        await operation(argument)
+        latencies.append(clock() - start)
+    return latencies
+
+
+def connect_string(backend, directory, redis_address):
+    """Return the connection string of *backend*."""
+    if backend == "json":
+        return "json://{}".format(os.path.join(directory, "model.json"))
+    if backend == "sqlite":
+        return "sqlite://{}".format(os.path.join(directory, "model.db"))
+    if backend in ("redis", "redis_async"):
+        address = redis_address or "localhost"
+        if ";db=" not in address:
+            address += ";db=15"
+        return "{}://{}".format(backend, address)
+    return "{}://".format(backend)
+
+
+def run_sync(markov, messages, generations):
+    """Benchmark a `ChattyMarkov` instance."""
+    results = {"learn": summarize(measure(markov.learn, messages))}
+    results["generate"] = summarize(
+        measure(lambda _: markov.generate(), range(generations))
+    )
+    return results
+
+
+async def run_async(markov, messages, generations, flush=False):
+    """Benchmark a `ChattyMarkovAsync` instance."""
+    await markov.connect()
+    if flush:
+        await markov.db.handle.flushdb()
+    results = {"learn": summarize(await measure_async(markov.learn, messages))}
+    results["generate"] = summarize(
+        await measure_async(lambda _: markov.generate(), range(generations))
+    )
+    return results
+
+
+def run_backend(backend, args, queue):
+    """Benchmark *backend*, in a child process, and queue its results."""
+    messages = list(
+        corpus(args.messages, args.words, args.vocabulary, args.zipf)
+    )
+    with tempfile.TemporaryDirectory() as directory:
+        is_async = backend in ASYNC_BACKENDS
+        cls = ChattyMarkovAsync if is_async else ChattyMarkov
+        markov = cls(connect_string(backend, directory, args.redis))
+
+        flush = backend.startswith("redis") and args.redis is not None
+        if backend.startswith("redis") and not flush:
+            markov.db.handle = (
+                fakeredis.FakeAsyncRedis()
+                if is_async
+                else fakeredis.FakeStrictRedis()
+            )
+
+        if is_async:
+            results = asyncio.run(
+                run_async(markov, messages, args.generate, flush)
+            )
+        else:
+            if flush:
+                markov.db.handle.flushdb()
+            results = run_sync(markov, messages, args.generate)
+            if hasattr(markov.db, "cleanup"):
+                start = time.perf_counter()
+                markov.db.cleanup()
+                results["store"] = {"seconds": time.perf_counter() - start}
+
+    # ru_maxrss is in kilobytes on Linux, and in bytes on macOS.
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform != "darwin":
+        rss *= 1024
+    results["peak_rss_mb"] = rss / 1024 / 1024
+    queue.put(results)
+
+
+def compare(results, baseline, tolerance):
+    """Print the operations slower than in *baseline*.
+
+    Returns:
+        True if none of them got slower than *tolerance* allows.
+    """
+    ok = True
+    for backend, operations in results.items():
+        for operation, stats in operations.items():
+            if not isinstance(stats, dict) or "ops_per_sec" not in stats:
+                continue
+            try:
+                before = baseline[backend][operation]["ops_per_sec"]
+            except (KeyError, TypeError):
+                continue
+            ratio = stats["ops_per_sec"] / before
+            if ratio < 1 - tolerance:
+                ok = False
+                print("REGRESSION {} {}: {:.0f} -> {:.0f} ops/sec ({:.0%})"
+                      .format(backend, operation, before,
+                              stats["ops_per_sec"], ratio - 1))
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--messages", type=int, default=10000)
+    parser.add_argument("--words", type=int, default=20)
+    parser.add_argument("--vocabulary", type=int, default=5000)
+    parser.add_argument("--zipf", type=float, default=1.0,
+                        help="exponent of the Zipfian distribution of words")
+    parser.add_argument("--generate", type=int, default=2000,
+                        help="number of sentences to generate")
+    parser.add_argument("--backends", nargs="+", choices=BACKENDS,
+                        default=BACKENDS)
+    parser.add_argument("--redis", metavar="ADDRESS",
+                        help="redis server to use instead of fakeredis")
+    parser.add_argument("--output", help="file to export results to")
+    parser.add_argument("--compare", help="results to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.1,
+                        help="slowdown ratio tolerated by --compare")
+    args = parser.parse_args()
+
+    backends = list(args.backends)
+    if args.redis is None and fakeredis is None:
+        print("fakeredis is not installed, skipping redis databases")
+        backends = [b for b in backends if not b.startswith("redis")]
+
+    results = {}
+    print("{:<14}{:<10}{:>12}{:>10}{:>10}{:>10}".format(
+        "backend", "operation", "ops/sec", "p50 us", "p99 us", "RSS MB"))
+    for backend in backends:
+        queue = multiprocessing.Queue()
+        process = multiprocessing.Process(
+            target=run_backend, args=(backend, args, queue)
+        )
+        process.start()
+        results[backend] = queue.get()
+        process.join()
+        for operation in ("learn", "generate"):
+            stats = results[backend][operation]
+            print("{:<14}{:<10}{:>12.0f}{:>10.1f}{:>10.1f}{:>10.1f}".format(
+                backend, operation, stats["ops_per_sec"], stats["p50_us"],
+                stats["p99_us"], results[backend]["peak_rss_mb"]))
+
+    if args.output:
+        with open(args.output, "w") as stream:
+            json.dump(
+                {"parameters": vars(args), "results": results},
+                stream,
+                indent=2,
+            )
+    if args.compare:
+        with open(args.compare) as stream:
+            baseline = json.load(stream)["results"]
+        if not compare(results, baseline, args.tolerance):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -12,7 +12,8 @@ CLASSIFIERS = [
     'Programming Language :: Python',
     'Topic :: Software Development',
 ]
-INSTALL_REQUIRES = ['aioredis', 'redis']
+INSTALL_REQUIRES = ['aioredis<2', 'redis>=4.2']
+EXTRAS_REQUIRE = {'hiredis': ['hiredis']}
 
 
 PROJECT_DIR = dirname(__file__)
@@ -49,6 +50,10 @@ setup(
     package_dir={'': 'src'},
     packages=find_packages('src'),
     install_requires=INSTALL_REQUIRES,
+    extras_require=EXTRAS_REQUIRE,
     python_requires='>=3.7, <4',
     zip_safe=False,
+    entry_points={
+        'console_scripts': ['chattymarkov = chattymarkov.cli:main'],
+    },
 )
@@ -8,9 +8,161 @@ rely on a database which has to inherit from the abstract interface described
 `chattymarkov.database.AbstractDatabase`.
 
 """
+import asyncio
+import contextlib
+import itertools
+import os
+
 from . import database
 
 
+# Default maximum number of words of a generated sentence.
+MAX_WORDS = 100
+
+# Number of messages read at once from files and iterables by learn_stream.
+READ_CHUNK = 256
+
+
+def _messages(source, encoding):
+    """Iterate over the messages of *source*.
+
+    *source* is either the path of a file, each line of which is a message,
+    or an iterable of messages. Files are read lazily.
+    """
+    if isinstance(source, (str, os.PathLike)):
+        with open(source, encoding=encoding, errors="replace") as stream:
+            for line in stream:
+                yield line.rstrip("\r\n")
+    else:
+        yield from source
+
+
+async def _amessages(source, encoding):
+    """Iterate asynchronously over the messages of *source*.
+
+    Files and iterables are read by chunks of `READ_CHUNK` messages in a
+    thread of the default executor, so that slow reads do not block the
+    event loop.
+
+    See also:
+        `_messages`, which handles the sources other than asynchronous
+        iterables.
+    """
+    if hasattr(source, "__aiter__"):
+        async for msg in source:
+            yield msg
+        return
+    loop = asyncio.get_running_loop()
+    messages = _messages(source, encoding)
+    while True:
+        chunk = await loop.run_in_executor(
+            None, list, itertools.islice(messages, READ_CHUNK)
+        )
+        if not chunk:
+            break
+        for msg in chunk:
+            yield msg
+
+
+def _key_builder(db, separator):
+    """Return a function building the database key of a state.
+
+    States are tuples of words. Databases with a true `tuple_keys` attribute
+    take keys as tuples made of the key prefix followed by the words of the
+    state, which spares building a string at each step. Other databases take
+    the key prefix followed by the words of the state joined by *separator*.
+
+    """
+    if getattr(db, "tuple_keys", False):
+
+        def build_key(prefix, state):
+            return (prefix,) + state
+
+    else:
+
+        def build_key(prefix, state):
+            return prefix + separator.join(state)
+
+    return build_key
+
+
+class _Walks:
+    """Random walks browsing a markov graph in lockstep.
+
+    Each step of the walks needs one random successor per walk still going
+    on, which lets `generate_many` fetch all of them in a single batch.
+
+    Databases without `tuple_keys`, such as memory and JSON ones, store
+    states under string keys, one of which is built per ongoing walk and
+    step. Only `tuple_keys` databases, such as `compact://` ones, spare
+    building them.
+
+    """
+
+    def __init__(self, n, build_key, prefix, order, stop_word):
+        self.build_key = build_key
+        self.prefix = prefix
+        self.stop_word = stop_word
+        self.states = [("",) * order] * n
+        self.sentences = [[] for _ in range(n)]
+        self.ongoing = list(range(n))
+
+    def keys(self):
+        """Return the keys to pick a successor from for ongoing walks."""
+        build_key = self.build_key
+        prefix = self.prefix
+        states = self.states
+        return [build_key(prefix, states[i]) for i in self.ongoing]
+
+    def advance(self, words):
+        """Move ongoing walks forward, given a successor for each of them."""
+        ongoing = []
+        for i, word in zip(self.ongoing, words):
+            if not word or word == self.stop_word:
+                continue
+            self.sentences[i].append(word)
+            self.states[i] = self.states[i][1:] + (word,)
+            ongoing.append(i)
+        self.ongoing = ongoing
+
+
+@contextlib.asynccontextmanager
+async def _no_connection():
+    yield None
+
+
+def _connection(db):
+    """Hold a single connection of *db* across several operations.
+
+    Returns:
+        `db.connection()` for databases providing it, such as redis ones,
+        an asynchronous context manager doing nothing otherwise.
+    """
+    if hasattr(db, "connection"):
+        return db.connection()
+    return _no_connection()
+
+
+def _end(deadline):
+    """Return the time of the event loop *deadline* seconds from now."""
+    if deadline is None:
+        return None
+    return asyncio.get_running_loop().time() + deadline
+
+
+async def _before(awaitable, end):
+    """Await *awaitable* until the *end* time of the event loop.
+
+    Raises:
+        asyncio.TimeoutError: *end* passed, and *awaitable* was cancelled.
+    """
+    if end is None:
+        return await awaitable
+    return await asyncio.wait_for(
+        awaitable, end - asyncio.get_running_loop().time()
+    )
+
+
 class ChattyMarkovAsync:
     """ChattyMarkov, the asyncio way.
 
@@ -25,12 +177,18 @@ class ChattyMarkovAsync:
         prefix="chattymarkov",
         separator="\x01",
         stop_word="\x02",
+        order=2,
     ):
         """Instanciate the ChattyMarkov async class."""
-        self.db = database.build_database_connection(connect_string, True)
+        if order < 1:
+            raise ValueError("The order must be at least 1.")
+        self.db = database.build_database_connection(
+            connect_string, True, separator
+        )
         self.separator = separator
         self.stop_word = stop_word
         self.prefix = prefix
+        self.order = order
 
     async def connect(self) -> None:
         """Wrap call around `self.db.connect`."""
@@ -38,50 +196,211 @@ class ChattyMarkovAsync:
             await self.db.connect()
 
     async def learn(self, msg: str, extra_prefix: str = "") -> None:
-        """Learn from *msg*."""
+        """Learn from *msg*.
+
+        See also:
+            `ChattyMarkov.learn`
+
+        """
         if not msg:
             return
-        async for words in self._split_message(msg, extra_prefix):
-            key = self.separator.join(words[:-1])
-            await self.db.add(self._make_key(key), words[-1])
-
-    async def _split_message(self, msg, extra_prefix):
-        """Split *msg* to better learn from it."""
-        words = msg.split(" ")
-        lastword = ""
-        previous = ""
-        msg += " " + self.stop_word
-
-        for word in words:
-            key = self._make_key(extra_prefix, self.separator.join([previous, lastword]))
-            await self.db.add(key, word)
-            yield [previous, lastword, word]
-            previous = lastword
-            lastword = word
-
-    async def generate(self):
+        await self.db.add_many(self._transitions(msg, extra_prefix))
+
+    async def learn_many(self, messages, extra_prefix="", batch_size=1024):
+        """Learn from several messages, writing them in batches.
+
+        See also:
+            `ChattyMarkov.learn_many`
+
+        """
+        batch = []
+        for msg in messages:
+            if not msg:
+                continue
+            batch.extend(self._transitions(msg, extra_prefix))
+            if len(batch) >= batch_size:
+                await self.db.add_many(batch)
+                batch = []
+        if batch:
+            await self.db.add_many(batch)
+
+    async def learn_stream(
+        self,
+        source,
+        extra_prefix="",
+        batch_size=1024,
+        max_pending=2,
+        encoding="utf-8",
+    ):
+        """Learn from a stream of messages, with bounded memory.
+
+        Messages are read and split into batches of transitions while
+        previous batches are being written to the database. At most
+        *max_pending* batches wait for the database: reading from *source*
+        is suspended until it catches up, so that a fast source never
+        piles up in memory. Files and iterables are read by chunks of
+        `READ_CHUNK` messages in a thread, off the event loop.
+
+        Args:
+            source: an asynchronous iterable of messages, an iterable of
+                messages or the path of a file, each line of which is a
+                message.
+            extra_prefix: an extra prefix to classify the learned sentences.
+            batch_size: the number of transitions to gather before writing
+                them to the database.
+            max_pending: the maximum number of batches waiting to be
+                written.
+            encoding: the encoding of *source* if it is a file.
+
+        See also:
+            `ChattyMarkov.learn_stream`
+
+        """
+        queue = asyncio.Queue(max_pending)
+
+        async def produce():
+            try:
+                batch = []
+                async for msg in _amessages(source, encoding):
+                    if not msg:
+                        continue
+                    batch.extend(self._transitions(msg, extra_prefix))
+                    if len(batch) >= batch_size:
+                        await queue.put((batch, None))
+                        batch = []
+                if batch:
+                    await queue.put((batch, None))
+                await queue.put((None, None))
+            except Exception as error:
+                await queue.put((None, error))
+
+        producer = asyncio.ensure_future(produce())
+        try:
+            while True:
+                batch, error = await queue.get()
+                if error is not None:
+                    raise error
+                if batch is None:
+                    break
+                await self.db.add_many(batch)
+        finally:
+            producer.cancel()
+
+    def _transitions(self, msg, extra_prefix):
+        """Yield the *(key, word)* transitions to store for *msg*."""
+        build_key = _key_builder(self.db, self.separator)
+        prefix = self._make_key(extra_prefix, "")
+        for state, word in self._split_message(msg):
+            yield build_key(prefix, state), word
+
+    def _split_message(self, msg):
+        """Split *msg* into *(state, word)* transitions.
+
+        See also:
+            `ChattyMarkov._split_message`
+
+        """
+        state = ("",) * self.order
+        for word in msg.split(" ") + [self.stop_word]:
+            yield state, word
+            state = state[1:] + (word,)
+
+    async def generate(
+        self, max_words=MAX_WORDS, namespace="", deadline=None
+    ):
         """Generate a message by browsing the database randomly as we
         browse a markov graph, to construct a random sentence from what
         the ChattyMarkov instance has learned so far.
 
+        Args:
+            max_words: the maximum number of words to generate.
+            namespace: the extra prefix of the sentences to generate from.
+            deadline: the number of seconds after which the words generated
+                so far are returned, None to wait for the whole sentence.
+                Databases providing a `walk` method are then browsed one
+                word at a time, so that the sentence may be cut short.
+
+        Databases providing a `connection` method, such as redis ones, lend
+        a single connection to the whole sentence when it is browsed one
+        word at a time.
+
         Returns:
             A string which consists of a random generated sentence.
 
         """
-        lastword = ""
-        previous = ""
+        if hasattr(self.db, "walk") and deadline is None:
+            words = await self.db.walk(
+                self._make_key(namespace, ""),
+                self.separator,
+                self.stop_word,
+                self.order,
+                max_words,
+            )
+            return " ".join(words)
+
+        end = _end(deadline)
+        build_key = _key_builder(self.db, self.separator)
+        prefix = self._make_key(namespace, "")
+        state = ("",) * self.order
         out = []
 
-        while True:
-            key = self._make_key(self.separator.join([previous, lastword]))
-            word = await self.db.random(key)
-            if not word or word == self.stop_word:
-                break
-            out.append(word)
-            previous = lastword
-            lastword = word
+        try:
+            async with _connection(self.db):
+                while len(out) < max_words:
+                    word = await _before(
+                        self.db.random(build_key(prefix, state)), end
+                    )
+                    if not word or word == self.stop_word:
+                        break
+                    out.append(word)
+                    state = state[1:] + (word,)
+        except asyncio.TimeoutError:
+            pass
         return " ".join(out)
 
+    async def generate_many(
+        self, n, max_words=MAX_WORDS, namespace="", deadline=None
+    ):
+        """Generate *n* messages at once.
+
+        Past the *deadline*, in seconds, the words generated so far are
+        returned, as `generate` does.
+
+        See also:
+            `ChattyMarkov.generate_many`
+
+        """
+        if hasattr(self.db, "walk_many") and deadline is None:
+            sentences = await self.db.walk_many(
+                n,
+                self._make_key(namespace, ""),
+                self.separator,
+                self.stop_word,
+                self.order,
+                max_words,
+            )
+            return [" ".join(words) for words in sentences]
+
+        end = _end(deadline)
+        walks = _Walks(
+            n,
+            _key_builder(self.db, self.separator),
+            self._make_key(namespace, ""),
+            self.order,
+            self.stop_word,
+        )
+        try:
+            async with _connection(self.db):
+                for _ in range(max_words):
+                    if not walks.ongoing:
+                        break
+                    walks.advance(
+                        await _before(self.db.random_many(walks.keys()), end)
+                    )
+        except asyncio.TimeoutError:
+            pass
+        return [" ".join(words) for words in walks.sentences]
+
     def _make_key(self, extra_prefix, key):
         """Private method. Generate a key for internal database storage,
         given the *key* parameter.
@@ -115,6 +434,7 @@ class ChattyMarkov:
         prefix="chattymarkov",
         separator="\x01",
         stop_word="\x02",
+        order=2,
     ):
         """Instanciate the ChattyMarkov class.
 
@@ -124,12 +444,21 @@ class ChattyMarkov:
             prefix: a prefix useful in database storage.
             separator: a separator pattern for database storage.
             stop_word: a stop-word pattern for database storage.
+            order: the number of previous words the next word of a sentence
+                depends on. Lower orders need less data to generate varied
+                sentences, higher ones generate more sensible sentences out
+                of big corpora.
 
         """
-        self.db = database.build_database_connection(connect_string)
+        if order < 1:
+            raise ValueError("The order must be at least 1.")
+        self.db = database.build_database_connection(
+            connect_string, separator=separator
+        )
         self.separator = separator
         self.stop_word = stop_word
         self.prefix = prefix
+        self.order = order
 
     def _make_key(self, extra_prefix, key):
         """Private method. Generate a key for internal database storage,
@@ -147,53 +476,196 @@ class ChattyMarkov:
         else:
             return "-".join((self.prefix, key))
 
-    def learn(self, msg, extra_prefix):
+    def learn(self, msg, extra_prefix=""):
         """Learn from a message. This function is called in order to
         memorise a sentence provided through the parameter `msg`.
 
+        The transitions of the message are written at once through the
+        database's `add_many` method.
+
         Args:
             msg: the sentence to learn from.
+            extra_prefix: an extra prefix to classify the learned sentence.
 
         """
         if msg == "":
             return
-        for words in self._split_message(msg, extra_prefix):
-            key = self.separator.join(words[:-1])
-            self.db.add(self._make_key(key), words[-1])
+        self.db.add_many(self._transitions(msg, extra_prefix))
+
+    def learn_many(self, messages, extra_prefix="", batch_size=1024):
+        """Learn from several messages, writing them in batches.
+
+        Transitions are gathered into batches of at most `batch_size` entries
+        which are handed over to the database through `add_many`, so that
+        backends such as redis store a whole batch in a single round trip.
+
+        Args:
+            messages: an iterable of sentences to learn from.
+            extra_prefix: an extra prefix to classify the learned sentences.
+            batch_size: the number of transitions to gather before writing
+                them to the database.
+
+        """
+        batch = []
+        for msg in messages:
+            if not msg:
+                continue
+            batch.extend(self._transitions(msg, extra_prefix))
+            if len(batch) >= batch_size:
+                self.db.add_many(batch)
+                batch = []
+        if batch:
+            self.db.add_many(batch)
+
+    def learn_stream(
+        self, source, extra_prefix="", batch_size=1024, encoding="utf-8"
+    ):
+        """Learn from a stream of messages, with bounded memory.
+
+        Messages are read lazily and written in batches of at most
+        `batch_size` transitions, as `learn_many` does, so that the whole
+        stream is never held in memory.
+
+        Args:
+            source: an iterable of messages, or the path of a file, each
+                line of which is a message.
+            extra_prefix: an extra prefix to classify the learned sentences.
+            batch_size: the number of transitions to gather before writing
+                them to the database.
+            encoding: the encoding of *source* if it is a file.
+
+        """
+        self.learn_many(_messages(source, encoding), extra_prefix, batch_size)
 
-    def generate(self):
+    def generate(self, max_words=MAX_WORDS, namespace=""):
         """Generate a message by browsing the database randomly as we
         browse a markov graph, to construct a random sentence from what
         the ChattyMarkov instance has learned so far.
 
+        Databases providing a `walk` method, such as redis ones, browse the
+        markov graph on their side and return the whole sentence at once.
+
+        Args:
+            max_words: the maximum number of words to generate, which
+                guards against endless loops in the markov graph.
+            namespace: the extra prefix of the sentences to generate from,
+                as given to `learn`. Each namespace is a model of its own.
+
         Returns:
             A string which consists of a random generated sentence.
 
         """
-        lastword = ""
-        previous = ""
+        if hasattr(self.db, "walk"):
+            words = self.db.walk(
+                self._make_key(namespace, ""),
+                self.separator,
+                self.stop_word,
+                self.order,
+                max_words,
+            )
+            return " ".join(words)
+
+        build_key = _key_builder(self.db, self.separator)
+        prefix = self._make_key(namespace, "")
+        state = ("",) * self.order
         out = []
 
-        while True:
-            key = self._make_key(self.separator.join([previous, lastword]))
-            word = self.db.random(key)
+        while len(out) < max_words:
+            word = self.db.random(build_key(prefix, state))
             if not word or word == self.stop_word:
                 break
             out.append(word)
-            previous = lastword
-            lastword = word
+            state = state[1:] + (word,)
         return " ".join(out)
 
-    def _split_message(self, msg, extra_prefix):
-        """Split message to better learn from it."""
-        words = msg.split(" ")
-        lastword = ""
-        previous = ""
-        msg += " " + self.stop_word
-
-        for word in words:
-            key = self._make_key(extra_prefix, self.separator.join([previous, lastword]))
-            self.db.add(key, word)
-            yield [previous, lastword, word]
-            previous = lastword
-            lastword = word
+    def generate_many(self, n, max_words=MAX_WORDS, namespace=""):
+        """Generate *n* messages at once.
+
+        The *n* random walks browse the markov graph in lockstep, so that
+        each step fetches the successors of all of them through a single
+        call to the database's `random_many` method. Databases providing a
+        `walk_many` method, such as redis ones, generate all the messages on
+        their side instead.
+
+        Args:
+            n: the number of messages to generate.
+            max_words: the maximum number of words of each message.
+            namespace: the extra prefix of the sentences to generate from.
+
+        Returns:
+            A list of *n* random generated sentences.
+
+        """
+        if hasattr(self.db, "walk_many"):
+            sentences = self.db.walk_many(
+                n,
+                self._make_key(namespace, ""),
+                self.separator,
+                self.stop_word,
+                self.order,
+                max_words,
+            )
+            return [" ".join(words) for words in sentences]
+
+        walks = _Walks(
+            n,
+            _key_builder(self.db, self.separator),
+            self._make_key(namespace, ""),
+            self.order,
+            self.stop_word,
+        )
+        for _ in range(max_words):
+            if not walks.ongoing:
+                break
+            walks.advance(self.db.random_many(walks.keys()))
+        return [" ".join(words) for words in walks.sentences]
+
+    def freeze(self, extra_prefix=""):
+        """Compile what has been learned so far into a frozen model.
+
+        Frozen models only generate sentences, several times faster than
+        `generate` does, and are not affected by what is learned after
+        they are built.
+
+        Args:
+            extra_prefix: the extra prefix of the sentences to compile.
+
+        Returns:
+            A `chattymarkov.frozen.FrozenModel` instance.
+
+        """
+        from .frozen import freeze
+
+        return freeze(
+            self.db,
+            self._make_key(extra_prefix, ""),
+            self.separator,
+            self.stop_word,
+            self.order,
+        )
+
+    def _split_message(self, msg):
+        """Split message to better learn from it.
+
+        This is a pure tokenizer, which does not touch the database.
+
+        Args:
+            msg: the sentence to split.
+
+        Yields:
+            A *(state, word)* transition for each word of the sentence,
+            followed by the stop word, *state* being the tuple of the `order`
+            words preceding *word*.
+
+        """
+        state = ("",) * self.order
+        for word in msg.split(" ") + [self.stop_word]:
+            yield state, word
+            state = state[1:] + (word,)
+
+    def _transitions(self, msg, extra_prefix):
+        """Yield the *(key, word)* transitions to store for `msg`."""
+        build_key = _key_builder(self.db, self.separator)
+        prefix = self._make_key(extra_prefix, "")
+        for state, word in self._split_message(msg):
+            yield build_key(prefix, state), word
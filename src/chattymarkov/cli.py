@@ -0,0 +1,183 @@
+"""Command line interface of chattymarkov.
+
+Run ``chattymarkov --help``, or ``python -m chattymarkov --help``, to list
+the available commands.
+
+"""
+import argparse
+import atexit
+import contextlib
+import sys
+
+from . import database, dump, training
+
+
+def _store(db):
+    """Store file databases now rather than at exit."""
+    if hasattr(db, "cleanup"):
+        db.cleanup()
+        atexit.unregister(db.cleanup)
+
+
+@contextlib.contextmanager
+def _open(path, mode):
+    """Open *path* in binary *mode*, "-" meaning stdin or stdout."""
+    if path == "-":
+        yield sys.stdin.buffer if "r" in mode else sys.stdout.buffer
+    else:
+        with open(path, mode + "b") as stream:
+            yield stream
+
+
+def _train(args):
+    """Learn from the lines of files in parallel."""
+    db = training.train(
+        args.connect_string,
+        args.paths,
+        extra_prefix=args.extra_prefix,
+        processes=args.processes,
+        merge=args.merge,
+        shard_size=args.shard_size,
+        batch_size=args.batch_size,
+        encoding=args.encoding,
+        prefix=args.prefix,
+        order=args.order,
+    )
+    _store(db)
+
+
+def _dump(args):
+    """Export a database."""
+    db = database.build_database_connection(args.connect_string)
+    with _open(args.output, "w") as stream:
+        dump.dump(db, stream, args.format)
+    if hasattr(db, "cleanup"):
+        # Nothing changed: do not store file databases again at exit.
+        atexit.unregister(db.cleanup)
+
+
+def _load(args):
+    """Import a dump into a database."""
+    db = database.build_database_connection(args.connect_string)
+    with _open(args.input, "r") as stream:
+        dump.load(db, stream, args.merge, args.batch_size)
+    _store(db)
+
+
+def _resp(args):
+    """Convert a dump into redis commands."""
+    with _open(args.input, "r") as source, _open(args.output, "w") as target:
+        dump.to_resp(dump.read(source), target, args.weighted)
+
+
+def get_parser():
+    """Return the argument parser of the command line interface."""
+    parser = argparse.ArgumentParser(prog="chattymarkov")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    train = commands.add_parser(
+        "train",
+        help="learn from the lines of files in parallel",
+        description=(
+            "Learn each line of the given files as a message, using a pool "
+            "of processes, and merge what they learned into a database."
+        ),
+    )
+    train.add_argument(
+        "connect_string", help="connection string of the target database"
+    )
+    train.add_argument("paths", nargs="+", help="files to learn from")
+    train.add_argument(
+        "-j",
+        "--processes",
+        type=int,
+        help="number of worker processes (default: number of CPUs)",
+    )
+    train.add_argument(
+        "--merge",
+        choices=training.MERGE_SEMANTICS,
+        help=(
+            "sum the counts of transitions or add each of them once "
+            "(default: sum for weighted databases, union otherwise)"
+        ),
+    )
+    train.add_argument("--prefix", default="chattymarkov")
+    train.add_argument("--extra-prefix", default="")
+    train.add_argument("--order", type=int, default=2)
+    train.add_argument(
+        "--shard-size",
+        type=int,
+        default=training.SHARD_SIZE,
+        help="size of the shards of input files, in bytes",
+    )
+    train.add_argument("--batch-size", type=int, default=10000)
+    train.add_argument("--encoding", default="utf-8")
+    train.set_defaults(func=_train)
+
+    dump_command = commands.add_parser(
+        "dump",
+        help="export a database",
+        description="Export the whole transition table of a database.",
+    )
+    dump_command.add_argument(
+        "connect_string", help="connection string of the database"
+    )
+    dump_command.add_argument(
+        "-o", "--output", default="-", help="output file (default: stdout)"
+    )
+    dump_command.add_argument(
+        "--format", choices=dump.FORMATS, default=dump.FORMAT_NDJSON
+    )
+    dump_command.set_defaults(func=_dump)
+
+    load = commands.add_parser(
+        "load",
+        help="import a dump into a database",
+        description=(
+            "Import a dump, in either format, into a database, in batches."
+        ),
+    )
+    load.add_argument(
+        "connect_string", help="connection string of the target database"
+    )
+    load.add_argument(
+        "input", nargs="?", default="-", help="dump file (default: stdin)"
+    )
+    load.add_argument(
+        "--merge",
+        choices=training.MERGE_SEMANTICS,
+        help=(
+            "sum the counts of transitions or add each of them once "
+            "(default: sum for weighted databases, union otherwise)"
+        ),
+    )
+    load.add_argument("--batch-size", type=int, default=10000)
+    load.set_defaults(func=_load)
+
+    resp = commands.add_parser(
+        "resp",
+        help="convert a dump into redis commands",
+        description=(
+            "Convert a dump into redis commands, to be loaded with "
+            "redis-cli --pipe."
+        ),
+    )
+    resp.add_argument(
+        "input", nargs="?", default="-", help="dump file (default: stdin)"
+    )
+    resp.add_argument(
+        "-o", "--output", default="-", help="output file (default: stdout)"
+    )
+    resp.add_argument(
+        "--weighted",
+        action="store_true",
+        help="count transitions, for weighted redis databases",
+    )
+    resp.set_defaults(func=_resp)
+    return parser
+
+
+def main(argv=None):
+    """Run the command line interface with *argv*."""
+    args = get_parser().parse_args(argv)
+    args.func(args)
@@ -2,8 +2,77 @@
 
 This submodule gathers all the supported database formats.
 """
+import asyncio
+from urllib.parse import unquote, urlsplit
+
+from .bounded import EVICTION_LRU, BoundedDatabase, BoundedDatabaseAsync
+from .cache import CachedDatabase, CachedDatabaseAsync
+from .coalescing import CoalescingDatabaseAsync
+from .compact import CompactDatabase
 from .databases import (JSONFileDatabase, MemoryDatabase, MemoryDatabaseAsync,
-                        RedisDatabase, RedisDatabaseAsync)
+                        RedisDatabase, RedisDatabaseAsync, Successors,
+                        WeightedSuccessors)
+from .journal import JournaledJSONFileDatabase
+from .mapped import (MappedDatabase, MappedDatabaseError, SharedMappedDatabase,
+                     build_mapped_file, share_mapped_model)
+from .metrics import InstrumentedDatabase, Metrics, get_tracer
+from .redis_asyncio import RedisAsyncioDatabase
+from .sharded import (REPLICAS, HashRing, ShardedRedisDatabase,
+                      ShardedRedisDatabaseAsync)
+from .sqlite import SQLiteDatabase, SQLiteDatabaseAsync
+from .threadsafe import ThreadSafeMemoryDatabase
+
+
+__all__ = [
+    "BoundedDatabase",
+    "BoundedDatabaseAsync",
+    "CachedDatabase",
+    "CachedDatabaseAsync",
+    "ChattymarkovDatabaseError",
+    "CoalescingDatabaseAsync",
+    "CompactDatabase",
+    "EVICTION_LRU",
+    "HashRing",
+    "InstrumentedDatabase",
+    "InvalidConnectionStringError",
+    "JSONFileDatabase",
+    "JournaledJSONFileDatabase",
+    "MappedDatabase",
+    "MappedDatabaseError",
+    "MemoryDatabase",
+    "MemoryDatabaseAsync",
+    "Metrics",
+    "REPLICAS",
+    "RedisAsyncioDatabase",
+    "RedisDatabase",
+    "RedisDatabaseAsync",
+    "SQLiteDatabase",
+    "SQLiteDatabaseAsync",
+    "ShardedRedisDatabase",
+    "ShardedRedisDatabaseAsync",
+    "SharedMappedDatabase",
+    "Successors",
+    "ThreadSafeMemoryDatabase",
+    "UnknownDatabasePrefixError",
+    "WeightedSuccessors",
+    "build_aioredis_database",
+    "build_async_memory_database",
+    "build_compact_database",
+    "build_database_connection",
+    "build_json_database",
+    "build_mapped_database",
+    "build_mapped_file",
+    "build_memory_database",
+    "build_redis_database",
+    "build_redis_database_async",
+    "build_sharded_redis_database",
+    "build_shared_mapped_database",
+    "build_sqlite_database",
+    "database",
+    "get_database_builder",
+    "get_tracer",
+    "share_mapped_model",
+]
 
 
 class ChattymarkovDatabaseError(Exception):
@@ -20,6 +89,16 @@ class InvalidConnectionStringError(ChattymarkovDatabaseError):
 
 _DATABASE_PREFIXES = {}
 
+# Connection pool parameters of the asynchronous redis databases.
+_REDIS_POOL_PARAMS = {
+    "pool_min": int,
+    "pool_max": int,
+    "connect_timeout": float,
+    "pool_timeout": float,
+    "pool_idle": float,
+    "health_check_interval": float,
+}
+
 
 def database(prefix):
     """Wrap a function responsible for building a database."""
@@ -62,9 +141,33 @@ def _get_connection_params(resource):
         return args[0], []
 
 
+def _parse_bool(value):
+    """Parse a boolean connection parameter."""
+    return value.lower() in ("1", "true", "yes", "on")
+
+
+def _get_extra_params(params, whitelist):
+    """Parse the `params` of a connection string.
+
+    Args:
+        params (list): the "key=value" parameters of the connection string.
+        whitelist (dict): the accepted keys, mapped to a function converting
+            their value. Other keys are ignored.
+
+    Returns:
+        dict: the converted values of the accepted parameters.
+    """
+    extra_params = {}
+    for param in params:
+        key, equal, value = param.partition("=")
+        if key in whitelist:
+            extra_params[key] = whitelist[key](value)
+    return extra_params
+
+
 @database("redis_async")
 def build_redis_database_async(resource: str, *args, **kwargs):
-    """Build a `RedisDatabaseAsync` instance to communicate with a redis
+    """Build a `RedisAsyncioDatabase` instance to communicate with a redis
     server.
 
     See also:
@@ -74,49 +177,121 @@ def build_redis_database_async(resource: str, *args, **kwargs):
     return build_redis_database(resource, True)
 
 
+@database("aioredis")
+def build_aioredis_database(resource: str, *args, **kwargs):
+    """Build a legacy `RedisDatabaseAsync` instance, relying on aioredis, to
+    communicate with a redis server.
+
+    Its connection pool is set up with the "pool_min", "pool_max",
+    "connect_timeout", "pool_timeout", "pool_idle" and
+    "health_check_interval" parameters.
+
+    See also:
+        `build_redis_database`
+
+    """
+    return _build_redis_database(
+        RedisDatabaseAsync, resource, _REDIS_POOL_PARAMS
+    )
+
+
 @database("redis")
 def build_redis_database(
     resource: str, is_async: bool = False, *args, **kwargs
 ):
-    """Build a `RedisDatabase` or a `RedisDatabaseAsync` instance to
+    """Build a `RedisDatabase` or a `RedisAsyncioDatabase` instance to
     communicate with a redis server.
 
+    The resource is either the path of a unix socket or a
+    "[:password@]host[:port][/db]" address, followed by the "db",
+    "password" and "weighted" parameters. The connection pool of
+    `RedisAsyncioDatabase` instances is set up with the "pool_min",
+    "pool_max", "connect_timeout", "pool_timeout", "pool_idle" and
+    "health_check_interval" parameters, as the one of the legacy
+    `RedisDatabaseAsync` is.
+
     Args:
         resource (str): a string that represents connection information.
-        is_async (bool): True to build a `RedisDatabaseAsync` instance,
+        is_async (bool): True to build a `RedisAsyncioDatabase` instance,
             False to build a `RedisDatabase` instance.
 
     Returns:
         An instance to communicate with the redis server.
     """
-    whitelist = {"db"}
-    extra_params = {}
+    if not is_async:
+        return _build_redis_database(RedisDatabase, resource, {})
+    return _build_redis_database(
+        RedisAsyncioDatabase, resource, _REDIS_POOL_PARAMS
+    )
+
+
+@database("redis_cluster")
+def build_sharded_redis_database(
+    resource: str, is_async: bool = False, *args, **kwargs
+):
+    """Build a `ShardedRedisDatabase` or a `ShardedRedisDatabaseAsync`
+    instance to communicate with several redis servers.
+
+    The resource is a comma separated list of redis servers, each of them
+    being either the path of a unix socket or a "host[:port]" address (e.g.
+    "redis_cluster://host1:6379,host2:6379;weighted=1"). Parameters apply
+    to every server (see `build_redis_database`), and "replicas" sets the
+    number of points of each server on the hash ring.
 
+    Raises:
+        InvalidConnectionStringError: no server is given.
+
+    Returns:
+        An instance to communicate with the redis servers.
+    """
     connection, params = _get_connection_params(resource)
+    replicas = _get_extra_params(params, {"replicas": int}).get(
+        "replicas", REPLICAS
+    )
+    addresses = [address for address in connection.split(",") if address]
+    if not addresses:
+        raise InvalidConnectionStringError(
+            "No redis server in '{}'.".format(resource)
+        )
+    nodes = [
+        build_redis_database(";".join([address] + params), is_async)
+        for address in addresses
+    ]
+    cls = ShardedRedisDatabaseAsync if is_async else ShardedRedisDatabase
+    return cls(nodes, addresses, replicas)
+
+
+def _build_redis_database(cls, resource, whitelist):
+    """Build a *cls* instance out of a redis connection *resource*.
 
-    # Parse additional parameters, if any
-    if len(params) > 0:
-        for param in params:
-            key, equal, value = param.partition("=")
-            if key in whitelist:
-                extra_params[key] = value
+    Args:
+        cls: the class of the redis database to build.
+        resource (str): a string that represents connection information.
+        whitelist (dict): the parameters accepted by *cls* along with the
+            common "db", "password" and "weighted" ones.
+
+    Returns:
+        An instance to communicate with the redis server.
+    """
+    whitelist = dict(whitelist, db=int, password=str, weighted=_parse_bool)
+    connection, params = _get_connection_params(resource)
+    extra_params = _get_extra_params(params, whitelist)
 
     if connection.startswith("/"):
         # UNIX socket connection
-        if is_async:
-            return RedisDatabaseAsync(
-                unix_socket_path=connection, **extra_params
-            )
-        else:
-            return RedisDatabase(unix_socket_path=connection, **extra_params)
+        return cls(unix_socket_path=connection, **extra_params)
     else:
-        # It's a normal connection string.
-        if is_async:
-            return RedisDatabaseAsync(
-                url=f"redis://{connection}", **extra_params
-            )
-        else:
-            return RedisDatabase(url=f"redis://{connection}", **extra_params)
+        # It's a normal connection string, or a URL without its scheme.
+        url = urlsplit(f"redis://{connection}")
+        url_params = {"host": url.hostname or "localhost"}
+        if url.port is not None:
+            url_params["port"] = url.port
+        if url.password is not None:
+            url_params["password"] = unquote(url.password)
+        if url.path.strip("/"):
+            url_params["db"] = int(url.path.strip("/"))
+        url_params.update(extra_params)
+        return cls(**url_params)
 
 
 @database("memory")
@@ -125,13 +300,24 @@ def build_memory_database(resource, *args, **kwargs):
 
     Args:
         resource (str): path to the memory location. It has actually no sense
-            at that time. Should be "memory://" anyway.
+            at that time. Should be "memory://" anyway, possibly followed by
+            parameters (e.g. "memory://;weighted=1"). The "threadsafe=1"
+            parameter builds a `ThreadSafeMemoryDatabase`, which several
+            threads may share, with "stripes" locks.
 
     Returns:
         MemoryDatabase: an instance of MemoryDatabase that handles a
             connection to the desired database.
     """
-    return MemoryDatabase()
+    connection, params = _get_connection_params(resource)
+    extra_params = _get_extra_params(
+        params, {"weighted": _parse_bool, "threadsafe": _parse_bool,
+                 "stripes": int}
+    )
+    if extra_params.pop("threadsafe", False):
+        return ThreadSafeMemoryDatabase(**extra_params)
+    extra_params.pop("stripes", None)
+    return MemoryDatabase(**extra_params)
 
 
 @database("memory_async")
@@ -147,7 +333,55 @@ def build_async_memory_database(resource, *args, **kwargs):
             connection to the desired database.
 
     """
-    return MemoryDatabaseAsync()
+    connection, params = _get_connection_params(resource)
+    return MemoryDatabaseAsync(
+        **_get_extra_params(params, {"weighted": _parse_bool})
+    )
+
+
+@database("compact")
+def build_compact_database(resource, *args, separator="\x01", **kwargs):
+    """Build a `CompactDatabase` instance.
+
+    Args:
+        resource (str): path to the memory location. It has actually no sense
+            at that time. Should be "compact://" anyway.
+        separator (str): the separator joining the words of a state.
+
+    Returns:
+        CompactDatabase: an instance of CompactDatabase that handles a
+            connection to the desired database.
+    """
+    return CompactDatabase(separator=separator)
+
+
+@database("mmap")
+def build_mapped_database(resource, *args, **kwargs):
+    """Build a `MappedDatabase` instance.
+
+    Args:
+        resource (str): path to a model file built by `build_mapped_file`.
+
+    Returns:
+        MappedDatabase: a read-only instance of MappedDatabase serving the
+            model file.
+    """
+    return MappedDatabase(resource)
+
+
+@database("shm")
+def build_shared_mapped_database(resource, *args, **kwargs):
+    """Build a `SharedMappedDatabase` instance.
+
+    Args:
+        resource (str): name of a shared memory segment built by
+            `share_mapped_model`.
+
+    Returns:
+        SharedMappedDatabase: a read-only instance of SharedMappedDatabase
+            serving the shared model.
+    """
+    return SharedMappedDatabase(resource)
 
 
 @database("json")
@@ -158,20 +392,81 @@ def build_json_database(resource, *args, **kwargs):
         resource (str): path to the JSON file representing the database. If
             the file is not empty, it will be loaded. In every cases, upon
             instance destruction, the database will be stored in the specified
-            file.
+            file. With the "journal=1" parameter, changes are also appended
+            to a journal as they happen (see `JournaledJSONFileDatabase` for
+            the "fsync", "fsync_interval", "flush_interval", "compact_size"
+            and "compact_interval" parameters).
 
     Returns:
         JSONFileDatabase: an instance of JSONFileDatabase that handles a
             connection to the desired database.
     """
-    return JSONFileDatabase(resource)
+    whitelist = {
+        "weighted": _parse_bool,
+        "journal": _parse_bool,
+        "fsync": str,
+        "fsync_interval": float,
+        "flush_interval": float,
+        "compact_size": int,
+        "compact_interval": float,
+    }
+
+    connection, params = _get_connection_params(resource)
+    extra_params = _get_extra_params(params, whitelist)
+    if extra_params.pop("journal", False):
+        return JournaledJSONFileDatabase(connection, **extra_params)
+    return JSONFileDatabase(
+        connection, weighted=extra_params.get("weighted", False)
+    )
+
+
+@database("sqlite")
+def build_sqlite_database(resource, is_async=False, *args, **kwargs):
+    """Build a `SQLiteDatabase` or a `SQLiteDatabaseAsync` instance.
+
+    Args:
+        resource (str): path to the SQLite file, created if needed (e.g.
+            "sqlite:///var/lib/bot/model.db"), followed by the "weighted"
+            and "timeout" parameters.
+        is_async (bool): True to build a `SQLiteDatabaseAsync` instance.
+
+    Returns:
+        An instance of SQLiteDatabase or SQLiteDatabaseAsync handling the
+            SQLite file.
+    """
+    connection, params = _get_connection_params(resource)
+    extra_params = _get_extra_params(
+        params, {"weighted": _parse_bool, "timeout": float}
+    )
+    cls = SQLiteDatabaseAsync if is_async else SQLiteDatabase
+    return cls(connection, **extra_params)
 
 
-def build_database_connection(connect_string, is_async: bool = False):
+def build_database_connection(
+    connect_string, is_async: bool = False, separator: str = "\x01"
+):
     """Build a database connection based on *connect_string*.
 
+    Whatever the database, the "cache_size" and "cache_ttl" parameters put a
+    client-side cache of at most "cache_size" successors, of keys read twice
+    within "cache_ttl" seconds (60 by default) and kept as long, in front of
+    it (see `CachedDatabase`). The "max_states"
+    and "max_successors" parameters cap the number of states of each
+    namespace and the number of successors of each state, evicting states
+    according to the "eviction" policy, "lru" or "lfu", and splitting keys
+    on the percent-encoded "separator" parameter (see `BoundedDatabase`).
+    Asynchronous databases coalesce concurrent lookups
+    of the same key into a single call with the "coalesce=1" parameter, and
+    keep at most "max_inflight" calls in flight at once (see
+    `CoalescingDatabaseAsync`). The "metrics=1" parameter records metrics
+    of its calls in its `metrics` attribute, and "tracing=1" records an
+    OpenTelemetry span per call (see `InstrumentedDatabase`).
+
     Args:
         connect_string (str): connection string for the database connection.
+        is_async (bool): True to build an asynchronous database.
+        separator (str): the separator joining the words of a state, unless
+            the connection string sets one.
 
     Raises:
         InvalidConnectionStringError: raised when the `connect_string` is
@@ -183,13 +478,62 @@ def build_database_connection(connect_string, is_async: bool = False):
             connection to the desired database.
     """
     prefix, colon_slash_slash, resource = connect_string.partition("://")
-    if colon_slash_slash != "":
-        builder = get_database_builder(prefix)
-        return builder(resource, is_async)
-    else:
+    if colon_slash_slash == "":
         raise InvalidConnectionStringError(
             "Invalid connection string '{}'. Must be of the form "
             "prefix://[resource[;param1=value1;param2=value2...]]".format(
                 prefix
             )
         )
+
+    connection, params = _get_connection_params(resource)
+    wrapper_params = _get_extra_params(
+        params,
+        {
+            "cache_size": int,
+            "cache_ttl": float,
+            "max_states": int,
+            "max_successors": int,
+            "eviction": str,
+            "separator": unquote,
+            "coalesce": _parse_bool,
+            "max_inflight": int,
+            "metrics": _parse_bool,
+            "tracing": _parse_bool,
+        },
+    )
+    separator = wrapper_params.get("separator", separator)
+    builder = get_database_builder(prefix)
+    db = builder(resource, is_async, separator=separator)
+    is_coroutine = asyncio.iscoroutinefunction(db.random)
+    if is_coroutine and (
+        wrapper_params.get("coalesce") or wrapper_params.get("max_inflight")
+    ):
+        db = CoalescingDatabaseAsync(
+            db,
+            coalesce=wrapper_params.get("coalesce", False),
+            max_inflight=wrapper_params.get("max_inflight", 0),
+        )
+    if "cache_size" in wrapper_params:
+        cache = CachedDatabaseAsync if is_coroutine else CachedDatabase
+        db = cache(
+            db,
+            maxsize=wrapper_params["cache_size"],
+            ttl=wrapper_params.get("cache_ttl", 60.0),
+        )
+    if wrapper_params.get("max_states") or wrapper_params.get(
+        "max_successors"
+    ):
+        bounded = BoundedDatabaseAsync if is_coroutine else BoundedDatabase
+        db = bounded(
+            db,
+            max_states=wrapper_params.get("max_states", 0),
+            max_successors=wrapper_params.get("max_successors", 0),
+            eviction=wrapper_params.get("eviction", EVICTION_LRU),
+            separator=separator,
+        )
+    if wrapper_params.get("tracing"):
+        db = InstrumentedDatabase(db, tracer=get_tracer())
+    elif wrapper_params.get("metrics"):
+        db = InstrumentedDatabase(db)
+    return db
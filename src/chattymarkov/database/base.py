@@ -4,20 +4,118 @@ Each time you want to add some support for a database, you must inherit this
 class.
 
 """
+import heapq
+import random
 
 
 class AbstractDatabase:
     """AbstractDatabase class."""
 
+    # True if keys may be given as tuples made of a prefix followed by the
+    # words of a state, rather than as strings.
+    tuple_keys = False
+
     def __init__(self, *args, **kwargs):
         pass
 
-    def add(self, key, element):
-        """Add an entry into the database."""
+    def add(self, key, element, count=1):
+        """Add an entry into the database.
+
+        Weighted databases count how many times each entry has been added,
+        *count* being the number of times to add it at once. Other databases
+        ignore it.
+
+        """
+
+    def add_many(self, items):
+        """Add several *(key, element)* entries into the database at once.
+
+        Backends able to batch their writes should override this method. The
+        default implementation simply calls `add` for each entry.
+
+        Args:
+            items: an iterable of *(key, element)* pairs, or of *(key,
+                element, count)* triples to add entries several times at
+                once, as `add` does.
+
+        """
+        for item in items:
+            self.add(*item)
 
     def random(self, key):
         """Pick up a random entry from the *key* subset into the database."""
 
+    def random_many(self, keys):
+        """Pick up a random entry from each of the *keys* subsets at once.
+
+        Backends able to batch their reads should override this method. The
+        default implementation simply calls `random` for each key.
+
+        Args:
+            keys: a list of keys.
+
+        Returns:
+            A list holding a random entry, or None, for each key.
+
+        """
+        return [self.random(key) for key in keys]
+
+    def members(self, key):
+        """Get all the entries of the *key* subset into the database.
+
+        Returns:
+            A dict mapping each entry to the number of times it has been
+            added (always 1 for unweighted databases), empty if *key* has no
+            entries.
+
+        """
+
+    def scan(self):
+        """Iterate over the whole database.
+
+        Yields:
+            A *(key, successors)* pair for each key having successors,
+            *successors* being a dict which maps each of them to the number
+            of times it has been added (always 1 for unweighted databases).
+
+        """
+        raise NotImplementedError
+
+    def delete(self, keys):
+        """Delete the *keys* subsets, along with all their entries."""
+        raise NotImplementedError
+
+    def trim(self, keys, max_successors):
+        """Keep at most *max_successors* entries in each of the *keys* subsets.
+
+        Weighted databases remove the entries added the least times first,
+        other databases remove random entries.
+
+        The default implementation reads the entries of each subset through
+        `members`, then deletes the subsets too large and adds their kept
+        entries back. Backends able to trim subsets in place should
+        override it.
+
+        Returns:
+            The number of removed entries.
+
+        """
+        removed = 0
+        for key in keys:
+            counts = self.members(key) or {}
+            if len(counts) <= max_successors:
+                continue
+            if getattr(self, "weighted", False):
+                kept = heapq.nlargest(max_successors, counts, key=counts.get)
+            else:
+                kept = random.sample(list(counts), max_successors)
+            self.delete([key])
+            self.add_many(
+                [(key, element, counts[element]) for element in kept]
+            )
+            removed += len(counts) - max_successors
+        return removed
+
     def get(self, key, default=None):
         """Get the value associated to *key* into the database."""
 
@@ -0,0 +1,464 @@
+"""Per-namespace memory limits for chattymarkov databases.
+
+Sentences learned with an extra prefix, such as the name of a chat channel,
+live in their own namespace of keys. Without limits, each namespace grows
+with every message it learns. `BoundedDatabase` and `BoundedDatabaseAsync`
+wrap another database and cap each namespace to a number of states, evicting
+the least recently or the least frequently used ones, and each state to a
+number of successors, so that thousands of namespaces may share one process
+or one redis server with predictable memory.
+
+Usage is tracked by the wrapper, in the memory of the process: keys learned
+before it started, or through other clients, are only accounted for once
+they are used through it.
+
+"""
+import functools
+import inspect
+from collections import OrderedDict
+
+from .base import AbstractDatabase
+
+
+# Eviction policies of bounded databases.
+EVICTION_LRU = "lru"
+EVICTION_LFU = "lfu"
+EVICTION_POLICIES = (EVICTION_LRU, EVICTION_LFU)
+
+# Number of uses per state of a namespace after which the uses of its states
+# are halved by the LFU policy.
+LFU_AGING = 10
+
+
+class _LRU:
+    """Keys of a namespace, in least recently used order."""
+
+    def __init__(self):
+        self._keys = OrderedDict()
+
+    def touch(self, key):
+        """Record a use of *key*."""
+        if key in self._keys:
+            self._keys.move_to_end(key)
+        else:
+            self._keys[key] = None
+
+    def pop(self):
+        """Forget about the least recently used key and return it."""
+        return self._keys.popitem(last=False)[0]
+
+    def __len__(self):
+        return len(self._keys)
+
+
+class _LFU:
+    """Keys of a namespace, in least frequently used order.
+
+    Keys are grouped in buckets by number of uses, each bucket being in
+    least recently used order, so that uses and evictions take constant
+    time. Ties are broken in favour of the most recently used keys.
+
+    Every *window* uses, the uses of all keys are halved, so that keys
+    which were used a lot a long time ago do not outlive the keys used
+    lately. The key used last is only popped if it is the only one, so that
+    a new key is not evicted before it may be used again.
+
+    Args:
+        window: the number of uses after which uses are halved, 0 to never
+            halve them.
+
+    """
+
+    def __init__(self, window=0):
+        self.window = window
+        self._uses = {}
+        self._buckets = {}
+        self._min_uses = 0
+        self._last = None
+        self._touches = 0
+
+    def touch(self, key):
+        """Record a use of *key*."""
+        uses = self._uses.get(key, 0)
+        if uses:
+            bucket = self._buckets[uses]
+            del bucket[key]
+            if not bucket:
+                del self._buckets[uses]
+                if self._min_uses == uses:
+                    self._min_uses = uses + 1
+        else:
+            self._min_uses = 1
+        self._uses[key] = uses + 1
+        self._buckets.setdefault(uses + 1, OrderedDict())[key] = None
+        self._last = key
+        self._touches += 1
+        if self.window and self._touches >= self.window:
+            self._age()
+
+    def _age(self):
+        """Halve the uses of every key."""
+        buckets = {}
+        # Keys merged into the same bucket keep their order of uses.
+        for uses in sorted(self._buckets):
+            halved = (uses + 1) // 2
+            bucket = buckets.setdefault(halved, OrderedDict())
+            for key in self._buckets[uses]:
+                bucket[key] = None
+                self._uses[key] = halved
+        self._buckets = buckets
+        self._min_uses = min(buckets, default=0)
+        self._touches = 0
+
+    def pop(self):
+        """Forget about the least frequently used key and return it."""
+        uses = self._min_uses
+        bucket = self._buckets[uses]
+        if len(bucket) == 1 and self._last in bucket and len(self._uses) > 1:
+            uses = min(other for other in self._buckets if other != uses)
+            bucket = self._buckets[uses]
+        key = bucket.popitem(last=False)[0]
+        del self._uses[key]
+        if not bucket:
+            del self._buckets[uses]
+            if uses == self._min_uses:
+                self._min_uses = min(self._buckets, default=0)
+        return key
+
+    def __len__(self):
+        return len(self._uses)
+
+
+class _Bounded:
+    """Usage tracking shared by the bounded databases."""
+
+    # Keys are taken as tuples, so that namespaces are known for sure.
+    tuple_keys = True
+
+    def __init__(
+        self,
+        database,
+        max_states=0,
+        max_successors=0,
+        eviction=EVICTION_LRU,
+        separator="\x01",
+    ):
+        if eviction not in EVICTION_POLICIES:
+            raise ValueError("Unknown eviction policy '{}'.".format(eviction))
+        self.database = database
+        self.max_states = max_states
+        self.max_successors = max_successors
+        self.eviction = eviction
+        self.separator = separator
+        if eviction == EVICTION_LRU:
+            self._usage = _LRU
+        else:
+            self._usage = functools.partial(_LFU, LFU_AGING * max_states)
+        self._namespaces = {}
+        self._evicted = []
+        self._evictions = 0
+        self._trimmed = 0
+
+    @property
+    def weighted(self):
+        return getattr(self.database, "weighted", False)
+
+    def _split(self, key):
+        """Split *key* into its namespace and the key of the database.
+
+        Tuple keys are made of the prefix of their namespace followed by the
+        words of their state. String keys belong to the namespace ending
+        with the last dash before the first separator.
+        """
+        if type(key) is tuple:
+            namespace = key[0]
+            if not getattr(self.database, "tuple_keys", False):
+                key = namespace + self.separator.join(key[1:])
+            return namespace, key
+        namespace, dash, word = key.split(self.separator)[0].rpartition("-")
+        return namespace + dash, key
+
+    def _touch(self, namespace, key):
+        """Record a use of *key* in *namespace*.
+
+        The keys of the namespace beyond *max_states* are forgotten about,
+        and queued for eviction. Uses are not recorded at all without a
+        limit of states.
+        """
+        if not self.max_states:
+            return
+        usage = self._namespaces.get(namespace)
+        if usage is None:
+            usage = self._namespaces[namespace] = self._usage()
+        usage.touch(key)
+        if len(usage) > self.max_states:
+            self._evicted.append(usage.pop())
+
+    def _track_items(self, items):
+        """Record the keys of added *items*.
+
+        Returns:
+            The *items* as the database takes them, along with the list of
+            their distinct keys.
+        """
+        converted = []
+        keys = {}
+        for key, *rest in items:
+            namespace, key = self._split(key)
+            if key not in keys:
+                keys[key] = None
+                self._touch(namespace, key)
+            converted.append((key, *rest))
+        return converted, list(keys)
+
+    def _track_walks(self, prefix, separator, order, sentences):
+        """Record the keys read by walks starting from *prefix*."""
+        if not self.max_states:
+            return
+        tuple_keys = getattr(self.database, "tuple_keys", False)
+        for words in sentences:
+            state = ("",) * order
+            for word in words:
+                if tuple_keys:
+                    key = (prefix,) + state
+                else:
+                    key = prefix + separator.join(state)
+                self._touch(prefix, key)
+                state = state[1:] + (word,)
+
+    def _victims(self):
+        """Return the keys queued for eviction, and empty the queue."""
+        victims, self._evicted = self._evicted, []
+        self._evictions += len(victims)
+        return victims
+
+    def stats(self):
+        """Return the usage statistics of the database.
+
+        Returns:
+            A dict holding the number of tracked *namespaces* and *states*
+            (none without a limit of states), the number of evicted states
+            (*evictions*) and of successors removed beyond the limit
+            (*trimmed*).
+        """
+        return {
+            "namespaces": len(self._namespaces),
+            "states": sum(map(len, self._namespaces.values())),
+            "evictions": self._evictions,
+            "trimmed": self._trimmed,
+        }
+
+
+class BoundedDatabase(_Bounded, AbstractDatabase):
+    """Database wrapper capping the size of each namespace.
+
+    Each time the number of states of a namespace exceeds *max_states*,
+    states are evicted from the wrapped database. Successors added to a
+    state beyond *max_successors* replace the least counted ones for
+    weighted databases, random ones otherwise. The wrapped database must
+    provide `delete` and `trim`.
+
+    Args:
+        database: the database to bound.
+        max_states: the maximum number of states of a namespace, 0 for no
+            limit.
+        max_successors: the maximum number of successors of a state, 0 for
+            no limit.
+        eviction: "lru" to evict the least recently used states first,
+            "lfu" to evict the least frequently used ones first, uses being
+            halved every `LFU_AGING` times *max_states* uses. Learning and
+            generating sentences both use states.
+        separator: the separator joining the words of a state, which must
+            be the one of the `ChattyMarkov` instance. It is set from the
+            "separator" connection string parameter, or from the one of the
+            `ChattyMarkov` instance.
+
+    """
+
+    def __init__(self, database, *args, **kwargs):
+        super().__init__(database, *args, **kwargs)
+        if hasattr(database, "walk"):
+            self.walk = self._walk
+        if hasattr(database, "walk_many"):
+            self.walk_many = self._walk_many
+
+    def _evict(self):
+        """Evict the states beyond the limits from the database."""
+        victims = self._victims()
+        if victims:
+            self.database.delete(victims)
+
+    def add(self, key, element, count=1):
+        namespace, key = self._split(key)
+        self._touch(namespace, key)
+        added = self.database.add(key, element, count)
+        if added and self.max_successors:
+            self._trimmed += self.database.trim([key], self.max_successors)
+        self._evict()
+        return added
+
+    def add_many(self, items):
+        items, keys = self._track_items(items)
+        self.database.add_many(items)
+        if self.max_successors:
+            self._trimmed += self.database.trim(keys, self.max_successors)
+        self._evict()
+
+    def random(self, key):
+        namespace, key = self._split(key)
+        element = self.database.random(key)
+        if element is not None:
+            self._touch(namespace, key)
+            self._evict()
+        return element
+
+    def random_many(self, keys):
+        keys = [self._split(key) for key in keys]
+        elements = self.database.random_many([key for _, key in keys])
+        for (namespace, key), element in zip(keys, elements):
+            if element is not None:
+                self._touch(namespace, key)
+        self._evict()
+        return elements
+
+    def _walk(self, prefix, separator, stop_word, order, max_words):
+        words = self.database.walk(
+            prefix, separator, stop_word, order, max_words
+        )
+        self._track_walks(prefix, separator, order, [words])
+        self._evict()
+        return words
+
+    def _walk_many(self, n, prefix, separator, stop_word, order, max_words):
+        sentences = self.database.walk_many(
+            n, prefix, separator, stop_word, order, max_words
+        )
+        self._track_walks(prefix, separator, order, sentences)
+        self._evict()
+        return sentences
+
+    def members(self, key):
+        return self.database.members(self._split(key)[1])
+
+    def scan(self):
+        return self.database.scan()
+
+    def delete(self, keys):
+        self.database.delete([self._split(key)[1] for key in keys])
+
+    def trim(self, keys, max_successors):
+        return self.database.trim(
+            [self._split(key)[1] for key in keys], max_successors
+        )
+
+    def get(self, key, default=None):
+        return self.database.get(key, default)
+
+    def set(self, key, value):
+        self.database.set(key, value)
+
+
+class BoundedDatabaseAsync(_Bounded):
+    """Asynchronous database wrapper capping the size of each namespace.
+
+    See also:
+        `BoundedDatabase`
+
+    """
+
+    def __init__(self, database, *args, **kwargs):
+        super().__init__(database, *args, **kwargs)
+        if hasattr(database, "walk"):
+            self.walk = self._walk
+        if hasattr(database, "walk_many"):
+            self.walk_many = self._walk_many
+        if hasattr(database, "connection"):
+            self.connection = database.connection
+
+    async def connect(self):
+        """Wrap call around `self.database.connect`."""
+        if hasattr(self.database, "connect"):
+            await self.database.connect()
+
+    async def _evict(self):
+        """Evict the states beyond the limits from the database."""
+        victims = self._victims()
+        if victims:
+            await self.database.delete(victims)
+
+    async def add(self, key, element, count=1):
+        namespace, key = self._split(key)
+        self._touch(namespace, key)
+        added = await self.database.add(key, element, count)
+        if added and self.max_successors:
+            self._trimmed += await self.database.trim(
+                [key], self.max_successors
+            )
+        await self._evict()
+        return added
+
+    async def add_many(self, items):
+        items, keys = self._track_items(items)
+        await self.database.add_many(items)
+        if self.max_successors:
+            self._trimmed += await self.database.trim(
+                keys, self.max_successors
+            )
+        await self._evict()
+
+    async def random(self, key):
+        namespace, key = self._split(key)
+        element = await self.database.random(key)
+        if element is not None:
+            self._touch(namespace, key)
+            await self._evict()
+        return element
+
+    async def random_many(self, keys):
+        keys = [self._split(key) for key in keys]
+        elements = await self.database.random_many([key for _, key in keys])
+        for (namespace, key), element in zip(keys, elements):
+            if element is not None:
+                self._touch(namespace, key)
+        await self._evict()
+        return elements
+
+    async def _walk(self, prefix, separator, stop_word, order, max_words):
+        words = await self.database.walk(
+            prefix, separator, stop_word, order, max_words
+        )
+        self._track_walks(prefix, separator, order, [words])
+        await self._evict()
+        return words
+
+    async def _walk_many(
+        self, n, prefix, separator, stop_word, order, max_words
+    ):
+        sentences = await self.database.walk_many(
+            n, prefix, separator, stop_word, order, max_words
+        )
+        self._track_walks(prefix, separator, order, sentences)
+        await self._evict()
+        return sentences
+
+    async def members(self, key):
+        return await self.database.members(self._split(key)[1])
+
+    async def delete(self, keys):
+        await self.database.delete([self._split(key)[1] for key in keys])
+
+    async def trim(self, keys, max_successors):
+        return await self.database.trim(
+            [self._split(key)[1] for key in keys], max_successors
+        )
+
+    async def get(self, key):
+        value = self.database.get(key)
+        if inspect.isawaitable(value):
+            value = await value
+        return value
+
+    async def set(self, key, value):
+        result = self.database.set(key, value)
+        if inspect.isawaitable(result):
+            await result
@@ -0,0 +1,280 @@
+"""Client-side cache for chattymarkov databases.
+
+Generating sentences reads the same hot keys over and over, such as the one
+starting every sentence. `CachedDatabase` and `CachedDatabaseAsync` wrap
+another database, keep the whole set of successors of recently read keys,
+and pick successors up locally instead of querying the database each time.
+
+Keys read once, such as the long tail of rare states, would only churn the
+cache, each of their misses fetching their whole set of successors: keys are
+only admitted on their second miss within the time to live of the cache,
+first misses picking a successor up from the database as if uncached. The
+cache is bounded by the number of successors it holds overall, rather than
+by its number of keys, since hub states may have thousands of them.
+
+"""
+import inspect
+import time
+from collections import OrderedDict
+
+from .base import AbstractDatabase
+from .databases import Successors, WeightedSuccessors
+
+
+def _successors(members):
+    """Build the successors container of *members*, None if empty."""
+    if not members:
+        return None
+    if any(count != 1 for count in members.values()):
+        return WeightedSuccessors(members)
+    return Successors(members)
+
+
+class _Cache:
+    """Least recently used cache of successors, with a time to live."""
+
+    def __init__(self, maxsize, ttl):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.successors = 0
+        self._entries = OrderedDict()
+        # Keys missed once, mapped to the time of their miss.
+        self._missed = OrderedDict()
+
+    def get(self, key):
+        """Return a *(found, successors)* pair for *key*."""
+        entry = self._entries.get(key)
+        if entry is not None:
+            expires, successors = entry
+            if expires > time.monotonic():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return True, successors
+            self.invalidate(key)
+        self.misses += 1
+        return False, None
+
+    def admit(self, key):
+        """Record a miss of *key*, return True if it is to be cached."""
+        now = time.monotonic()
+        missed = self._missed.pop(key, None)
+        if missed is not None and now - missed < self.ttl:
+            return True
+        self._missed[key] = now
+        while len(self._missed) > self.maxsize:
+            self._missed.popitem(last=False)
+        return False
+
+    def put(self, key, members):
+        """Cache *members* of *key*, return the successors container.
+
+        Keys without successors count as one, and keys having more than
+        *maxsize* successors are not cached at all.
+        """
+        successors = _successors(members)
+        size = _size(successors)
+        if size > self.maxsize:
+            return successors
+        self.invalidate(key)
+        self._entries[key] = (time.monotonic() + self.ttl, successors)
+        self.successors += size
+        while self.successors > self.maxsize:
+            _, (_, evicted) = self._entries.popitem(last=False)
+            self.successors -= _size(evicted)
+            self.evictions += 1
+        return successors
+
+    def invalidate(self, key):
+        """Forget about *key*."""
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.successors -= _size(entry[1])
+
+    def stats(self):
+        """Return the statistics of the cache."""
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "size": len(self._entries),
+            "successors": self.successors,
+        }
+
+
+def _size(successors):
+    """Return the room taken in cache by *successors*."""
+    return 1 if successors is None else len(successors)
+
+
+class CachedDatabase(AbstractDatabase):
+    """Read-through cache in front of a chattymarkov database.
+
+    The successors of keys missed twice within *ttl* seconds are kept for
+    *ttl* seconds, up to *maxsize* successors overall. Keys are evicted in
+    least recently used order, and invalidated when this instance adds
+    successors to them: changes made through other clients show up once the
+    cached entry expires.
+
+    Args:
+        database: the database to cache, which must provide `members`.
+        maxsize: the maximum number of cached successors.
+        ttl: the number of seconds a key stays in cache.
+
+    """
+
+    def __init__(self, database, maxsize=65536, ttl=60.0):
+        self.database = database
+        self._cache = _Cache(maxsize, ttl)
+
+    @property
+    def tuple_keys(self):
+        return getattr(self.database, "tuple_keys", False)
+
+    @property
+    def weighted(self):
+        return getattr(self.database, "weighted", False)
+
+    def add(self, key, element, count=1):
+        self._cache.invalidate(key)
+        return self.database.add(key, element, count)
+
+    def add_many(self, items):
+        items = list(items)
+        for key, *_ in items:
+            self._cache.invalidate(key)
+        self.database.add_many(items)
+
+    def members(self, key):
+        found, successors = self._cache.get(key)
+        if not found:
+            members = self.database.members(key) or {}
+            if self._cache.admit(key):
+                self._cache.put(key, members)
+            return members
+        return {} if successors is None else successors.counts()
+
+    def random(self, key):
+        found, successors = self._cache.get(key)
+        if not found:
+            if not self._cache.admit(key):
+                return self.database.random(key)
+            successors = self._cache.put(key, self.database.members(key))
+        if successors is None:
+            return None
+        return successors.choice()
+
+    def scan(self):
+        return self.database.scan()
+
+    def delete(self, keys):
+        for key in keys:
+            self._cache.invalidate(key)
+        self.database.delete(keys)
+
+    def trim(self, keys, max_successors):
+        for key in keys:
+            self._cache.invalidate(key)
+        return self.database.trim(keys, max_successors)
+
+    def get(self, key, default=None):
+        return self.database.get(key, default)
+
+    def set(self, key, value):
+        self.database.set(key, value)
+
+    def stats(self):
+        """Return the hits, misses, evictions, number of keys (*size*) and
+        of successors of the cache."""
+        return self._cache.stats()
+
+
+class CachedDatabaseAsync:
+    """Read-through cache in front of an asynchronous database.
+
+    See also:
+        `CachedDatabase`
+
+    """
+
+    def __init__(self, database, maxsize=65536, ttl=60.0):
+        self.database = database
+        self._cache = _Cache(maxsize, ttl)
+        if hasattr(database, "connection"):
+            self.connection = database.connection
+
+    @property
+    def tuple_keys(self):
+        return getattr(self.database, "tuple_keys", False)
+
+    @property
+    def weighted(self):
+        return getattr(self.database, "weighted", False)
+
+    async def connect(self):
+        """Wrap call around `self.database.connect`."""
+        if hasattr(self.database, "connect"):
+            await self.database.connect()
+
+    async def add(self, key, element, count=1):
+        added = await self.database.add(key, element, count)
+        self._cache.invalidate(key)
+        return added
+
+    async def add_many(self, items):
+        items = list(items)
+        await self.database.add_many(items)
+        for key, *_ in items:
+            self._cache.invalidate(key)
+
+    async def members(self, key):
+        found, successors = self._cache.get(key)
+        if not found:
+            members = await self.database.members(key) or {}
+            if self._cache.admit(key):
+                self._cache.put(key, members)
+            return members
+        return {} if successors is None else successors.counts()
+
+    async def random(self, key):
+        found, successors = self._cache.get(key)
+        if not found:
+            if not self._cache.admit(key):
+                return await self.database.random(key)
+            members = await self.database.members(key)
+            successors = self._cache.put(key, members)
+        if successors is None:
+            return None
+        return successors.choice()
+
+    async def random_many(self, keys):
+        return [await self.random(key) for key in keys]
+
+    async def delete(self, keys):
+        await self.database.delete(keys)
+        for key in keys:
+            self._cache.invalidate(key)
+
+    async def trim(self, keys, max_successors):
+        removed = await self.database.trim(keys, max_successors)
+        for key in keys:
+            self._cache.invalidate(key)
+        return removed
+
+    async def get(self, key):
+        value = self.database.get(key)
+        if inspect.isawaitable(value):
+            value = await value
+        return value
+
+    async def set(self, key, value):
+        result = self.database.set(key, value)
+        if inspect.isawaitable(result):
+            await result
+
+    def stats(self):
+        """Return the hits, misses, evictions, number of keys (*size*) and
+        of successors of the cache."""
+        return self._cache.stats()
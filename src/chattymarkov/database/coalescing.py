@@ -0,0 +1,232 @@
+"""Request coalescing for asynchronous chattymarkov databases.
+
+Under bursty traffic, many coroutines generate sentences at the same time,
+and look up the same hot states, such as the one starting every sentence,
+at the same moment. `CoalescingDatabaseAsync` wraps an asynchronous
+database and lets concurrent lookups of the same key share a single call
+to the database: lookups of a key made until the event loop gets back to
+the first of them are batched, then answered by a single `random_many`
+call drawing one successor per lookup, so that sentences generated at once
+stay independent of each other. Concurrent random walks with the same
+arguments, which databases such as redis ones run server side to generate
+whole sentences, are batched the same way into a single `walk_many` call.
+Concurrent calls to `members`, such as the fetches of a cache wrapping the
+database, share the call in flight for their key (singleflight).
+
+It may also cap the number of calls to the database in flight at once,
+other calls waiting for one of them to complete, so that a slow database is
+not flooded with retries.
+
+Batched calls run as tasks of their own: a lookup which is cancelled, for
+instance because the deadline of the sentence it belongs to passed, neither
+cancels the call nor the other lookups batched with it.
+
+"""
+import asyncio
+import collections
+import inspect
+import weakref
+
+
+class CoalescingDatabaseAsync:
+    """Request coalescing and concurrency limit for an asynchronous database.
+
+    Args:
+        database: the asynchronous database to wrap.
+        coalesce: True to coalesce concurrent lookups of the same key.
+        max_inflight: the maximum number of calls to the database in flight
+            at once, 0 for no limit.
+
+    """
+
+    def __init__(self, database, coalesce=True, max_inflight=0):
+        self.database = database
+        self.coalesce = coalesce
+        self.max_inflight = max_inflight
+        # Semaphores are bound to the event loop they are used from.
+        self._semaphores = weakref.WeakKeyDictionary()
+        self._flights = {}
+        self._batches = {}
+        self._tasks = set()
+        self._calls = 0
+        self._coalesced = 0
+        if hasattr(database, "walk"):
+            self.walk = self._walk
+        if hasattr(database, "walk_many"):
+            self.walk_many = self._walk_many
+        if hasattr(database, "connection"):
+            self.connection = database.connection
+
+    @property
+    def tuple_keys(self):
+        return getattr(self.database, "tuple_keys", False)
+
+    @property
+    def weighted(self):
+        return getattr(self.database, "weighted", False)
+
+    async def _call(self, method, *args):
+        """Call *method* of the database, within the concurrency limit."""
+        self._calls += 1
+        if not self.max_inflight:
+            return await method(*args)
+        loop = asyncio.get_running_loop()
+        semaphore = self._semaphores.get(loop)
+        if semaphore is None:
+            semaphore = self._semaphores[loop] = asyncio.Semaphore(
+                self.max_inflight
+            )
+        async with semaphore:
+            return await method(*args)
+
+    def _batch(self, fetch, args, n=1):
+        """Return *n* futures answered by the next batch of *fetch(args)*.
+
+        The batch is started if none is pending, and fetched once the event
+        loop gets back to it, along with every lookup which joined it in the
+        meantime.
+        """
+        loop = asyncio.get_running_loop()
+        futures = [loop.create_future() for _ in range(n)]
+        batch = self._batches.get((fetch, args))
+        if batch is None:
+            self._batches[(fetch, args)] = list(futures)
+            task = asyncio.ensure_future(self._flush(fetch, args))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+        else:
+            batch.extend(futures)
+            self._coalesced += n
+        return futures
+
+    async def _flush(self, fetch, args):
+        """Answer the lookups of a batch with a single call."""
+        futures = self._batches.pop((fetch, args))
+        try:
+            results = await fetch(len(futures), *args)
+        except asyncio.CancelledError:
+            for future in futures:
+                future.cancel()
+            raise
+        except Exception as exc:
+            for future in futures:
+                if not future.done():
+                    future.set_exception(exc)
+            return
+        for future, result in zip(futures, results):
+            # Cancelled lookups are skipped.
+            if not future.done():
+                future.set_result(result)
+
+    async def _picks(self, n, key):
+        """Pick up *n* random successors of *key*."""
+        if n == 1:
+            return [await self._call(self.database.random, key)]
+        return await self._call(self.database.random_many, [key] * n)
+
+    async def _walks(self, n, *args):
+        """Generate *n* sentences server side."""
+        if n > 1 and hasattr(self.database, "walk_many"):
+            return await self._call(self.database.walk_many, n, *args)
+        return await asyncio.gather(
+            *(self._call(self.database.walk, *args) for _ in range(n))
+        )
+
+    async def _fetch(self, key):
+        """Fetch the successors of *key*, then let other lookups fetch it."""
+        try:
+            return await self._call(self.database.members, key)
+        finally:
+            del self._flights[key]
+
+    async def connect(self):
+        """Wrap call around `self.database.connect`."""
+        if hasattr(self.database, "connect"):
+            await self.database.connect()
+
+    async def add(self, key, element, count=1):
+        return await self._call(self.database.add, key, element, count)
+
+    async def add_many(self, items):
+        await self._call(self.database.add_many, items)
+
+    async def random(self, key):
+        if not self.coalesce:
+            return await self._call(self.database.random, key)
+        future, = self._batch(self._picks, (key,))
+        return await future
+
+    async def random_many(self, keys):
+        if not self.coalesce:
+            return await self._call(self.database.random_many, keys)
+        # Keys with a pending batch join it, the others are read at once.
+        # Both are awaited together, so that the joined lookups are awaited
+        # even when reading the others fails.
+        joined = {
+            key: self._batch(self._picks, (key,), n)
+            for key, n in collections.Counter(keys).items()
+            if (self._picks, (key,)) in self._batches
+        }
+        others = [key for key in keys if key not in joined]
+        calls = [future for futures in joined.values() for future in futures]
+        if others:
+            calls.append(self._call(self.database.random_many, others))
+        results = await asyncio.gather(*calls)
+        elements = iter(results[-1] if others else ())
+        joined = {key: iter(futures) for key, futures in joined.items()}
+        picked = []
+        for key in keys:
+            if key in joined:
+                picked.append(next(joined[key]).result())
+            else:
+                picked.append(next(elements))
+        return picked
+
+    async def members(self, key):
+        if not self.coalesce:
+            return await self._call(self.database.members, key)
+        flight = self._flights.get(key)
+        if flight is None:
+            flight = self._flights[key] = asyncio.ensure_future(
+                self._fetch(key)
+            )
+        else:
+            self._coalesced += 1
+        return dict(await asyncio.shield(flight))
+
+    async def _walk(self, prefix, separator, stop_word, order, max_words):
+        args = (prefix, separator, stop_word, order, max_words)
+        if not self.coalesce:
+            return await self._call(self.database.walk, *args)
+        future, = self._batch(self._walks, args)
+        return await future
+
+    async def _walk_many(
+        self, n, prefix, separator, stop_word, order, max_words
+    ):
+        args = (prefix, separator, stop_word, order, max_words)
+        if not self.coalesce or (self._walks, args) not in self._batches:
+            return await self._call(self.database.walk_many, n, *args)
+        return list(await asyncio.gather(*self._batch(self._walks, args, n)))
+
+    async def delete(self, keys):
+        await self._call(self.database.delete, keys)
+
+    async def trim(self, keys, max_successors):
+        return await self._call(self.database.trim, keys, max_successors)
+
+    async def get(self, key):
+        value = self.database.get(key)
+        if inspect.isawaitable(value):
+            value = await value
+        return value
+
+    async def set(self, key, value):
+        result = self.database.set(key, value)
+        if inspect.isawaitable(result):
+            await result
+
+    def stats(self):
+        """Return the number of calls to the database and of lookups which
+        shared the call of another one."""
+        return {"calls": self._calls, "coalesced": self._coalesced}
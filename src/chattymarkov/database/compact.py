@@ -0,0 +1,175 @@
+"""Compact in-memory database for chattymarkov.
+
+`MemoryDatabase` keeps every key as a whole string and every successor as a
+separate string object, which costs a lot of memory for big corpora. The
+`CompactDatabase` class interns each word once and refers to it through an
+integer identifier instead.
+
+"""
+import random
+from array import array
+
+from .base import AbstractDatabase
+
+
+# Number of bits used to pack a word identifier into a state.
+_ID_BITS = 32
+
+# Number of successors of a state beyond which their identifiers are indexed
+# by a set, rather than looked up in their array.
+_INDEX_SIZE = 16
+
+
+class CompactDatabase(AbstractDatabase):
+    """Compact memory database class for chattymarkov.
+
+    Keys are split into their prefix, up to the last dash before the first
+    `separator`, and their words, split on `separator`. Keys may also be
+    given already split, as a tuple made of the prefix followed by the words,
+    which spares building and splitting strings. Each part of a key is
+    interned into an integer identifier, and the identifiers are then packed
+    into a single integer, which is used as the state of the markov chain. The
+    successors of a state are stored either as a single identifier or, as
+    soon as there are several of them, as an `array` of identifiers in the
+    order they were added, which keeps additions and random picks constant.
+    Membership checks scan the array of states with few successors, and a
+    set indexing the identifiers of the others.
+
+    Like `MemoryDatabase`, this database is volatile.
+
+    """
+
+    tuple_keys = True
+
+    def __init__(self, separator="\x01", *args, **kwargs):
+        self.separator = separator
+        # Identifier 0 is never used, so that packed states are unambiguous.
+        self._words = [None]
+        self._ids = {}
+        self._states = {}
+        self._indexes = {}
+        self._values = {}
+
+    def _intern(self, word):
+        """Return the identifier of *word*, interning it if needed."""
+        word_id = self._ids.get(word)
+        if word_id is None:
+            word_id = self._ids[word] = len(self._words)
+            self._words.append(word)
+        return word_id
+
+    def _split(self, key):
+        """Split *key* into its prefix followed by its words."""
+        if type(key) is tuple:
+            if len(key) < 2 or "-" not in key[1]:
+                return key
+            # Split it the same way as its string counterpart.
+            key = key[0] + self.separator.join(key[1:])
+        words = key.split(self.separator)
+        prefix, dash, words[0] = words[0].rpartition("-")
+        return [prefix + dash] + words
+
+    def _state(self, key, create=False):
+        """Pack *key* into a state, None if one of its words is unknown."""
+        state = 0
+        for word in self._split(key):
+            word_id = self._intern(word) if create else self._ids.get(word)
+            if word_id is None:
+                return None
+            state = (state << _ID_BITS) | word_id
+        return state
+
+    def add(self, key, element, count=1):
+        state = self._state(key, create=True)
+        element_id = self._intern(element)
+        successors = self._states.get(state)
+        if successors is None:
+            self._states[state] = element_id
+            return True
+        if type(successors) is int:
+            if successors == element_id:
+                return False
+            successors = self._states[state] = array("I", [successors])
+
+        index = self._indexes.get(state)
+        if index is None:
+            if element_id in successors:
+                return False
+            if len(successors) >= _INDEX_SIZE:
+                index = self._indexes[state] = set(successors)
+        elif element_id in index:
+            return False
+        successors.append(element_id)
+        if index is not None:
+            index.add(element_id)
+        return True
+
+    def random(self, key):
+        successors = self._states.get(self._state(key))
+        if successors is None:
+            return None
+        if type(successors) is int:
+            return self._words[successors]
+        return self._words[random.choice(successors)]
+
+    def members(self, key):
+        successors = self._states.get(self._state(key))
+        if successors is None:
+            return {}
+        if type(successors) is int:
+            successors = (successors,)
+        return {self._words[i]: 1 for i in successors}
+
+    def scan(self):
+        mask = (1 << _ID_BITS) - 1
+        for state, successors in self._states.items():
+            ids = []
+            while state:
+                ids.append(state & mask)
+                state >>= _ID_BITS
+            prefix, *words = (self._words[i] for i in reversed(ids))
+            key = prefix + self.separator.join(words)
+            if type(successors) is int:
+                successors = (successors,)
+            yield key, {self._words[i]: 1 for i in successors}
+
+    def delete(self, keys):
+        for key in keys:
+            state = self._state(key)
+            if state is not None:
+                self._states.pop(state, None)
+                self._indexes.pop(state, None)
+
+    def trim(self, keys, max_successors):
+        removed = 0
+        for key in keys:
+            state = self._state(key)
+            successors = self._states.get(state)
+            if successors is None:
+                continue
+            if type(successors) is int:
+                successors = array("I", [successors])
+            excess = len(successors) - max_successors
+            if excess <= 0:
+                continue
+            kept = sorted(
+                random.sample(range(len(successors)), max_successors)
+            )
+            successors = array("I", (successors[i] for i in kept))
+            removed += excess
+            self._indexes.pop(state, None)
+            if not successors:
+                del self._states[state]
+            elif len(successors) == 1:
+                self._states[state] = successors[0]
+            else:
+                self._states[state] = successors
+                if len(successors) > _INDEX_SIZE:
+                    self._indexes[state] = set(successors)
+        return removed
+
+    def get(self, key, default=None):
+        return self._values.get(key, default)
+
+    def set(self, key, value):
+        self._values[key] = value
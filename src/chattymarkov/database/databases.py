@@ -1,8 +1,17 @@
 """Database interfaces for chattimarkov."""
+import asyncio
 import atexit
+import bisect
+import contextlib
+import contextvars
+import hashlib
+import heapq
+import itertools
 import json
 import os.path
 import random
+import time
+import weakref
 
 import aioredis
 import redis
@@ -10,6 +19,335 @@ import redis
 from .base import AbstractDatabase
 
 
+# Weighted databases store the successors of a key in a hash mapping each of
+# them to the number of times it has been learned. Keys having more than
+# _INDEX_MIN successors also get an index, in a hash named after the key
+# followed by _INDEX_SUFFIX, so that picking a successor proportionally to
+# the counts takes O(log n) calls rather than reading all of them. The
+# index numbers successors from 1 in the order they were indexed and holds:
+#
+# - "n": the number of indexed successors,
+# - "i" .. successor: the number of the successor,
+# - "w" .. number: the successor of a number,
+# - "t" .. number: a Fenwick tree of the counts, "t" .. j summing the counts
+#   of the successors numbered from j - lowbit(j) + 1 to j.
+#
+# Learning updates the index of a key in O(log n) if it has one. Indexes are
+# built by picks, and dropped when successors are removed.
+_INDEX_SUFFIX = "\x00index"
+_INDEX_MIN = 64
+
+_LUA_INDEX = """
+local INDEX_SUFFIX = "\\0index"
+local INDEX_MIN = %d
+
+local function lowbit(i)
+    local bit = 1
+    while i %% (bit * 2) == 0 do
+        bit = bit * 2
+    end
+    return bit
+end
+
+-- Add *count* to the count of *word* in the index of *key*, if it has one.
+local function index_add(key, word, count, new)
+    local index = key .. INDEX_SUFFIX
+    local n = tonumber(redis.call("HGET", index, "n"))
+    if not n then
+        return
+    end
+    if not new then
+        local i = tonumber(redis.call("HGET", index, "i" .. word))
+        if not i then
+            -- Out of date: rebuilt by the next pick.
+            redis.call("DEL", index)
+            return
+        end
+        while i <= n do
+            redis.call("HINCRBY", index, "t" .. i, count)
+            i = i + lowbit(i)
+        end
+        return
+    end
+    local i = n + 1
+    local sum = count
+    local j = i - 1
+    while j > i - lowbit(i) do
+        sum = sum + tonumber(redis.call("HGET", index, "t" .. j))
+        j = j - lowbit(j)
+    end
+    redis.call(
+        "HSET", index, "n", i, "i" .. word, i, "w" .. i, word, "t" .. i, sum
+    )
+end
+
+-- Build the index of *key* out of the *counts* of HGETALL.
+local function index_build(key, counts)
+    local index = key .. INDEX_SUFFIX
+    local n = #counts / 2
+    local tree = {}
+    for i = 1, n do
+        tree[i] = tonumber(counts[2 * i])
+    end
+    for i = 1, n do
+        local parent = i + lowbit(i)
+        if parent <= n then
+            tree[parent] = tree[parent] + tree[i]
+        end
+    end
+    redis.call("DEL", index)
+    local fields = {}
+    for i = 1, n do
+        local word = counts[2 * i - 1]
+        fields[#fields + 1] = "i" .. word
+        fields[#fields + 1] = i
+        fields[#fields + 1] = "w" .. i
+        fields[#fields + 1] = word
+        fields[#fields + 1] = "t" .. i
+        fields[#fields + 1] = tree[i]
+        if #fields >= 3000 or i == n then
+            redis.call("HSET", index, unpack(fields))
+            fields = {}
+        end
+    end
+    redis.call("HSET", index, "n", n)
+    return n
+end
+""" % _INDEX_MIN
+
+# Pick up a successor of a key, given a random number in [0, 1) for weighted
+# databases.
+_LUA_PICK = _LUA_INDEX + """
+local function pick(key, weighted, r)
+    if not weighted then
+        return redis.call("SRANDMEMBER", key)
+    end
+    local size = redis.call("HLEN", key)
+    if size == 0 then
+        return false
+    end
+    if size <= INDEX_MIN then
+        local counts = redis.call("HGETALL", key)
+        local total = 0
+        for i = 2, #counts, 2 do
+            total = total + tonumber(counts[i])
+        end
+        local target = r * total
+        for i = 2, #counts, 2 do
+            target = target - tonumber(counts[i])
+            if target < 0 then
+                return counts[i - 1]
+            end
+        end
+        return counts[#counts - 1]
+    end
+
+    local index = key .. INDEX_SUFFIX
+    local n = tonumber(redis.call("HGET", index, "n"))
+    if n ~= size then
+        -- Missing, or out of date after successors were written by
+        -- another client.
+        n = index_build(key, redis.call("HGETALL", key))
+    end
+    local total = 0
+    local i = n
+    while i > 0 do
+        total = total + tonumber(redis.call("HGET", index, "t" .. i))
+        i = i - lowbit(i)
+    end
+    local target = math.floor(r * total)
+    local position = 0
+    local step = 1
+    while step * 2 <= n do
+        step = step * 2
+    end
+    while step >= 1 do
+        local next = position + step
+        if next <= n then
+            local count = tonumber(redis.call("HGET", index, "t" .. next))
+            if count <= target then
+                target = target - count
+                position = next
+            end
+        end
+        step = step / 2
+    end
+    return redis.call("HGET", index, "w" .. (position + 1))
+end
+"""
+
+# KEYS: the key to pick a successor from. ARGV: a random number in [0, 1).
+_PICK_SCRIPT = _LUA_PICK + """
+return pick(KEYS[1], true, tonumber(ARGV[1]))
+"""
+
+# Count successors of weighted databases, keeping indexes up to date.
+#
+# KEYS: the keys to add successors to. ARGV: the successor and its count for
+# each key. Returns the new count of each successor.
+_ADD_SCRIPT = _LUA_INDEX + """
+local counts = {}
+for i, key in ipairs(KEYS) do
+    local word = ARGV[2 * i - 1]
+    local count = tonumber(ARGV[2 * i])
+    counts[i] = redis.call("HINCRBY", key, word, count)
+    index_add(key, word, count, counts[i] == count)
+end
+return counts
+"""
+
+# Maximum number of successors counted by a single run of _ADD_SCRIPT, so
+# that big batches do not block redis for long.
+_ADD_BATCH = 1000
+
+# Walk the markov chain inside redis and return the generated words, so that
+# a whole sentence costs a single round trip.
+#
+# ARGV: key prefix, separator, stop word, chain order, maximum of words,
+# "1" for weighted databases, then one random number in [0, 1) per word for
+# weighted databases.
+_WALK_SCRIPT = _LUA_PICK + """
+local prefix = ARGV[1]
+local separator = ARGV[2]
+local stop_word = ARGV[3]
+local order = tonumber(ARGV[4])
+local max_words = tonumber(ARGV[5])
+local weighted = ARGV[6] == "1"
+local state = {}
+for i = 1, order do
+    state[i] = ""
+end
+local out = {}
+while #out < max_words do
+    local key = prefix .. table.concat(state, separator)
+    local word = pick(key, weighted, tonumber(ARGV[7 + #out]))
+    if not word or word == "" or word == stop_word then
+        break
+    end
+    out[#out + 1] = word
+    table.remove(state, 1)
+    state[order] = word
+end
+return out
+"""
+
+# Remove successors of keys having too many of them: the least counted ones
+# for weighted databases, random ones otherwise.
+#
+# KEYS: the keys to trim. ARGV: the maximum number of successors, "1" for
+# weighted databases. Returns the number of removed successors.
+_TRIM_SCRIPT = """
+local max_successors = tonumber(ARGV[1])
+local weighted = ARGV[2] == "1"
+local removed = 0
+for _, key in ipairs(KEYS) do
+    if weighted then
+        local excess = redis.call("HLEN", key) - max_successors
+        if excess > 0 then
+            local counts = redis.call("HGETALL", key)
+            local entries = {}
+            for i = 1, #counts, 2 do
+                entries[#entries + 1] = {counts[i], tonumber(counts[i + 1])}
+            end
+            table.sort(entries, function(a, b) return a[2] < b[2] end)
+            for i = 1, excess do
+                redis.call("HDEL", key, entries[i][1])
+            end
+            -- Indexes are rebuilt by the next pick.
+            redis.call("DEL", key .. "\\0index")
+            removed = removed + excess
+        end
+    else
+        local excess = redis.call("SCARD", key) - max_successors
+        if excess > 0 then
+            redis.call("SPOP", key, excess)
+            removed = removed + excess
+        end
+    end
+end
+return removed
+"""
+
+_SCRIPT_SHAS = {
+    script: hashlib.sha1(script.encode()).hexdigest()
+    for script in (_PICK_SCRIPT, _ADD_SCRIPT, _WALK_SCRIPT, _TRIM_SCRIPT)
+}
+
+
+def _group_by_key(items):
+    """Group *(key, element)* pairs by key, encoding elements on the way.
+
+    This lets redis backends issue a single SADD per key for a whole batch.
+    Counts of *(key, element, count)* triples are ignored.
+    """
+    groups = {}
+    for key, element, *count in items:
+        groups.setdefault(key, []).append(element.encode())
+    return groups
+
+
+def _count_pairs(items):
+    """Count the occurrences of each *(key, element)* pair of *items*.
+
+    Items may also be *(key, element, count)* triples, which count *count*
+    occurrences at once. This lets weighted redis backends count each pair
+    once.
+    """
+    counts = {}
+    for key, element, *count in items:
+        pair = (key, element.encode())
+        counts[pair] = counts.get(pair, 0) + (count[0] if count else 1)
+    return counts
+
+
+def _add_batches(items):
+    """Split the counted pairs of *items* into the arguments of runs of
+    `_ADD_SCRIPT`.
+
+    Yields:
+        *(keys, args)* pairs, holding at most `_ADD_BATCH` successors.
+    """
+    pairs = list(_count_pairs(items).items())
+    for start in range(0, len(pairs), _ADD_BATCH):
+        batch = pairs[start:start + _ADD_BATCH]
+        args = []
+        for (key, element), count in batch:
+            args.append(element)
+            args.append(count)
+        yield [key for (key, element), count in batch], args
+
+
+def _index_keys(keys):
+    """Return *keys* along with the keys of their indexes."""
+    return list(keys) + [key + _INDEX_SUFFIX for key in keys]
+
+
+def _walk_args(prefix, separator, stop_word, order, max_words, weighted):
+    """Build the arguments of the walk script."""
+    args = [prefix, separator, stop_word, order, max_words]
+    if weighted:
+        args.append("1")
+        args.extend(random.random() for _ in range(max_words))
+    else:
+        args.append("0")
+    return args
+
+
+async def _evalsha(conn, script, keys=(), args=()):
+    """Run *script* through EVALSHA on an aioredis connection.
+
+    The script is loaded with SCRIPT LOAD first if redis does not know it.
+    """
+    sha = _SCRIPT_SHAS[script]
+    try:
+        return await conn.execute("EVALSHA", sha, len(keys), *keys, *args)
+    except aioredis.ReplyError as exc:
+        if not str(exc).startswith("NOSCRIPT"):
+            raise
+        await conn.execute("SCRIPT", "LOAD", script)
+        return await conn.execute("EVALSHA", sha, len(keys), *keys, *args)
+
+
 class RedisDatabasePropertyMixin:
     @property
     def host(self):
@@ -31,21 +369,54 @@ class RedisDatabasePropertyMixin:
     def unix_socket_path(self):
         return self._unix_socket_path
 
+    @property
+    def weighted(self):
+        return self._weighted
+
 
 class RedisDatabaseAsync(RedisDatabasePropertyMixin):
+    """Asynchronous redis database class for chattymarkov.
+
+    Commands are run on connections taken from a pool of *pool_min* to
+    *pool_max* connections. Operations made of several commands, such as
+    `add_many` or `walk_many`, hold a single connection all along, and
+    `connection` lets callers hold one across several operations.
+
+    Args:
+        connect_timeout: seconds to wait for a new connection to be
+            established, None to wait forever.
+        pool_timeout: seconds to wait for a connection once the pool is
+            full, None to wait forever.
+        pool_idle: seconds after which an idle connection is closed rather
+            than reused, 0 to keep idle connections forever.
+        health_check_interval: seconds after which an idle connection is
+            checked with a PING before being reused, 0 to never check.
+
+    """
+
     def __init__(
         self,
         host="localhost",
-        port=6739,
+        port=6379,
         db=0,
         unix_socket_path=None,
         password=None,
         url=None,
+        weighted=False,
+        pool_min=1,
+        pool_max=10,
+        connect_timeout=None,
+        pool_timeout=None,
+        pool_idle=0,
+        health_check_interval=0,
     ):
-        self._conn = None
+        if pool_min > pool_max:
+            raise ValueError("pool_min must not be greater than pool_max.")
         self._db = int(db)
         self._password = password
+        self._weighted = weighted
         self._unix_socket_path = None
+        self._url = None
         if url is not None:
             self._url = f"{url}/{self._db}"
 
@@ -55,47 +426,263 @@ class RedisDatabaseAsync(RedisDatabasePropertyMixin):
             self._host = host
             self._port = int(port)
 
+        self.pool_min = pool_min
+        self.pool_max = pool_max
+        self.connect_timeout = connect_timeout
+        self.pool_timeout = pool_timeout
+        self.pool_idle = pool_idle
+        self.health_check_interval = health_check_interval
+        self._connection_pool = None
+        # The connection held by the current task, see `connection`.
+        self._held = contextvars.ContextVar("connection", default=None)
+        self._released_at = weakref.WeakKeyDictionary()
+        self._acquired = 0
+        self._waits = 0
+        self._wait_time = 0.0
+        self._recycled = 0
+
     async def connect(self):
         """Create the connection pool."""
         if self._url is not None:
-            self._connection_pool = await aioredis.create_pool(
-                self._url, minsize=1, maxsize=10
-            )
+            address = self._url
         elif self._unix_socket_path is not None:
-            self._connection_pool = await aioredis.create_pool(
-                self._unix_socket_path,
-                minsize=1,
-                maxsize=10,
-                db=self._db,
-                password=self._password,
-            )
+            address = self._unix_socket_path
         else:
-            self._connection_pool = await aioredis.create_pool(
-                (self._host, self._port),
-                minsize=1,
-                maxsize=10,
-                db=self._db,
-                password=self._password,
-            )
+            address = (self._host, self._port)
+        self._connection_pool = await aioredis.create_pool(
+            address,
+            minsize=self.pool_min,
+            maxsize=self.pool_max,
+            create_connection_timeout=self.connect_timeout,
+            db=self._db,
+            password=self._password,
+        )
+
+    async def close(self):
+        """Close the connection pool."""
+        self._connection_pool.close()
+        await self._connection_pool.wait_closed()
+
+    def _recycle(self, conn):
+        """Close *conn* and give it back to the pool, which drops it."""
+        conn.close()
+        self._connection_pool.release(conn)
+        self._recycled += 1
+
+    async def _acquire(self):
+        """Take a healthy connection from the pool."""
+        pool = self._connection_pool
+        start = time.monotonic()
+        if pool.freesize == 0 and pool.size >= pool.maxsize:
+            self._waits += 1
+        while True:
+            acquire = pool.acquire()
+            if self.pool_timeout is not None:
+                acquire = asyncio.wait_for(acquire, self.pool_timeout)
+            conn = await acquire
+            released_at = self._released_at.pop(conn, None)
+            idle = 0 if released_at is None else time.monotonic() - released_at
+            if self.pool_idle and idle >= self.pool_idle:
+                self._recycle(conn)
+                continue
+            if self.health_check_interval and (
+                idle >= self.health_check_interval
+            ):
+                try:
+                    await conn.execute("PING")
+                except (aioredis.RedisError, OSError):
+                    self._recycle(conn)
+                    continue
+            break
+        self._acquired += 1
+        self._wait_time += time.monotonic() - start
+        return conn
+
+    def _release(self, conn):
+        """Give *conn* back to the pool."""
+        self._released_at[conn] = time.monotonic()
+        self._connection_pool.release(conn)
+
+    @contextlib.asynccontextmanager
+    async def connection(self):
+        """Hold a single connection of the pool.
+
+        Operations run by the current task while the connection is held use
+        it rather than taking one from the pool each time:
 
-    async def add(self, key, element):
-        with await self._connection_pool as conn:
+            async with db.connection():
+                word = await db.random(key)
+                members = await db.members(key)
+
+        Yields:
+            The held aioredis connection.
+        """
+        conn = self._held.get()
+        if conn is not None:
+            yield conn
+            return
+        conn = await self._acquire()
+        token = self._held.set(conn)
+        try:
+            yield conn
+        finally:
+            self._held.reset(token)
+            self._release(conn)
+
+    def stats(self):
+        """Return the utilization statistics of the connection pool.
+
+        Returns:
+            A dict holding the current *size* of the pool, its number of
+            *free* and *in_use* connections, its *minsize* and *maxsize*,
+            along with the number of connections *acquired*, of
+            acquisitions which had to wait for a full pool (*waits*), the
+            total *wait_time* spent acquiring connections, in seconds, and
+            the number of *recycled* idle or unhealthy connections.
+        """
+        pool = self._connection_pool
+        size = pool.size if pool is not None else 0
+        free = pool.freesize if pool is not None else 0
+        return {
+            "size": size,
+            "free": free,
+            "in_use": size - free,
+            "minsize": self.pool_min,
+            "maxsize": self.pool_max,
+            "acquired": self._acquired,
+            "waits": self._waits,
+            "wait_time": self._wait_time,
+            "recycled": self._recycled,
+        }
+
+    async def add(self, key, element, count=1):
+        async with self.connection() as conn:
+            if self._weighted:
+                total, = await _evalsha(
+                    conn, _ADD_SCRIPT, [key], [element.encode(), count]
+                )
+                return total == count
             return await conn.execute("SADD", key, element.encode()) > 0
 
+    async def add_many(self, items):
+        async with self.connection() as conn:
+            # Commands issued concurrently on the same connection are
+            # pipelined by aioredis.
+            if self._weighted:
+                commands = [
+                    _evalsha(conn, _ADD_SCRIPT, keys, args)
+                    for keys, args in _add_batches(items)
+                ]
+            else:
+                commands = [
+                    conn.execute("SADD", key, *elements)
+                    for key, elements in _group_by_key(items).items()
+                ]
+            await asyncio.gather(*commands)
+
     async def random(self, key):
-        with await self._connection_pool as conn:
-            element = await conn.execute("SRANDMEMBER", key)
+        async with self.connection() as conn:
+            if self._weighted:
+                element = await _evalsha(
+                    conn, _PICK_SCRIPT, [key], [random.random()]
+                )
+            else:
+                element = await conn.execute("SRANDMEMBER", key)
             if element is not None:
                 return element.decode()
 
+    async def random_many(self, keys):
+        async with self.connection() as conn:
+            if self._weighted:
+                commands = [
+                    _evalsha(conn, _PICK_SCRIPT, [key], [random.random()])
+                    for key in keys
+                ]
+            else:
+                commands = [conn.execute("SRANDMEMBER", key) for key in keys]
+            elements = await asyncio.gather(*commands)
+        return [
+            None if element is None else element.decode()
+            for element in elements
+        ]
+
+    async def members(self, key):
+        async with self.connection() as conn:
+            if self._weighted:
+                counts = await conn.execute("HGETALL", key)
+                return {
+                    counts[i].decode(): int(counts[i + 1])
+                    for i in range(0, len(counts), 2)
+                }
+            elements = await conn.execute("SMEMBERS", key)
+        return {element.decode(): 1 for element in elements}
+
+    async def walk(self, prefix, separator, stop_word, order, max_words):
+        """Generate a whole sentence server side.
+
+        See also:
+            `RedisDatabase.walk`
+
+        """
+        words, = await self.walk_many(
+            1, prefix, separator, stop_word, order, max_words
+        )
+        return words
+
+    async def walk_many(
+        self, n, prefix, separator, stop_word, order, max_words
+    ):
+        """Generate *n* sentences server side.
+
+        See also:
+            `RedisDatabase.walk_many`
+
+        """
+        async with self.connection() as conn:
+            sentences = await asyncio.gather(
+                *(
+                    _evalsha(
+                        conn,
+                        _WALK_SCRIPT,
+                        args=_walk_args(
+                            prefix,
+                            separator,
+                            stop_word,
+                            order,
+                            max_words,
+                            self._weighted,
+                        ),
+                    )
+                    for _ in range(n)
+                )
+            )
+        return [[word.decode() for word in words] for words in sentences]
+
+    async def delete(self, keys):
+        if not keys:
+            return
+        async with self.connection() as conn:
+            await conn.execute("DEL", *_index_keys(keys))
+
+    async def trim(self, keys, max_successors):
+        if not keys:
+            return 0
+        async with self.connection() as conn:
+            return await _evalsha(
+                conn,
+                _TRIM_SCRIPT,
+                keys,
+                [max_successors, "1" if self._weighted else "0"],
+            )
+
     async def get(self, key):
-        with await self._connection_pool as conn:
+        async with self.connection() as conn:
             element = await conn.execute("GET", key)
             if element is not None:
                 return element.decode()
 
     async def set(self, key, value):
-        with await self._connection_pool as conn:
+        async with self.connection() as conn:
             await conn.execute("SET", key, value)
 
 
@@ -103,14 +690,17 @@ class RedisDatabase(AbstractDatabase, RedisDatabasePropertyMixin):
     def __init__(
         self,
         host="localhost",
-        port=6739,
+        port=6379,
         db=0,
         unix_socket_path=None,
         password=None,
+        weighted=False,
     ):
 
         self._db = int(db)
         self._password = password
+        self._weighted = weighted
+        self._scripts = {}
 
         if unix_socket_path is not None:
             self._unix_socket_path = unix_socket_path
@@ -124,14 +714,180 @@ class RedisDatabase(AbstractDatabase, RedisDatabasePropertyMixin):
                 host=host, port=port, db=db, password=password
             )
 
-    def add(self, key, element):
+    def add(self, key, element, count=1):
+        if self._weighted:
+            total, = self._script(_ADD_SCRIPT)(
+                keys=[key], args=[element.encode(), count]
+            )
+            return total == count
         return self.handle.sadd(key, element.encode()) > 0
 
+    def add_many(self, items):
+        pipeline = self.handle.pipeline(transaction=False)
+        if self._weighted:
+            add = self._script(_ADD_SCRIPT)
+            for keys, args in _add_batches(items):
+                add(keys=keys, args=args, client=pipeline)
+        else:
+            for key, elements in _group_by_key(items).items():
+                pipeline.sadd(key, *elements)
+        pipeline.execute()
+
+    def _script(self, script):
+        """Return *script* registered on the redis handle.
+
+        Registered scripts are run through EVALSHA, and loaded through
+        SCRIPT LOAD if redis does not know them yet.
+        """
+        registered = self._scripts.get(script)
+        if registered is None:
+            registered = self._scripts[script] = self.handle.register_script(
+                script
+            )
+        return registered
+
     def random(self, key):
-        element = self.handle.srandmember(key)
+        if self._weighted:
+            element = self._script(_PICK_SCRIPT)(
+                keys=[key], args=[random.random()]
+            )
+        else:
+            element = self.handle.srandmember(key)
         if element is not None:
             return element.decode()
 
+    def random_many(self, keys):
+        pipeline = self.handle.pipeline(transaction=False)
+        if self._weighted:
+            pick = self._script(_PICK_SCRIPT)
+            for key in keys:
+                pick(keys=[key], args=[random.random()], client=pipeline)
+        else:
+            for key in keys:
+                pipeline.srandmember(key)
+        return [
+            None if element is None else element.decode()
+            for element in pipeline.execute()
+        ]
+
+    def members(self, key):
+        if self._weighted:
+            return {
+                element.decode(): int(count)
+                for element, count in self.handle.hgetall(key).items()
+            }
+        return {element.decode(): 1 for element in self.handle.smembers(key)}
+
+    def scan(self, batch_size=1000):
+        """Iterate over the whole database.
+
+        Keys are listed through SCAN, which does not block redis, and their
+        successors are fetched by pipelines of *batch_size* keys. Keys
+        added or removed meanwhile may or may not be iterated over.
+
+        See also:
+            `AbstractDatabase.scan`
+
+        """
+        kind = "hash" if self._weighted else "set"
+        suffix = _INDEX_SUFFIX.encode()
+        keys = (
+            key
+            for key in self.handle.scan_iter(count=batch_size, _type=kind)
+            if not key.endswith(suffix)
+        )
+        while True:
+            batch = list(itertools.islice(keys, batch_size))
+            if not batch:
+                return
+            pipeline = self.handle.pipeline(transaction=False)
+            for key in batch:
+                if self._weighted:
+                    pipeline.hgetall(key)
+                else:
+                    pipeline.smembers(key)
+            for key, successors in zip(batch, pipeline.execute()):
+                if self._weighted:
+                    successors = {
+                        element.decode(): int(count)
+                        for element, count in successors.items()
+                    }
+                else:
+                    successors = dict.fromkeys(
+                        (element.decode() for element in successors), 1
+                    )
+                if successors:
+                    yield key.decode(), successors
+
+    def walk(self, prefix, separator, stop_word, order, max_words):
+        """Generate a whole sentence server side.
+
+        The markov chain is browsed by a Lua script, registered once through
+        SCRIPT LOAD and then run with EVALSHA, so that a sentence costs a
+        single round trip whatever its length.
+
+        Args:
+            prefix: the prefix prepended to every state key.
+            separator: the separator joining the words of a state.
+            stop_word: the word which ends a sentence.
+            order: the number of words a state is made of.
+            max_words: the maximum number of words to generate.
+
+        Returns:
+            The list of generated words.
+
+        """
+        words, = self.walk_many(
+            1, prefix, separator, stop_word, order, max_words
+        )
+        return words
+
+    def walk_many(self, n, prefix, separator, stop_word, order, max_words):
+        """Generate *n* sentences server side, in a single round trip.
+
+        See also:
+            `RedisDatabase.walk`
+
+        Returns:
+            A list of *n* lists of generated words.
+
+        """
+        walk = self._script(_WALK_SCRIPT)
+        pipeline = self.handle.pipeline(transaction=False)
+        for _ in range(n):
+            walk(
+                args=_walk_args(
+                    prefix,
+                    separator,
+                    stop_word,
+                    order,
+                    max_words,
+                    self._weighted,
+                ),
+                client=pipeline,
+            )
+        return [
+            [word.decode() for word in words] for words in pipeline.execute()
+        ]
+
+    def delete(self, keys):
+        if keys:
+            self.handle.delete(*_index_keys(keys))
+
+    def trim(self, keys, max_successors):
+        """Trim keys server side, in a single round trip.
+
+        See also:
+            `AbstractDatabase.trim`
+
+        """
+        if not keys:
+            return 0
+        return self._script(_TRIM_SCRIPT)(
+            keys=list(keys),
+            args=[max_successors, "1" if self._weighted else "0"],
+        )
+
     def get(self, key):
         element = self.handle.get(key)
         if element is not None:
@@ -141,6 +897,208 @@ class RedisDatabase(AbstractDatabase, RedisDatabasePropertyMixin):
         self.handle.set(key, value)
 
 
+class Successors:
+    """Successors of a key in memory databases.
+
+    Elements are stored in a list, so that picking a random one takes
+    constant time, along with a dict mapping each element to its position in
+    the list, so that membership checks take constant time as well.
+
+    """
+
+    __slots__ = ("_elements", "_index")
+
+    def __init__(self, elements=()):
+        self._elements = []
+        self._index = {}
+        for element in elements:
+            self.add(element)
+
+    def add(self, element, count=1):
+        """Add *element*, return False if it was already there."""
+        if element in self._index:
+            return False
+        self._index[element] = len(self._elements)
+        self._elements.append(element)
+        return True
+
+    def remove(self, element):
+        """Remove *element*, which must be there.
+
+        The last element takes its place in the list, so that removing an
+        element takes constant time.
+        """
+        index = self._index.pop(element)
+        last = self._elements.pop()
+        if index < len(self._elements):
+            self._elements[index] = last
+            self._index[last] = index
+        return index
+
+    def choice(self, rng=random):
+        """Pick up a random element, drawn from the *rng* generator."""
+        return rng.choice(self._elements)
+
+    def counts(self):
+        """Return a dict mapping each element to its count."""
+        return dict.fromkeys(self._elements, 1)
+
+    def dump(self):
+        """Return a JSON serializable version of the successors."""
+        return list(self._elements)
+
+    def __contains__(self, element):
+        return element in self._index
+
+    def __getitem__(self, index):
+        return self._elements[index]
+
+    def __iter__(self):
+        return iter(self._elements)
+
+    def __len__(self):
+        return len(self._elements)
+
+    def __repr__(self):
+        return "{}({!r})".format(type(self).__name__, self.dump())
+
+
+class WeightedSuccessors(Successors):
+    """Successors of a key in weighted memory databases.
+
+    Each element comes with the number of times it has been added, and
+    random picks are proportional to these counts. Picks bisect an array of
+    cumulative counts, which is rebuilt lazily after additions. The array is
+    tagged with the version of the counts it was built from, which changes
+    after each of their updates, so that a pick racing with an update never
+    keeps a stale array around.
+
+    """
+
+    __slots__ = ("_counts", "_cumulative", "_version")
+
+    def __init__(self, elements=()):
+        self._counts = []
+        self._cumulative = None
+        self._version = 0
+        if isinstance(elements, dict):
+            super().__init__()
+            for element, count in elements.items():
+                self.add(element, count)
+        else:
+            super().__init__(elements)
+
+    def add(self, element, count=1):
+        """Add *element* *count* times, return False if it was known."""
+        index = self._index.get(element)
+        if index is not None:
+            self._counts[index] += count
+            self._version += 1
+            return False
+        super().add(element)
+        self._counts.append(count)
+        self._version += 1
+        return True
+
+    def count(self, element):
+        """Return the number of times *element* has been added."""
+        index = self._index.get(element)
+        return 0 if index is None else self._counts[index]
+
+    def remove(self, element):
+        """Remove *element*, which must be there."""
+        index = super().remove(element)
+        last = self._counts.pop()
+        if index < len(self._counts):
+            self._counts[index] = last
+        self._version += 1
+        return index
+
+    def choice(self, rng=random):
+        """Pick up a random element, proportionally to its count."""
+        # The version is read before the counts, so that an update racing
+        # with this pick leaves an array tagged with an outdated version.
+        version = self._version
+        cached = self._cumulative
+        if cached is None or cached[0] != version:
+            cached = self._cumulative = (
+                version,
+                list(itertools.accumulate(self._counts)),
+            )
+        cumulative = cached[1]
+        target = rng.randrange(cumulative[-1])
+        return self._elements[bisect.bisect_right(cumulative, target)]
+
+    def counts(self):
+        """Return a dict mapping each element to its count."""
+        return dict(zip(self._elements, self._counts))
+
+    def dump(self):
+        """Return a JSON serializable version of the successors."""
+        return self.counts()
+
+
+def _trim_successors(successors, max_successors):
+    """Remove elements of *successors* beyond *max_successors*.
+
+    Weighted successors lose their least counted elements first, others
+    lose random ones.
+
+    Returns:
+        The list of removed elements.
+    """
+    excess = len(successors) - max_successors
+    if excess <= 0:
+        return []
+    if isinstance(successors, WeightedSuccessors):
+        counts = successors.counts()
+        removed = heapq.nsmallest(excess, counts, key=counts.get)
+    else:
+        removed = random.sample(list(successors), excess)
+    for element in removed:
+        successors.remove(element)
+    return removed
+
+
+def _to_successors(value, weighted=False):
+    """Turn a raw *value* into `Successors` if it holds successors.
+
+    Lists are turned into `Successors`, or into `WeightedSuccessors` for
+    weighted databases, which also turn dicts mapping elements to their
+    counts. Other values are returned as is.
+    """
+    if weighted:
+        if type(value) in (list, dict):
+            return WeightedSuccessors(value)
+    elif type(value) is list:
+        return Successors(value)
+    return value
+
+
+def _load_successors(db, weighted=False):
+    """Return a copy of a raw database *db*, its successors turned into
+    `Successors` (see `_to_successors`)."""
+    return {key: _to_successors(value, weighted) for key, value in db.items()}
+
+
+def _dump_value(value):
+    """Return a JSON serializable copy of a database value."""
+    if isinstance(value, Successors):
+        return value.dump()
+    return value
+
+
+def _dump_successors(obj):
+    """Serialize `Successors` instances to JSON."""
+    if isinstance(obj, Successors):
+        return obj.dump()
+    raise TypeError(
+        "Object of type {} is not JSON serializable".format(
+            type(obj).__name__
+        )
+    )
+
+
 class MemoryDatabaseAsync:
     """Asynchronous memory database class for chattymarkov.
 
@@ -150,34 +1108,59 @@ class MemoryDatabaseAsync:
 
     """
 
-    def __init__(self, db=None, *args, **kwargs):
+    def __init__(self, db=None, *args, weighted=False, **kwargs):
+        self.weighted = weighted
+        self._successors = WeightedSuccessors if weighted else Successors
         if db is None:
             self.db = {}
         else:
-            self.db = db
+            self.db = _load_successors(db, weighted)
 
-    async def add(self, key, element):
-        if key not in self.db:
-            self.db[key] = []
-        if type(self.db[key]) is not list:
+    async def add(self, key, element, count=1):
+        successors = self.db.get(key)
+        if successors is None:
+            successors = self.db[key] = self._successors()
+        elif not isinstance(successors, Successors):
             return False
 
-        if element not in self.db[key]:
-            self.db[key].append(element)
+        return successors.add(element, count)
+
+    async def add_many(self, items):
+        for item in items:
+            await self.add(*item)
 
     async def random(self, key):
-        if key not in self.db:
+        successors = self.db.get(key)
+        if not isinstance(successors, Successors):
             return None
-        elif type(self.db[key]) is not list:
-            return None
-        else:
-            return random.choice(self.db[key])
+        return successors.choice()
+
+    async def random_many(self, keys):
+        return [await self.random(key) for key in keys]
+
+    async def members(self, key):
+        successors = self.db.get(key)
+        if not isinstance(successors, Successors):
+            return {}
+        return successors.counts()
+
+    async def delete(self, keys):
+        for key in keys:
+            self.db.pop(key, None)
+
+    async def trim(self, keys, max_successors):
+        removed = 0
+        for key in keys:
+            successors = self.db.get(key)
+            if isinstance(successors, Successors):
+                removed += len(_trim_successors(successors, max_successors))
+        return removed
 
     def get(self, key, default=None):
-        return self.db.get(key, default)
+        return _dump_value(self.db.get(key, default))
 
     def set(self, key, value):
-        self.db[key] = value
+        self.db[key] = _to_successors(value, self.weighted)
 
 
 class MemoryDatabase(AbstractDatabase):
@@ -189,33 +1172,68 @@ class MemoryDatabase(AbstractDatabase):
 
     """
 
-    def __init__(self, db=None, *args, **kwargs):
+    def __init__(self, db=None, *args, weighted=False, **kwargs):
+        self.weighted = weighted
+        self._successors = WeightedSuccessors if weighted else Successors
         if db is None:
             self.db = {}
         else:
-            self.db = db
+            self.db = _load_successors(db, weighted)
 
-    def add(self, key, element):
-        if key not in self.db:
-            self.db[key] = []
-        if type(self.db[key]) is not list:
+    def add(self, key, element, count=1):
+        successors = self.db.get(key)
+        if successors is None:
+            successors = self.db[key] = self._successors()
+        elif not isinstance(successors, Successors):
             return False
 
-        if element not in self.db[key]:
-            self.db[key].append(element)
+        return successors.add(element, count)
 
     def random(self, key):
-        if key not in self.db:
-            return None
-        if type(self.db[key]) is not list:
+        successors = self.db.get(key)
+        if not isinstance(successors, Successors):
             return None
-        return random.choice(self.db[key])
+        return successors.choice()
+
+    def random_many(self, keys):
+        get = self.db.get
+        elements = []
+        for key in keys:
+            successors = get(key)
+            if isinstance(successors, Successors):
+                elements.append(successors.choice())
+            else:
+                elements.append(None)
+        return elements
+
+    def members(self, key):
+        successors = self.db.get(key)
+        if not isinstance(successors, Successors):
+            return {}
+        return successors.counts()
+
+    def scan(self):
+        for key, value in self.db.items():
+            if isinstance(value, Successors):
+                yield key, value.counts()
+
+    def delete(self, keys):
+        for key in keys:
+            self.db.pop(key, None)
+
+    def trim(self, keys, max_successors):
+        removed = 0
+        for key in keys:
+            successors = self.db.get(key)
+            if isinstance(successors, Successors):
+                removed += len(_trim_successors(successors, max_successors))
+        return removed
 
     def get(self, key, default=None):
-        return self.db.get(key, default)
+        return _dump_value(self.db.get(key, default))
 
     def set(self, key, value):
-        self.db[key] = value
+        self.db[key] = _to_successors(value, self.weighted)
 
 
 class JSONFileDatabase(MemoryDatabase):
@@ -230,7 +1248,8 @@ class JSONFileDatabase(MemoryDatabase):
     def __init__(self, filepath, *args, **kwargs):
         self.filepath = filepath
         if os.path.exists(self.filepath):
-            db = json.load(open(filepath))
+            # An empty document means an empty database.
+            db = json.load(open(filepath)) or None
         else:
             db = None
 
@@ -240,4 +1259,4 @@ class JSONFileDatabase(MemoryDatabase):
 
     def cleanup(self):
         with open(self.filepath, "w") as stream:
-            json.dump(self.db, stream)
+            json.dump(self.db, stream, default=_dump_successors)
@@ -0,0 +1,295 @@
+"""Journaled JSON database for chattymarkov.
+
+`JSONFileDatabase` only stores the database when the process exits, which
+means that a crash loses everything learned since startup, and that exiting
+with a big database takes a while. `JournaledJSONFileDatabase` appends each
+change to a journal instead, and compacts the journal into the JSON snapshot
+from time to time.
+
+"""
+import atexit
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+
+from .databases import (JSONFileDatabase, MemoryDatabase, Successors,
+                        _dump_value, _trim_successors)
+
+
+# fsync policies of the journal.
+FSYNC_ALWAYS = "always"
+FSYNC_INTERVAL = "interval"
+FSYNC_NEVER = "never"
+FSYNC_POLICIES = (FSYNC_ALWAYS, FSYNC_INTERVAL, FSYNC_NEVER)
+
+logger = logging.getLogger(__name__)
+
+
+class JournaledJSONFileDatabase(JSONFileDatabase):
+    """Journaled JSON database class for chattymarkov.
+
+    The database is made of the JSON snapshot at *filepath*, which keeps the
+    same format as `JSONFileDatabase`, and of a journal at *filepath* with a
+    ".log" suffix. Each line of the journal is a JSON array describing a
+    change, the first one identifying the snapshot the changes apply to, so
+    that a journal outliving its snapshot is not replayed twice.
+
+    `add` and `set` only queue their change in memory: a background thread
+    appends queued changes to the journal every *flush_interval* seconds and
+    syncs it to disk according to the *fsync* policy, so that learning never
+    waits for the disk. The same thread compacts the journal into a new
+    snapshot once it grows over *compact_size* bytes or, if set, every
+    *compact_interval* seconds.
+
+    Args:
+        filepath: path to the JSON snapshot.
+        fsync: "always" to sync the journal after each write, "interval" to
+            sync it every *fsync_interval* seconds at most, "never" to leave
+            it to the operating system.
+        fsync_interval: seconds between two syncs of the "interval" policy.
+        flush_interval: seconds between two writes to the journal.
+        compact_size: size of the journal, in bytes, which triggers a
+            compaction.
+        compact_interval: seconds between two compactions, 0 to only
+            compact on size.
+
+    """
+
+    def __init__(
+        self,
+        filepath,
+        *args,
+        fsync=FSYNC_INTERVAL,
+        fsync_interval=1.0,
+        flush_interval=0.1,
+        compact_size=64 * 1024 * 1024,
+        compact_interval=0,
+        **kwargs
+    ):
+        if fsync not in FSYNC_POLICIES:
+            raise ValueError("Unknown fsync policy '{}'.".format(fsync))
+        self.filepath = filepath
+        self.journal_path = filepath + ".log"
+        self.fsync = fsync
+        self.fsync_interval = fsync_interval
+        self.flush_interval = flush_interval
+        self.compact_size = compact_size
+        self.compact_interval = compact_interval
+
+        # `_lock` protects the database and the queued changes, `_io_lock`
+        # the journal and snapshot files. Always take `_io_lock` first.
+        self._lock = threading.Lock()
+        self._io_lock = threading.Lock()
+        self._pending = []
+        self._journal = None
+        self._unsynced = False
+
+        data = b""
+        if os.path.exists(filepath):
+            with open(filepath, "rb") as stream:
+                data = stream.read()
+        # An empty document means an empty database.
+        db = (json.loads(data.decode()) or None) if data else None
+        MemoryDatabase.__init__(self, db, *args, **kwargs)
+        self._snapshot_id = hashlib.sha1(data).hexdigest()
+
+        if self._replay():
+            # The last change was not entirely written: store everything
+            # again rather than appending after it.
+            self.compact()
+        else:
+            self._journal = open(self.journal_path, "a")
+        self._last_fsync = self._last_compaction = time.monotonic()
+
+        self._closing = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+        atexit.register(self.cleanup)
+
+    def _replay(self):
+        """Replay the journal over the snapshot.
+
+        A new journal is started if there is none yet, or if it belongs to a
+        previous snapshot.
+
+        Returns:
+            True if the journal ends with a truncated change.
+        """
+        header = None
+        if os.path.exists(self.journal_path):
+            with open(self.journal_path) as stream:
+                lines = iter(stream)
+                try:
+                    header = json.loads(next(lines))
+                except (StopIteration, ValueError):
+                    pass
+                if header == self._journal_header():
+                    for line in lines:
+                        try:
+                            change = json.loads(line)
+                        except ValueError:
+                            return True
+                        if change[0] == "a":
+                            MemoryDatabase.add(self, *change[1:])
+                        elif change[0] == "s":
+                            MemoryDatabase.set(self, *change[1:])
+                        elif change[0] == "d":
+                            self.db.pop(change[1], None)
+                        elif change[0] == "r":
+                            self._remove(*change[1:])
+                    return False
+
+        self._start_journal()
+        return False
+
+    def _journal_header(self):
+        """Return the first change of journals applying to the snapshot."""
+        return ["snapshot", self._snapshot_id]
+
+    def _start_journal(self):
+        """Start a new, empty journal applying to the snapshot."""
+        header = json.dumps(self._journal_header()) + "\n"
+        self._write_atomically(self.journal_path, header.encode())
+
+    def _run(self):
+        """Flush and compact the journal in the background.
+
+        Errors are logged rather than raised, so that the thread keeps
+        journaling changes once they are solved, e.g. once some disk space
+        is freed.
+        """
+        while not self._closing.wait(self.flush_interval):
+            try:
+                self.flush()
+                with self._io_lock:
+                    size = self._journal.tell()
+                now = time.monotonic()
+                if size >= self.compact_size or (
+                    self.compact_interval
+                    and now - self._last_compaction >= self.compact_interval
+                ):
+                    self.compact()
+            except Exception:
+                logger.exception(
+                    "Could not write the journal of %s.", self.filepath
+                )
+
+    def add(self, key, element, count=1):
+        with self._lock:
+            added = MemoryDatabase.add(self, key, element, count)
+            if added or self.weighted:
+                self._pending.append(["a", key, element, count])
+        return added
+
+    def set(self, key, value):
+        with self._lock:
+            MemoryDatabase.set(self, key, value)
+            self._pending.append(["s", key, value])
+
+    def delete(self, keys):
+        with self._lock:
+            for key in keys:
+                if self.db.pop(key, None) is not None:
+                    self._pending.append(["d", key])
+
+    def trim(self, keys, max_successors):
+        # Unweighted databases remove random successors: journal the removed
+        # ones, so that replaying the journal removes the same ones.
+        removed = 0
+        with self._lock:
+            for key in keys:
+                successors = self.db.get(key)
+                if not isinstance(successors, Successors):
+                    continue
+                for element in _trim_successors(successors, max_successors):
+                    self._pending.append(["r", key, element])
+                    removed += 1
+        return removed
+
+    def _remove(self, key, element):
+        """Remove *element* from the successors of *key*, if there."""
+        successors = self.db.get(key)
+        if isinstance(successors, Successors) and element in successors:
+            successors.remove(element)
+
+    def flush(self):
+        """Append the queued changes to the journal."""
+        with self._io_lock:
+            with self._lock:
+                pending, self._pending = self._pending, []
+            if pending:
+                try:
+                    self._journal.writelines(
+                        json.dumps(change) + "\n" for change in pending
+                    )
+                    self._journal.flush()
+                except BaseException:
+                    # Keep the changes for the next flush.
+                    with self._lock:
+                        self._pending[:0] = pending
+                    raise
+                self._unsynced = True
+
+            now = time.monotonic()
+            if self._unsynced and (
+                self.fsync == FSYNC_ALWAYS
+                or self.fsync == FSYNC_INTERVAL
+                and now - self._last_fsync >= self.fsync_interval
+            ):
+                os.fsync(self._journal.fileno())
+                self._last_fsync = now
+                self._unsynced = False
+
+    def compact(self):
+        """Store a new snapshot of the database and start a new journal."""
+        with self._io_lock:
+            with self._lock:
+                snapshot = {
+                    key: _dump_value(value) for key, value in self.db.items()
+                }
+                # Queued changes are part of the snapshot.
+                self._pending = []
+            data = json.dumps(snapshot).encode()
+
+            # Replace the snapshot first: the current journal then belongs
+            # to a previous snapshot, and will not be replayed over the new
+            # one if the process dies before the new journal is written.
+            self._write_atomically(self.filepath, data)
+            self._snapshot_id = hashlib.sha1(data).hexdigest()
+            self._start_journal()
+
+            if self._journal is not None:
+                self._journal.close()
+            self._journal = open(self.journal_path, "a")
+            self._unsynced = False
+            self._last_compaction = time.monotonic()
+
+    @staticmethod
+    def _write_atomically(path, data):
+        """Replace the content of *path* with *data*, synced to disk."""
+        temporary = path + ".tmp"
+        with open(temporary, "wb") as stream:
+            stream.write(data)
+            stream.flush()
+            os.fsync(stream.fileno())
+        os.replace(temporary, path)
+
+    def cleanup(self):
+        """Stop the background thread and sync the journal to disk.
+
+        The snapshot is left as it is, since the journal is replayed over it
+        on the next start: compacting them is left to `compact_size` and
+        `compact_interval`, rather than stalling the exit of the program.
+        """
+        if self._closing.is_set():
+            return
+        self._closing.set()
+        self._thread.join()
+        self.flush()
+        with self._io_lock:
+            os.fsync(self._journal.fileno())
+            self._journal.close()
@@ -0,0 +1,373 @@
+"""Memory-mapped, read-only database for chattymarkov.
+
+`JSONFileDatabase` loads the whole model in memory when it is instanciated,
+so that startup time and memory grow with the size of the model, and each
+process holds its own copy of it. The `MappedDatabase` class reads a binary,
+offset-indexed model file through `mmap` instead: opening it takes constant
+time, and processes reading the same file share the same page cache.
+
+Model files are built from any database providing `scan` through the
+`build_mapped_file` function.
+
+The same format may also live in shared memory rather than in a file:
+`share_mapped_model` serializes a database into a segment of
+`multiprocessing.shared_memory`, typically in the master process of a
+pre-fork server, and `SharedMappedDatabase` attaches to the segment by its
+name in each worker. Workers only ever read the segment and hold no Python
+object per key or word, so that its pages are never copied on write and
+their private memory does not depend on the size of the model.
+
+File format
+-----------
+
+All integers are little-endian.
+
+- A header: magic number, format version, flags, number of slots of the
+  hash index and number of keys.
+- The hash index: an open-addressing table of slots, each made of the CRC32
+  of a key and the offset of its record, 0 meaning an empty slot.
+- The words: every successor, stored once, in UTF-8.
+- The records: for each key, its length and number of successors, the key
+  itself in UTF-8, then one entry per successor made of the offset and
+  length of the word along with the cumulative count of successors up to
+  this one, used by weighted databases to pick successors up.
+
+"""
+import atexit
+import bisect
+import contextlib
+import mmap
+import os
+import random
+import struct
+import zlib
+from multiprocessing import resource_tracker, shared_memory
+
+from .base import AbstractDatabase
+
+
+MAGIC = b"CMKV"
+VERSION = 1
+
+# Flag set in the header of weighted model files.
+FLAG_WEIGHTED = 0x1
+
+_HEADER = struct.Struct("<4sHHQQ")
+_SLOT = struct.Struct("<IQ")
+_RECORD = struct.Struct("<II")
+_ENTRY = struct.Struct("<QIQ")
+
+
+class MappedDatabaseError(Exception):
+    """Exception class for invalid or read-only mapped databases."""
+
+
+class _Cumulative:
+    """Lazy sequence over the cumulative counts of a record's entries."""
+
+    __slots__ = ("_buffer", "_offset", "_count")
+
+    def __init__(self, buffer, offset, count):
+        self._buffer = buffer
+        self._offset = offset
+        self._count = count
+
+    def __getitem__(self, index):
+        return _ENTRY.unpack_from(
+            self._buffer, self._offset + index * _ENTRY.size
+        )[2]
+
+    def __len__(self):
+        return self._count
+
+
+class MappedDatabase(AbstractDatabase):
+    """Memory-mapped database class for chattymarkov.
+
+    This database is read-only: build model files with `build_mapped_file`.
+
+    """
+
+    def __init__(self, filepath, *args, **kwargs):
+        self.filepath = filepath
+        with open(filepath, "rb") as stream:
+            buffer = mmap.mmap(stream.fileno(), 0, access=mmap.ACCESS_READ)
+        self._open(buffer)
+
+    def _open(self, buffer):
+        """Check the header of *buffer* and start reading from it."""
+        magic, version, flags, slots, keys = _HEADER.unpack_from(buffer)
+        if magic != MAGIC or version != VERSION:
+            raise MappedDatabaseError("Not a chattymarkov model file.")
+        self._buffer = buffer
+        self._mask = slots - 1
+        self.weighted = bool(flags & FLAG_WEIGHTED)
+
+    def _find(self, key):
+        """Return the offset of the record of *key*, or None."""
+        buffer = self._buffer
+        key = key.encode()
+        crc = zlib.crc32(key)
+        slot = crc & self._mask
+        while True:
+            slot_crc, offset = _SLOT.unpack_from(
+                buffer, _HEADER.size + slot * _SLOT.size
+            )
+            if offset == 0:
+                return None
+            if slot_crc == crc:
+                length, count = _RECORD.unpack_from(buffer, offset)
+                start = offset + _RECORD.size
+                if buffer[start:start + length] == key:
+                    return offset
+            slot = (slot + 1) & self._mask
+
+    def _entries(self, offset):
+        """Return the entries offset and count of the record at *offset*."""
+        length, count = _RECORD.unpack_from(self._buffer, offset)
+        return offset + _RECORD.size + length, count
+
+    def _word(self, entry):
+        """Return the word of the entry at offset *entry*."""
+        word_offset, length, cumulative = _ENTRY.unpack_from(
+            self._buffer, entry
+        )
+        return str(self._buffer[word_offset:word_offset + length], "utf-8")
+
+    def add(self, key, element, count=1):
+        raise MappedDatabaseError("Mapped databases are read-only.")
+
+    def random(self, key):
+        offset = self._find(key)
+        if offset is None:
+            return None
+        entries, count = self._entries(offset)
+        if self.weighted:
+            cumulative = _Cumulative(self._buffer, entries, count)
+            target = random.randrange(cumulative[count - 1])
+            index = bisect.bisect_right(cumulative, target)
+        else:
+            index = random.randrange(count)
+        return self._word(entries + index * _ENTRY.size)
+
+    def _members(self, offset):
+        """Return the successors of the record at *offset* with counts."""
+        entries, count = self._entries(offset)
+        successors = {}
+        previous = 0
+        for index in range(count):
+            entry = entries + index * _ENTRY.size
+            cumulative = _ENTRY.unpack_from(self._buffer, entry)[2]
+            successors[self._word(entry)] = cumulative - previous
+            previous = cumulative
+        return successors
+
+    def members(self, key):
+        offset = self._find(key)
+        if offset is None:
+            return {}
+        return self._members(offset)
+
+    def scan(self):
+        buffer = self._buffer
+        for slot in range(self._mask + 1):
+            slot_crc, offset = _SLOT.unpack_from(
+                buffer, _HEADER.size + slot * _SLOT.size
+            )
+            if offset == 0:
+                continue
+            length, count = _RECORD.unpack_from(buffer, offset)
+            start = offset + _RECORD.size
+            key = str(buffer[start:start + length], "utf-8")
+            yield key, self._members(offset)
+
+    def get(self, key, default=None):
+        return default
+
+    def delete(self, keys):
+        raise MappedDatabaseError("Mapped databases are read-only.")
+
+    def trim(self, keys, max_successors):
+        raise MappedDatabaseError("Mapped databases are read-only.")
+
+    def set(self, key, value):
+        raise MappedDatabaseError("Mapped databases are read-only.")
+
+    def close(self):
+        """Unmap the model file."""
+        self._buffer.close()
+
+
+def _open_segment(name=None, create=False, size=0):
+    """Open a shared memory segment, left out of the resource tracker.
+
+    Before Python 3.13, the resource tracker unlinks every segment a process
+    attached to when it exits, and forked processes share the tracker of
+    their parent, so that segments are kept out of it: their owner unlinks
+    them by itself.
+    """
+    try:
+        return shared_memory.SharedMemory(name, create, size, track=False)
+    except TypeError:
+        segment = shared_memory.SharedMemory(name, create, size)
+        if os.name == "posix":
+            resource_tracker.unregister(segment._name, "shared_memory")
+        return segment
+
+
+class SharedMappedDatabase(MappedDatabase):
+    """Shared memory database class for chattymarkov.
+
+    This database reads a model from a segment of shared memory built by
+    `share_mapped_model`, so that every process of a server shares a
+    single copy of it. It is read-only, like `MappedDatabase`.
+
+    Args:
+        name: the name of the shared memory segment.
+
+    """
+
+    # Identifier of the process which created the segment, if it is this
+    # database's.
+    _owner = None
+
+    def __init__(self, name, *args, **kwargs):
+        self._attach(_open_segment(name))
+
+    def _attach(self, segment):
+        """Start reading from the shared memory *segment*."""
+        self._segment = segment
+        self.name = segment.name
+        self._open(segment.buf)
+
+    def close(self):
+        """Detach from the shared memory segment."""
+        self._buffer = None
+        self._segment.close()
+
+    def unlink(self):
+        """Free the shared memory segment, once every process closed it."""
+        # Before Python 3.13, `unlink` unregisters the segment from the
+        # resource tracker, which it must be registered to.
+        tracked = os.name == "posix" and getattr(self._segment, "_track", True)
+        if tracked:
+            resource_tracker.register(self._segment._name, "shared_memory")
+        try:
+            self._segment.unlink()
+        except FileNotFoundError:
+            if tracked:
+                resource_tracker.unregister(
+                    self._segment._name, "shared_memory"
+                )
+            raise
+        self._owner = None
+
+    def _cleanup(self):
+        """Free the segment at exit, in the process which created it."""
+        # Forked workers run the exit handlers of their parent too.
+        if self._owner == os.getpid():
+            with contextlib.suppress(FileNotFoundError):
+                self.unlink()
+
+
+def share_mapped_model(source, name=None, weighted=None):
+    """Serialize *source* into a new segment of shared memory.
+
+    The process calling this function owns the segment, which is freed when
+    the returned database is unlinked, or when the process exits. Other
+    processes, forked or not, attach to it by its name through
+    `SharedMappedDatabase` or "shm://" connection strings.
+
+    Args:
+        source: a database providing `scan`.
+        name: the name of the segment, chosen at random by default.
+        weighted: True to pick successors up proportionally to their counts.
+            Defaults to the `weighted` attribute of *source*.
+
+    Returns:
+        SharedMappedDatabase: a database reading the new segment.
+    """
+    chunks = _serialize(source, weighted)
+    segment = _open_segment(
+        name, create=True, size=sum(len(chunk) for chunk in chunks)
+    )
+    offset = 0
+    for chunk in chunks:
+        segment.buf[offset:offset + len(chunk)] = chunk
+        offset += len(chunk)
+    db = SharedMappedDatabase.__new__(SharedMappedDatabase)
+    db._attach(segment)
+    db._owner = os.getpid()
+    atexit.register(db._cleanup)
+    return db
+
+
+def _serialize(source, weighted=None):
+    """Serialize the content of *source* to the mapped file format.
+
+    Args:
+        source: a database providing `scan`.
+        weighted: True to pick successors up proportionally to their counts.
+            Defaults to the `weighted` attribute of *source*.
+
+    Returns:
+        A list of bytes objects, to be written one after the other.
+    """
+    if weighted is None:
+        weighted = getattr(source, "weighted", False)
+
+    records = [
+        (key.encode(), successors) for key, successors in source.scan()
+    ]
+    slots = 1
+    while slots < 2 * len(records):
+        slots *= 2
+
+    # Store each word once, right after the hash index.
+    words = {}
+    chunks = []
+    offset = _HEADER.size + slots * _SLOT.size
+    for key, successors in records:
+        for word in successors:
+            if word not in words:
+                encoded = word.encode()
+                words[word] = (offset, len(encoded))
+                chunks.append(encoded)
+                offset += len(encoded)
+
+    table = bytearray(slots * _SLOT.size)
+    for key, successors in records:
+        crc = zlib.crc32(key)
+        slot = crc & (slots - 1)
+        while _SLOT.unpack_from(table, slot * _SLOT.size)[1] != 0:
+            slot = (slot + 1) & (slots - 1)
+        _SLOT.pack_into(table, slot * _SLOT.size, crc, offset)
+
+        chunks.append(_RECORD.pack(len(key), len(successors)))
+        chunks.append(key)
+        cumulative = 0
+        for word, count in successors.items():
+            cumulative += count
+            chunks.append(_ENTRY.pack(*words[word], cumulative))
+        offset += (
+            _RECORD.size + len(key) + len(successors) * _ENTRY.size
+        )
+
+    flags = FLAG_WEIGHTED if weighted else 0
+    header = _HEADER.pack(MAGIC, VERSION, flags, slots, len(records))
+    return [header, bytes(table)] + chunks
+
+
+def build_mapped_file(source, filepath, weighted=None):
+    """Build a model file readable by `MappedDatabase` from *source*.
+
+    Args:
+        source: a database providing `scan`, such as `MemoryDatabase`,
+            `JSONFileDatabase` or `CompactDatabase`.
+        filepath: path of the model file to write.
+        weighted: True to pick successors up proportionally to their counts.
+            Defaults to the `weighted` attribute of *source*.
+
+    """
+    with open(filepath, "wb") as stream:
+        stream.writelines(_serialize(source, weighted))
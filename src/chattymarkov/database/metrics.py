@@ -0,0 +1,347 @@
+"""Instrumentation of chattymarkov databases.
+
+`learn` and `generate` hide the database calls they make. The
+`InstrumentedDatabase` class wraps any database, synchronous or not, and
+records the number of calls of each operation, a histogram of their
+latencies and the number of bytes sent and received. Recorded metrics are
+exposed through a `Metrics` instance, which can be dumped in the Prometheus
+text format, through a callback called after each operation, and through
+OpenTelemetry spans when the ``opentelemetry-api`` package is installed.
+
+Databases are only wrapped when asked to, with the ``metrics=1`` or
+``tracing=1`` connection string parameters, so that instrumentation costs
+nothing when it is disabled.
+
+"""
+import bisect
+import functools
+import inspect
+import time
+
+from .cache import CachedDatabase, CachedDatabaseAsync
+
+
+try:
+    from opentelemetry import trace
+except ImportError:  # pragma: no cover
+    trace = None
+
+
+# Upper bounds, in seconds, of the buckets of latency histograms.
+BUCKETS = (
+    0.0001,
+    0.00025,
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+)
+
+# Database operations recorded by `InstrumentedDatabase`.
+OPERATIONS = (
+    "add",
+    "add_many",
+    "random",
+    "random_many",
+    "members",
+    "walk",
+    "walk_many",
+    "delete",
+    "trim",
+    "get",
+    "set",
+)
+
+
+def _size(value):
+    """Return the number of bytes *value* takes on the wire, roughly."""
+    if value is None:
+        return 0
+    if isinstance(value, str):
+        return len(value.encode())
+    if isinstance(value, (bytes, bytearray)):
+        return len(value)
+    if isinstance(value, dict):
+        return sum(_size(key) + _size(item) for key, item in value.items())
+    if isinstance(value, (list, tuple)):
+        return sum(_size(item) for item in value)
+    return len(str(value))
+
+
+class _Operation:
+    """Metrics recorded for a single operation."""
+
+    __slots__ = ("calls", "errors", "seconds", "buckets", "sent", "received")
+
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.seconds = 0.0
+        self.buckets = [0] * (len(BUCKETS) + 1)
+        self.sent = 0
+        self.received = 0
+
+
+class Metrics:
+    """Metrics recorded by one or several instrumented databases.
+
+    Args:
+        callback: a function called after each operation with its name, its
+            duration in seconds and the exception it raised, or None.
+
+    """
+
+    def __init__(self, callback=None):
+        self.callback = callback
+        self.operations = {}
+        self._caches = []
+
+    def record(self, operation, seconds, sent=0, received=0, error=None):
+        """Record a call to *operation* which took *seconds*."""
+        metrics = self.operations.get(operation)
+        if metrics is None:
+            metrics = self.operations[operation] = _Operation()
+        metrics.calls += 1
+        metrics.seconds += seconds
+        metrics.buckets[bisect.bisect_left(BUCKETS, seconds)] += 1
+        metrics.sent += sent
+        metrics.received += received
+        if error is not None:
+            metrics.errors += 1
+        if self.callback is not None:
+            self.callback(operation, seconds, error)
+
+    def track_cache(self, cache):
+        """Report the statistics of *cache*, which provides `stats`."""
+        self._caches.append(cache)
+
+    def cache_stats(self):
+        """Return the summed statistics of the tracked caches."""
+        stats = {
+            "hits": 0,
+            "misses": 0,
+            "evictions": 0,
+            "size": 0,
+            "successors": 0,
+        }
+        for cache in self._caches:
+            for key, value in cache.stats().items():
+                stats[key] = stats.get(key, 0) + value
+        return stats
+
+    def snapshot(self):
+        """Return the recorded metrics as a dict.
+
+        Returns:
+            A dict mapping each operation to its number of *calls* and
+            *errors*, the total *seconds* spent in it, the number of calls
+            per latency bucket in *buckets*, and the number of bytes *sent*
+            and *received*, along with the statistics of tracked caches
+            under the "cache" key.
+        """
+        snapshot = {
+            operation: {
+                "calls": metrics.calls,
+                "errors": metrics.errors,
+                "seconds": metrics.seconds,
+                "buckets": dict(
+                    zip(BUCKETS + (float("inf"),), metrics.buckets)
+                ),
+                "sent": metrics.sent,
+                "received": metrics.received,
+            }
+            for operation, metrics in self.operations.items()
+        }
+        if self._caches:
+            snapshot["cache"] = self.cache_stats()
+        return snapshot
+
+    def prometheus(self, namespace="chattymarkov"):
+        """Dump the recorded metrics in the Prometheus text format."""
+        lines = []
+
+        def family(name, kind, description):
+            lines.append(f"# HELP {namespace}_{name} {description}")
+            lines.append(f"# TYPE {namespace}_{name} {kind}")
+
+        def sample(name, value, **labels):
+            labels = ",".join(f'{k}="{v}"' for k, v in labels.items())
+            lines.append(f"{namespace}_{name}{{{labels}}} {value}")
+
+        operations = sorted(self.operations.items())
+        family("db_calls_total", "counter", "Database calls.")
+        for operation, metrics in operations:
+            sample("db_calls_total", metrics.calls, operation=operation)
+
+        family("db_errors_total", "counter", "Database calls which failed.")
+        for operation, metrics in operations:
+            sample("db_errors_total", metrics.errors, operation=operation)
+
+        family("db_bytes_total", "counter", "Bytes sent and received.")
+        for operation, metrics in operations:
+            for direction in ("sent", "received"):
+                sample(
+                    "db_bytes_total",
+                    getattr(metrics, direction),
+                    operation=operation,
+                    direction=direction,
+                )
+
+        family("db_latency_seconds", "histogram", "Database calls latency.")
+        for operation, metrics in operations:
+            cumulative = 0
+            for bound, count in zip(BUCKETS + ("+Inf",), metrics.buckets):
+                cumulative += count
+                sample(
+                    "db_latency_seconds_bucket",
+                    cumulative,
+                    operation=operation,
+                    le=bound,
+                )
+            sample(
+                "db_latency_seconds_sum", metrics.seconds, operation=operation
+            )
+            sample(
+                "db_latency_seconds_count", metrics.calls, operation=operation
+            )
+
+        if self._caches:
+            family("cache_events_total", "counter", "Cache events.")
+            stats = self.cache_stats()
+            for event in ("hits", "misses", "evictions"):
+                sample("cache_events_total", stats[event], event=event)
+        return "\n".join(lines) + "\n"
+
+
+class InstrumentedDatabase:
+    """Database wrapper recording metrics of the wrapped database's calls.
+
+    Synchronous and asynchronous databases are both supported. Methods and
+    attributes are looked up on the wrapped database, so that the wrapper
+    provides the same operations: `walk` is only available if the wrapped
+    database provides it, for instance. The statistics of the caches found
+    down the chain of wrapped databases, such as a cache wrapped by a
+    bounded database, are reported along with the metrics.
+
+    Args:
+        database: the database to instrument.
+        metrics: the `Metrics` instance to record metrics into, a new one by
+            default.
+        tracer: an OpenTelemetry tracer to record a span per call with,
+            None to record no spans.
+
+    """
+
+    def __init__(self, database, metrics=None, tracer=None):
+        self.database = database
+        self.metrics = Metrics() if metrics is None else metrics
+        self.tracer = tracer
+        wrapped = database
+        while wrapped is not None:
+            if isinstance(wrapped, (CachedDatabase, CachedDatabaseAsync)):
+                self.metrics.track_cache(wrapped)
+            wrapped = getattr(wrapped, "database", None)
+
+    def __getattr__(self, name):
+        attribute = getattr(self.database, name)
+        if name not in OPERATIONS:
+            return attribute
+        method = self._instrument(name, attribute)
+        # Spare the lookup next time.
+        setattr(self, name, method)
+        return method
+
+    def _instrument(self, operation, method):
+        """Wrap *method*, recording its calls under *operation*."""
+        record = self.metrics.record
+        tracer = self.tracer
+        clock = time.perf_counter
+        # Batches may be generators, which would be consumed by the call.
+        materialize = operation == "add_many"
+
+        if inspect.iscoroutinefunction(method):
+
+            @functools.wraps(method)
+            async def wrapper(*args, **kwargs):
+                if materialize:
+                    args = (list(args[0]),) + args[1:]
+                span = _start_span(tracer, operation)
+                error = result = None
+                start = clock()
+                try:
+                    result = await method(*args, **kwargs)
+                    return result
+                except Exception as exc:
+                    error = exc
+                    raise
+                finally:
+                    seconds = clock() - start
+                    _end_span(span, error)
+                    record(
+                        operation, seconds, _size(args), _size(result), error
+                    )
+
+        else:
+
+            @functools.wraps(method)
+            def wrapper(*args, **kwargs):
+                if materialize:
+                    args = (list(args[0]),) + args[1:]
+                span = _start_span(tracer, operation)
+                error = result = None
+                start = clock()
+                try:
+                    result = method(*args, **kwargs)
+                    return result
+                except Exception as exc:
+                    error = exc
+                    raise
+                finally:
+                    seconds = clock() - start
+                    _end_span(span, error)
+                    record(
+                        operation, seconds, _size(args), _size(result), error
+                    )
+
+        return wrapper
+
+
+def _start_span(tracer, operation):
+    """Start the span of a call to *operation*, if tracing."""
+    if tracer is None:
+        return None
+    return tracer.start_span("chattymarkov.db." + operation)
+
+
+def _end_span(span, error):
+    """End *span*, recording *error* if any."""
+    if span is None:
+        return
+    if error is not None:
+        span.record_exception(error)
+        if trace is not None:
+            span.set_status(trace.Status(trace.StatusCode.ERROR))
+    span.end()
+
+
+def get_tracer():
+    """Return the OpenTelemetry tracer of chattymarkov.
+
+    Raises:
+        ImportError: the ``opentelemetry-api`` package is not installed.
+    """
+    if trace is None:
+        raise ImportError(
+            "Tracing requires the opentelemetry-api package to be installed."
+        )
+    return trace.get_tracer("chattymarkov")
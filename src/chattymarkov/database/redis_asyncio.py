@@ -0,0 +1,443 @@
+"""Asynchronous redis database for chattymarkov, on top of `redis.asyncio`.
+
+`RedisDatabaseAsync` relies on the `aioredis` 1.x API, which is not
+maintained anymore. `RedisAsyncioDatabase` talks to redis through the
+asyncio client of redis-py instead, which parses replies with hiredis when
+it is installed (``pip install chattymarkov[hiredis]``), and sends each
+batch of commands as a single pipeline.
+
+Words are returned as strings by default. Callers able to handle bytes may
+pass ``raw=True`` to the methods returning words, which spares decoding
+them.
+
+Its connection pool offers what the pool of `RedisDatabaseAsync` does:
+*pool_min* connections opened by `connect`, idle connections recycled
+after *pool_idle* seconds, a `connection` context manager holding one
+connection across several operations, and utilization statistics through
+`stats`.
+
+"""
+import asyncio
+import contextlib
+import contextvars
+import inspect
+import random
+import time
+import weakref
+
+import redis.asyncio
+
+from .databases import (_ADD_SCRIPT, _PICK_SCRIPT, _TRIM_SCRIPT, _WALK_SCRIPT,
+                        RedisDatabasePropertyMixin, _add_batches,
+                        _group_by_key, _index_keys, _walk_args)
+
+
+def _decode(element, raw):
+    """Decode *element* unless *raw* is set."""
+    if element is None or raw:
+        return element
+    return element.decode()
+
+
+# Older redis-py versions, such as 5.0, require the name of the command a
+# connection is taken for, which later versions deprecate.
+_COMMAND = (
+    ("_",)
+    if inspect.signature(
+        redis.asyncio.BlockingConnectionPool.get_connection
+    ).parameters["command_name"].default is inspect.Parameter.empty
+    else ()
+)
+
+
+class _Held:
+    """A connection held by a task, see `RedisAsyncioDatabase.connection`.
+
+    Operations of the task, and of the tasks it starts, share the connection
+    one at a time, through *lock*.
+    """
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.lock = asyncio.Lock()
+        self.released = False
+
+
+class _Pool(redis.asyncio.BlockingConnectionPool):
+    """Blocking connection pool recycling idle connections.
+
+    It lends the connection held by the current task, if any, rather than
+    one of its own, and keeps the utilization statistics of
+    `RedisAsyncioDatabase.stats`.
+
+    Args:
+        pool_idle: seconds after which an idle connection is closed and
+            opened again rather than reused, 0 to keep idle connections
+            forever.
+
+    """
+
+    def __init__(self, pool_idle=0, **kwargs):
+        super().__init__(**kwargs)
+        self.pool_idle = pool_idle
+        self.held = contextvars.ContextVar("connection", default=None)
+        self._released_at = weakref.WeakKeyDictionary()
+        self.acquired = 0
+        self.waits = 0
+        self.wait_time = 0.0
+        self.recycled = 0
+
+    @property
+    def size(self):
+        """The number of connections of the pool."""
+        return len(self._available_connections) + len(
+            self._in_use_connections
+        )
+
+    @property
+    def in_use(self):
+        """The number of connections taken from the pool."""
+        return len(self._in_use_connections)
+
+    async def get_connection(self, *args, **kwargs):
+        held = self.held.get()
+        if held is not None and not held.released:
+            await held.lock.acquire()
+            return held.conn
+        return await self.acquire(*args, **kwargs)
+
+    async def acquire(self, *args, **kwargs):
+        """Take a connection from the pool, recycling it if it is idle.
+
+        Arguments are passed on to `get_connection` of redis-py, which
+        requires the name of a command in older versions.
+        """
+        start = time.monotonic()
+        if not self._available_connections and (
+            self.size >= self.max_connections
+        ):
+            self.waits += 1
+        conn = await super().get_connection(*(args or _COMMAND), **kwargs)
+        released_at = self._released_at.pop(conn, None)
+        if (
+            self.pool_idle
+            and released_at is not None
+            and time.monotonic() - released_at >= self.pool_idle
+        ):
+            try:
+                await conn.disconnect()
+                await self.ensure_connection(conn)
+            except BaseException:
+                await super().release(conn)
+                raise
+            self.recycled += 1
+        self.acquired += 1
+        self.wait_time += time.monotonic() - start
+        return conn
+
+    async def release(self, connection):
+        held = self.held.get()
+        if held is not None and held.conn is connection and not held.released:
+            held.lock.release()
+            return
+        self._released_at[connection] = time.monotonic()
+        await super().release(connection)
+
+
+class RedisAsyncioDatabase(RedisDatabasePropertyMixin):
+    """Asynchronous redis database class for chattymarkov.
+
+    Connections are taken from a blocking pool of *pool_min* to *pool_max*
+    connections. Operations made of several commands, such as `add_many` or
+    `walk_many`, run as a single pipeline, and `connection` lets callers
+    hold one connection across several operations.
+
+    Args:
+        connect_timeout: seconds to wait for a new connection to be
+            established, None to wait forever.
+        pool_timeout: seconds to wait for a connection once the pool is
+            full, None to wait forever.
+        pool_idle: seconds after which an idle connection is closed and
+            opened again rather than reused, 0 to keep idle connections
+            forever.
+        health_check_interval: seconds after which an idle connection is
+            checked with a PING before being reused, 0 to never check.
+            Connections failing the check are opened again by redis-py.
+
+    """
+
+    def __init__(
+        self,
+        host="localhost",
+        port=6379,
+        db=0,
+        unix_socket_path=None,
+        password=None,
+        weighted=False,
+        pool_min=1,
+        pool_max=10,
+        connect_timeout=None,
+        pool_timeout=None,
+        pool_idle=0,
+        health_check_interval=0,
+    ):
+        if pool_min > pool_max:
+            raise ValueError("pool_min must not be greater than pool_max.")
+        self._db = int(db)
+        self._password = password
+        self._weighted = weighted
+        self._unix_socket_path = unix_socket_path
+        self.pool_min = pool_min
+        self.pool_max = pool_max
+        self.connect_timeout = connect_timeout
+        self.pool_timeout = pool_timeout
+        self.pool_idle = pool_idle
+        self.health_check_interval = health_check_interval
+        self._scripts = {}
+
+        kwargs = {
+            "pool_idle": pool_idle,
+            "db": self._db,
+            "password": password,
+            "max_connections": pool_max,
+            "timeout": pool_timeout,
+            "socket_connect_timeout": connect_timeout,
+            "health_check_interval": health_check_interval,
+        }
+        if unix_socket_path is not None:
+            kwargs.update(
+                connection_class=redis.asyncio.UnixDomainSocketConnection,
+                path=unix_socket_path,
+            )
+        else:
+            self._host = host
+            self._port = int(port)
+            kwargs.update(host=host, port=self._port)
+        self.handle = redis.asyncio.Redis(connection_pool=_Pool(**kwargs))
+
+    async def connect(self):
+        """Open *pool_min* connections and check that redis is reachable."""
+        await self.handle.ping()
+        pool = self.handle.connection_pool
+        if not isinstance(pool, _Pool):
+            return
+        conns = []
+        try:
+            while len(conns) < self.pool_min:
+                conns.append(await pool.acquire())
+        finally:
+            for conn in conns:
+                await pool.release(conn)
+
+    @contextlib.asynccontextmanager
+    async def connection(self):
+        """Hold a single connection of the pool.
+
+        Operations run by the current task while the connection is held use
+        it rather than taking one from the pool each time:
+
+            async with db.connection():
+                word = await db.random(key)
+                members = await db.members(key)
+
+        Operations run concurrently, by tasks started while the connection
+        is held, use it one at a time.
+
+        Yields:
+            The held redis-py connection.
+        """
+        pool = self.handle.connection_pool
+        if not isinstance(pool, _Pool):
+            # A client given by the caller, whose pool lends no connection.
+            yield None
+            return
+        held = pool.held.get()
+        if held is not None and not held.released:
+            yield held.conn
+            return
+        held = _Held(await pool.acquire())
+        token = pool.held.set(held)
+        try:
+            yield held.conn
+        finally:
+            pool.held.reset(token)
+            # Wait for the operations of tasks started meanwhile.
+            async with held.lock:
+                held.released = True
+            await pool.release(held.conn)
+
+    def stats(self):
+        """Return the utilization statistics of the connection pool.
+
+        See also:
+            `RedisDatabaseAsync.stats`
+        """
+        pool = self.handle.connection_pool
+        stats = {
+            "size": 0,
+            "free": 0,
+            "in_use": 0,
+            "minsize": self.pool_min,
+            "maxsize": self.pool_max,
+            "acquired": 0,
+            "waits": 0,
+            "wait_time": 0.0,
+            "recycled": 0,
+        }
+        if isinstance(pool, _Pool):
+            stats.update(
+                size=pool.size,
+                free=pool.size - pool.in_use,
+                in_use=pool.in_use,
+                acquired=pool.acquired,
+                waits=pool.waits,
+                wait_time=pool.wait_time,
+                recycled=pool.recycled,
+            )
+        return stats
+
+    async def close(self):
+        """Close the connections of the pool."""
+        await self.handle.connection_pool.disconnect()
+
+    def _script(self, script):
+        """Return *script* registered on the redis handle.
+
+        See also:
+            `RedisDatabase._script`
+        """
+        registered = self._scripts.get(script)
+        if registered is None:
+            registered = self._scripts[script] = self.handle.register_script(
+                script
+            )
+        return registered
+
+    async def add(self, key, element, count=1):
+        if self._weighted:
+            total, = await self._script(_ADD_SCRIPT)(
+                keys=[key], args=[element.encode(), count]
+            )
+            return total == count
+        return await self.handle.sadd(key, element.encode()) > 0
+
+    async def add_many(self, items):
+        pipeline = self.handle.pipeline(transaction=False)
+        if self._weighted:
+            add = self._script(_ADD_SCRIPT)
+            for keys, args in _add_batches(items):
+                await add(keys=keys, args=args, client=pipeline)
+        else:
+            for key, elements in _group_by_key(items).items():
+                pipeline.sadd(key, *elements)
+        if len(pipeline):
+            await pipeline.execute()
+
+    async def random(self, key, raw=False):
+        """Pick up a random successor of *key*.
+
+        Args:
+            raw: True to return the successor as bytes.
+        """
+        if self._weighted:
+            element = await self._script(_PICK_SCRIPT)(
+                keys=[key], args=[random.random()]
+            )
+        else:
+            element = await self.handle.srandmember(key)
+        return _decode(element, raw)
+
+    async def random_many(self, keys, raw=False):
+        """Pick up a random successor of each of *keys*, in one pipeline.
+
+        Args:
+            raw: True to return the successors as bytes.
+        """
+        pipeline = self.handle.pipeline(transaction=False)
+        if self._weighted:
+            pick = self._script(_PICK_SCRIPT)
+            for key in keys:
+                await pick(
+                    keys=[key], args=[random.random()], client=pipeline
+                )
+        else:
+            for key in keys:
+                pipeline.srandmember(key)
+        return [_decode(element, raw) for element in await pipeline.execute()]
+
+    async def members(self, key):
+        if self._weighted:
+            counts = await self.handle.hgetall(key)
+            return {
+                element.decode(): int(count)
+                for element, count in counts.items()
+            }
+        elements = await self.handle.smembers(key)
+        return {element.decode(): 1 for element in elements}
+
+    async def walk(self, prefix, separator, stop_word, order, max_words):
+        """Generate a whole sentence server side.
+
+        See also:
+            `RedisDatabase.walk`
+
+        """
+        words, = await self.walk_many(
+            1, prefix, separator, stop_word, order, max_words
+        )
+        return words
+
+    async def walk_many(
+        self, n, prefix, separator, stop_word, order, max_words, raw=False
+    ):
+        """Generate *n* sentences server side, in a single pipeline.
+
+        Args:
+            raw: True to return the generated words as bytes.
+
+        See also:
+            `RedisDatabase.walk_many`
+
+        """
+        walk = self._script(_WALK_SCRIPT)
+        pipeline = self.handle.pipeline(transaction=False)
+        for _ in range(n):
+            await walk(
+                args=_walk_args(
+                    prefix,
+                    separator,
+                    stop_word,
+                    order,
+                    max_words,
+                    self._weighted,
+                ),
+                client=pipeline,
+            )
+        sentences = await pipeline.execute()
+        if raw:
+            return sentences
+        return [[word.decode() for word in words] for words in sentences]
+
+    async def delete(self, keys):
+        if keys:
+            await self.handle.delete(*_index_keys(keys))
+
+    async def trim(self, keys, max_successors):
+        """Trim keys server side, in a single round trip.
+
+        See also:
+            `AbstractDatabase.trim`
+
+        """
+        if not keys:
+            return 0
+        return await self._script(_TRIM_SCRIPT)(
+            keys=list(keys),
+            args=[max_successors, "1" if self._weighted else "0"],
+        )
+
+    async def get(self, key):
+        return _decode(await self.handle.get(key), False)
+
+    async def set(self, key, value):
+        await self.handle.set(key, value)
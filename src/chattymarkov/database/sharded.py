@@ -0,0 +1,226 @@
+"""Sharded redis databases for chattymarkov.
+
+A single redis server may neither hold a big model nor serve enough reads.
+`ShardedRedisDatabase` spreads keys across several redis servers, using a
+consistent hash ring so that adding or removing a server only moves the keys
+of its neighbours on the ring.
+
+Sentences cannot be generated server side since the states of a sentence
+live on different servers: each step of the generation is sent to the
+server holding its state instead. Batches, such as the ones of `add_many`
+and `random_many`, are split into one pipeline per server.
+
+"""
+import asyncio
+import bisect
+import hashlib
+import itertools
+
+from .base import AbstractDatabase
+
+
+# Number of points of each node on the hash ring.
+REPLICAS = 160
+
+
+def _hash(value):
+    """Hash *value* to a 64 bits integer, stable across processes."""
+    digest = hashlib.md5(value.encode()).digest()
+    return int.from_bytes(digest[:8], "little")
+
+
+class HashRing:
+    """Consistent hash ring mapping keys to nodes.
+
+    Args:
+        nodes: the names of the nodes.
+        replicas: the number of points of each node on the ring. More points
+            spread keys more evenly across nodes.
+
+    """
+
+    def __init__(self, nodes, replicas=REPLICAS):
+        if not nodes:
+            raise ValueError("A hash ring needs at least one node.")
+        points = sorted(
+            (_hash("{}#{}".format(node, replica)), index)
+            for index, node in enumerate(nodes)
+            for replica in range(replicas)
+        )
+        self.nodes = list(nodes)
+        self._points = [point for point, index in points]
+        self._indexes = [index for point, index in points]
+
+    def index(self, key):
+        """Return the index of the node holding *key*."""
+        position = bisect.bisect(self._points, _hash(key))
+        return self._indexes[position % len(self._points)]
+
+    def node(self, key):
+        """Return the node holding *key*."""
+        return self.nodes[self.index(key)]
+
+
+class _Sharded:
+    """Routing shared by the sharded databases."""
+
+    def __init__(self, nodes, names=None, replicas=REPLICAS):
+        self.nodes = list(nodes)
+        if names is None:
+            names = [str(index) for index in range(len(self.nodes))]
+        self.ring = HashRing(names, replicas)
+
+    @property
+    def weighted(self):
+        return self.nodes[0].weighted
+
+    def _node(self, key):
+        """Return the database holding *key*."""
+        return self.nodes[self.ring.index(key)]
+
+    def _split_items(self, items):
+        """Split the *items* of a batch by node index."""
+        batches = {}
+        index = self.ring.index
+        for item in items:
+            batches.setdefault(index(item[0]), []).append(item)
+        return batches
+
+    def _split_keys(self, keys):
+        """Split *keys* by node index, along with their positions."""
+        batches = {}
+        index = self.ring.index
+        for position, key in enumerate(keys):
+            batch = batches.setdefault(index(key), ([], []))
+            batch[0].append(position)
+            batch[1].append(key)
+        return batches
+
+
+class ShardedRedisDatabase(_Sharded, AbstractDatabase):
+    """Redis database sharded across several servers.
+
+    Args:
+        nodes: the `RedisDatabase` instances of the servers.
+        names: the names identifying each server on the hash ring, which
+            must not change when servers are added or removed. Defaults to
+            their position in *nodes*.
+        replicas: the number of points of each server on the hash ring.
+
+    """
+
+    def add(self, key, element, count=1):
+        return self._node(key).add(key, element, count)
+
+    def add_many(self, items):
+        for index, batch in self._split_items(items).items():
+            self.nodes[index].add_many(batch)
+
+    def random(self, key):
+        return self._node(key).random(key)
+
+    def random_many(self, keys):
+        elements = [None] * len(keys)
+        for index, (positions, batch) in self._split_keys(keys).items():
+            picked = self.nodes[index].random_many(batch)
+            for position, element in zip(positions, picked):
+                elements[position] = element
+        return elements
+
+    def members(self, key):
+        return self._node(key).members(key)
+
+    def scan(self):
+        return itertools.chain.from_iterable(
+            node.scan() for node in self.nodes
+        )
+
+    def delete(self, keys):
+        for index, (positions, batch) in self._split_keys(keys).items():
+            self.nodes[index].delete(batch)
+
+    def trim(self, keys, max_successors):
+        return sum(
+            self.nodes[index].trim(batch, max_successors)
+            for index, (positions, batch) in self._split_keys(keys).items()
+        )
+
+    def get(self, key, default=None):
+        value = self._node(key).get(key)
+        return default if value is None else value
+
+    def set(self, key, value):
+        self._node(key).set(key, value)
+
+
+class ShardedRedisDatabaseAsync(_Sharded):
+    """Asynchronous redis database sharded across several servers.
+
+    Batches are sent to all the servers concurrently.
+
+    See also:
+        `ShardedRedisDatabase`
+
+    """
+
+    async def connect(self):
+        """Connect to every server."""
+        await asyncio.gather(*(node.connect() for node in self.nodes))
+
+    async def close(self):
+        """Close the connections to every server."""
+        await asyncio.gather(*(node.close() for node in self.nodes))
+
+    async def add(self, key, element, count=1):
+        return await self._node(key).add(key, element, count)
+
+    async def add_many(self, items):
+        await asyncio.gather(
+            *(
+                self.nodes[index].add_many(batch)
+                for index, batch in self._split_items(items).items()
+            )
+        )
+
+    async def random(self, key):
+        return await self._node(key).random(key)
+
+    async def random_many(self, keys):
+        batches = self._split_keys(keys).items()
+        results = await asyncio.gather(
+            *(
+                self.nodes[index].random_many(batch)
+                for index, (positions, batch) in batches
+            )
+        )
+        elements = [None] * len(keys)
+        for (index, (positions, batch)), picked in zip(batches, results):
+            for position, element in zip(positions, picked):
+                elements[position] = element
+        return elements
+
+    async def members(self, key):
+        return await self._node(key).members(key)
+
+    async def delete(self, keys):
+        await asyncio.gather(
+            *(
+                self.nodes[index].delete(batch)
+                for index, (positions, batch) in self._split_keys(keys).items()
+            )
+        )
+
+    async def trim(self, keys, max_successors):
+        removed = await asyncio.gather(
+            *(
+                self.nodes[index].trim(batch, max_successors)
+                for index, (positions, batch) in self._split_keys(keys).items()
+            )
+        )
+        return sum(removed)
+
+    async def get(self, key):
+        return await self._node(key).get(key)
+
+    async def set(self, key, value):
+        await self._node(key).set(key, value)
@@ -0,0 +1,507 @@
+"""SQLite database for chattymarkov.
+
+`JSONFileDatabase` loads and stores the whole model at once, and cannot be
+shared between processes. `SQLiteDatabase` stores the model in a SQLite
+file instead: opening it takes constant time, each batch of learned
+messages is written in a single transaction, and the file is opened in WAL
+mode so that several processes may read it while one of them learns.
+
+Schema
+------
+
+- ``words``: every word, interned once and referred to by its identifier.
+- ``states``: every key, along with its number of successors (``size``)
+  and the sum of their counts (``total``).
+- ``transitions``: the successors of each state, numbered by ``position``
+  from 0 to the size of the state, along with their count.
+- ``blocks``: the sum of the counts of each block of successive positions
+  of a state, blocks spanning either `BLOCK` positions or `BLOCK` blocks of
+  `BLOCK` positions.
+- ``data``: the values of `get` and `set`.
+
+Triggers keep ``states`` and ``blocks`` up to date, so that learning a
+successor, or counting it once more, updates a constant number of rows.
+
+Picking a random successor of an unweighted state looks its position up,
+drawn below the size of the state. Weighted states draw a number below
+their total, then add the sums of their largest blocks up to find the block
+the number falls in, then the sums of the smaller blocks within it, then
+the counts of the successors of the smallest one, so that a pick reads
+about `BLOCK` numbers per level whatever the size of the state.
+
+"""
+import asyncio
+import bisect
+import concurrent.futures
+import contextlib
+import functools
+import itertools
+import random
+import sqlite3
+
+from .base import AbstractDatabase
+
+
+# Number of successive positions, or blocks, summed up by each block.
+BLOCK = 64
+
+# Number of positions spanned by the blocks of each level, largest first.
+_SPANS = (BLOCK * BLOCK, BLOCK)
+
+# Statements of the triggers counting a successor in, or out of, its block of
+# each level.
+_ADD_TO_BLOCK = """
+    INSERT INTO blocks (state, span, block, total)
+    VALUES (NEW.state, {span}, NEW.position / {span}, NEW.count)
+    ON CONFLICT (state, span, block)
+    DO UPDATE SET total = total + excluded.total;"""
+_REMOVE_FROM_BLOCK = """
+    UPDATE blocks SET total = total - OLD.count
+    WHERE state = OLD.state AND span = {span}
+        AND block = OLD.position / {span};"""
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS words (
+    id INTEGER PRIMARY KEY,
+    word TEXT NOT NULL UNIQUE
+);
+CREATE TABLE IF NOT EXISTS states (
+    id INTEGER PRIMARY KEY,
+    key TEXT NOT NULL UNIQUE,
+    size INTEGER NOT NULL DEFAULT 0,
+    total INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS transitions (
+    state INTEGER NOT NULL REFERENCES states (id),
+    position INTEGER NOT NULL,
+    word INTEGER NOT NULL REFERENCES words (id),
+    count INTEGER NOT NULL,
+    PRIMARY KEY (state, position)
+) WITHOUT ROWID;
+CREATE UNIQUE INDEX IF NOT EXISTS transitions_word
+    ON transitions (state, word);
+CREATE TABLE IF NOT EXISTS blocks (
+    state INTEGER NOT NULL REFERENCES states (id),
+    span INTEGER NOT NULL,
+    block INTEGER NOT NULL,
+    total INTEGER NOT NULL,
+    PRIMARY KEY (state, span, block)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS data (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+CREATE TRIGGER IF NOT EXISTS transitions_insert
+AFTER INSERT ON transitions
+BEGIN
+    UPDATE states SET size = size + 1, total = total + NEW.count
+    WHERE id = NEW.state;{add_new}
+END;
+CREATE TRIGGER IF NOT EXISTS transitions_update
+AFTER UPDATE OF count, position ON transitions
+BEGIN
+    UPDATE states SET total = total + NEW.count - OLD.count
+    WHERE id = NEW.state;{remove_old}{add_new}
+END;
+CREATE TRIGGER IF NOT EXISTS transitions_delete
+AFTER DELETE ON transitions
+BEGIN
+    UPDATE states SET size = size - 1, total = total - OLD.count
+    WHERE id = OLD.state;{remove_old}
+END;
+""".format(
+    add_new="".join(_ADD_TO_BLOCK.format(span=span) for span in _SPANS),
+    remove_old="".join(
+        _REMOVE_FROM_BLOCK.format(span=span) for span in _SPANS
+    ),
+)
+
+_INSERT_WORD = "INSERT OR IGNORE INTO words (word) VALUES (?)"
+_INSERT_STATE = "INSERT OR IGNORE INTO states (key) VALUES (?)"
+
+# Successors are appended to their state, at the position given by its size.
+_SELECT_TRANSITION = """
+SELECT states.id, states.size, words.id, :count
+FROM states, words
+WHERE states.key = :key AND words.word = :word
+"""
+_INSERT_TRANSITION = "INSERT OR IGNORE INTO transitions " + _SELECT_TRANSITION
+_COUNT_TRANSITION = (
+    "INSERT INTO transitions " + _SELECT_TRANSITION + """
+ON CONFLICT (state, word) DO UPDATE SET count = count + excluded.count
+"""
+)
+
+_STATE = "SELECT id, size, total FROM states WHERE key = ?"
+
+_WORD_AT = """
+SELECT words.word
+FROM transitions
+JOIN words ON words.id = transitions.word
+WHERE transitions.state = ? AND transitions.position = ?
+"""
+
+# Sums of blocks, then counts of the successors of a block, are read as a
+# single string of comma-separated numbers, rather than a row each.
+_BLOCKS = """
+SELECT group_concat(total)
+FROM (
+    SELECT total
+    FROM blocks
+    WHERE state = ? AND span = ? AND block >= ? AND block < ?
+    ORDER BY block
+)
+"""
+
+_COUNTS = """
+SELECT group_concat(count)
+FROM (
+    SELECT count
+    FROM transitions
+    WHERE state = ? AND position >= ? AND position < ?
+    ORDER BY position
+)
+"""
+
+# The successors removed first by `trim`.
+_VICTIMS = """
+SELECT position
+FROM transitions
+WHERE state = ?
+ORDER BY {}
+LIMIT ?
+"""
+_LEAST_COUNTED = _VICTIMS.format("count, position")
+_RANDOM = _VICTIMS.format("random()")
+
+_MEMBERS = """
+SELECT words.word, transitions.count
+FROM states
+JOIN transitions ON transitions.state = states.id
+JOIN words ON words.id = transitions.word
+WHERE states.key = ?
+ORDER BY transitions.position
+"""
+
+_SCAN = """
+SELECT states.key, words.word, transitions.count
+FROM states
+JOIN transitions ON transitions.state = states.id
+JOIN words ON words.id = transitions.word
+ORDER BY states.id, transitions.position
+"""
+
+
+def _fetch(execute, query, args):
+    """Return the first column of the first row of *query*, None if none."""
+    row = execute(query, args).fetchone()
+    return None if row is None else row[0]
+
+
+def _cumulate(numbers):
+    """Return the cumulative sums of comma-separated *numbers*."""
+    return list(itertools.accumulate(map(int, numbers.split(","))))
+
+
+class SQLiteDatabase(AbstractDatabase):
+    """SQLite database class for chattymarkov.
+
+    Args:
+        filepath: path to the SQLite file, created if needed.
+        weighted: True to count how many times each successor is learned,
+            and pick successors proportionally to these counts.
+        timeout: seconds to wait for the lock of another process writing
+            to the same file.
+        check_same_thread: False to allow using the database from several
+            threads, one at a time.
+
+    """
+
+    def __init__(
+        self,
+        filepath,
+        *args,
+        weighted=False,
+        timeout=5.0,
+        check_same_thread=True,
+        **kwargs
+    ):
+        self.filepath = filepath
+        self.weighted = weighted
+        # Transactions are handled explicitly, see `_transaction`.
+        self.connection = sqlite3.connect(
+            filepath,
+            timeout=timeout,
+            isolation_level=None,
+            check_same_thread=check_same_thread,
+        )
+        self.connection.execute("PRAGMA journal_mode = WAL")
+        # Syncing on checkpoints only is safe in WAL mode.
+        self.connection.execute("PRAGMA synchronous = NORMAL")
+        self.connection.executescript(_SCHEMA)
+
+    @contextlib.contextmanager
+    def _transaction(self):
+        """Run the statements of the block in a single transaction."""
+        self.connection.execute("BEGIN IMMEDIATE")
+        try:
+            yield self.connection
+        except BaseException:
+            self.connection.execute("ROLLBACK")
+            raise
+        self.connection.execute("COMMIT")
+
+    def _exists(self, key, element):
+        """Return True if *element* is a successor of *key*."""
+        row = self.connection.execute(
+            "SELECT 1 FROM states "
+            "JOIN transitions ON transitions.state = states.id "
+            "JOIN words ON words.id = transitions.word "
+            "WHERE states.key = ? AND words.word = ?",
+            (key, element),
+        ).fetchone()
+        return row is not None
+
+    def add(self, key, element, count=1):
+        with self._transaction() as connection:
+            added = not self._exists(key, element)
+            if added or self.weighted:
+                self._insert(connection, [(key, element, count)])
+        return added
+
+    def add_many(self, items):
+        if self.weighted:
+            counts = {}
+            for key, element, *count in items:
+                pair = (key, element)
+                counts[pair] = counts.get(pair, 0) + (count[0] if count else 1)
+            rows = [(key, element, count) for (key, element), count in
+                    counts.items()]
+        else:
+            rows = list(
+                dict.fromkeys((key, element, 1) for key, element, *_ in items)
+            )
+        if not rows:
+            return
+        with self._transaction() as connection:
+            self._insert(connection, rows)
+
+    def _insert(self, connection, rows):
+        """Insert *(key, element, count)* rows, within a transaction."""
+        connection.executemany(
+            _INSERT_WORD, ((element,) for key, element, count in rows)
+        )
+        connection.executemany(
+            _INSERT_STATE, ((key,) for key, element, count in rows)
+        )
+        connection.executemany(
+            _COUNT_TRANSITION if self.weighted else _INSERT_TRANSITION,
+            (
+                {"key": key, "word": element, "count": count}
+                for key, element, count in rows
+            ),
+        )
+
+    @contextlib.contextmanager
+    def _snapshot(self):
+        """Run the queries of the block on a single snapshot of the file.
+
+        Picks read several rows of a state, which a concurrent `trim` or
+        `delete` of another process must not change in the meantime.
+        """
+        self.connection.execute("BEGIN")
+        try:
+            yield self.connection.execute
+        finally:
+            self.connection.execute("COMMIT")
+
+    def _pick(self, execute, key):
+        """Pick up a random successor of *key*, None if it has none."""
+        row = execute(_STATE, (key,)).fetchone()
+        if row is None or not row[1]:
+            return None
+        state, size, total = row
+        if not self.weighted:
+            return _fetch(execute, _WORD_AT, (state, random.randrange(size)))
+        drawn = random.randrange(total)
+        # The number is drawn among the positions from start to end, which
+        # narrow down to a single block of each level in turn.
+        start, end = 0, size
+        for span in _SPANS:
+            if end - start <= span:
+                continue
+            first = start // span
+            sums = _fetch(
+                execute, _BLOCKS, (state, span, first, -(-end // span))
+            )
+            if sums is None:
+                return None
+            sums = _cumulate(sums)
+            block = bisect.bisect_right(sums, drawn)
+            if block:
+                drawn -= sums[block - 1]
+            start = (first + block) * span
+            end = min(start + span, end)
+        counts = _fetch(execute, _COUNTS, (state, start, end))
+        if counts is None:
+            return None
+        position = start + bisect.bisect_right(_cumulate(counts), drawn)
+        return _fetch(execute, _WORD_AT, (state, position))
+
+    def random(self, key):
+        with self._snapshot() as execute:
+            return self._pick(execute, key)
+
+    def random_many(self, keys):
+        with self._snapshot() as execute:
+            return [self._pick(execute, key) for key in keys]
+
+    def members(self, key):
+        return dict(self.connection.execute(_MEMBERS, (key,)))
+
+    def scan(self):
+        rows = self.connection.execute(_SCAN)
+        for key, successors in itertools.groupby(rows, lambda row: row[0]):
+            yield key, {word: count for _, word, count in successors}
+
+    def delete(self, keys):
+        keys = [(key,) for key in keys]
+        with self._transaction() as connection:
+            for table in ("transitions", "blocks"):
+                connection.executemany(
+                    "DELETE FROM {} WHERE state = "
+                    "(SELECT id FROM states WHERE key = ?)".format(table),
+                    keys,
+                )
+            connection.executemany("DELETE FROM states WHERE key = ?", keys)
+
+    def trim(self, keys, max_successors):
+        removed = 0
+        victims_query = _LEAST_COUNTED if self.weighted else _RANDOM
+        with self._transaction() as connection:
+            execute = connection.execute
+            for key in keys:
+                row = execute(_STATE, (key,)).fetchone()
+                if row is None or row[1] <= max_successors:
+                    continue
+                state, size, _ = row
+                excess = size - max_successors
+                victims = [
+                    position for position, in
+                    execute(victims_query, (state, excess))
+                ]
+                connection.executemany(
+                    "DELETE FROM transitions "
+                    "WHERE state = ? AND position = ?",
+                    ((state, position) for position in victims),
+                )
+                # Successors beyond the new size fill the holes left below
+                # it, so that positions stay numbered from 0.
+                holes = sorted(
+                    position for position in victims
+                    if position < max_successors
+                )
+                moved = execute(
+                    "SELECT position FROM transitions "
+                    "WHERE state = ? AND position >= ? ORDER BY position",
+                    (state, max_successors),
+                ).fetchall()
+                connection.executemany(
+                    "UPDATE transitions SET position = ? "
+                    "WHERE state = ? AND position = ?",
+                    (
+                        (hole, state, position)
+                        for hole, (position,) in zip(holes, moved)
+                    ),
+                )
+                connection.executemany(
+                    "DELETE FROM blocks "
+                    "WHERE state = ? AND span = ? AND block >= ?",
+                    (
+                        (state, span, -(-max_successors // span))
+                        for span in _SPANS
+                    ),
+                )
+                removed += excess
+        return removed
+
+    def get(self, key, default=None):
+        row = self.connection.execute(
+            "SELECT value FROM data WHERE key = ?", (key,)
+        ).fetchone()
+        return default if row is None else row[0]
+
+    def set(self, key, value):
+        self.connection.execute(
+            "INSERT OR REPLACE INTO data (key, value) VALUES (?, ?)",
+            (key, value),
+        )
+
+    def close(self):
+        """Close the connection to the SQLite file."""
+        self.connection.close()
+
+
+class SQLiteDatabaseAsync:
+    """Asynchronous SQLite database class for chattymarkov.
+
+    The operations of a `SQLiteDatabase` are run by a single thread, one at
+    a time, so that the event loop never waits for the disk.
+
+    See also:
+        `SQLiteDatabase`
+
+    """
+
+    def __init__(self, filepath, *args, **kwargs):
+        self.database = SQLiteDatabase(
+            filepath, *args, check_same_thread=False, **kwargs
+        )
+        self._executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix="chattymarkov-sqlite"
+        )
+
+    @property
+    def weighted(self):
+        return self.database.weighted
+
+    async def _run(self, method, *args):
+        """Run *method* of the database in the thread of the database."""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self._executor, functools.partial(method, *args)
+        )
+
+    async def add(self, key, element, count=1):
+        return await self._run(self.database.add, key, element, count)
+
+    async def add_many(self, items):
+        # Batches may be generators, which must not be consumed by the
+        # thread of the database.
+        await self._run(self.database.add_many, list(items))
+
+    async def random(self, key):
+        return await self._run(self.database.random, key)
+
+    async def random_many(self, keys):
+        return await self._run(self.database.random_many, keys)
+
+    async def members(self, key):
+        return await self._run(self.database.members, key)
+
+    async def delete(self, keys):
+        await self._run(self.database.delete, keys)
+
+    async def trim(self, keys, max_successors):
+        return await self._run(self.database.trim, keys, max_successors)
+
+    async def get(self, key):
+        return await self._run(self.database.get, key)
+
+    async def set(self, key, value):
+        await self._run(self.database.set, key, value)
+
+    async def close(self):
+        """Close the connection and stop the thread of the database."""
+        await self._run(self.database.close)
+        self._executor.shutdown()
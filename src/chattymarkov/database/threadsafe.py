@@ -0,0 +1,152 @@
+"""Thread-safe memory database for chattymarkov.
+
+`MemoryDatabase` does not lock anything: two threads learning the same
+state at once may both create its successors, one of them overwriting the
+other, and a thread picking a successor while another one trims it may pick
+past the end of the successors. `ThreadSafeMemoryDatabase` may be shared by
+the threads of a server instead.
+
+Thread safety
+-------------
+
+- Writers (`add`, `add_many`, `delete` and `trim`) lock the state they
+  write to. States are spread over a fixed number of locks, or stripes,
+  according to the hash of their key, so that threads learning different
+  states seldom wait for each other.
+- Readers picking successors (`random` and `random_many`), which is all
+  that generating sentences does, never lock anything. New successors are
+  published in the database once they hold an element, but are then
+  updated in place: weighted counts are incremented, and `trim` moves the
+  last elements into the place of the removed ones. A pick racing with
+  such an update may thus follow slightly stale counts, or return an
+  element which was just removed or moved, but never one which was never
+  a successor of its state. A pick past the end of successors shrunk by a
+  `trim` raises `IndexError`, and is retried under the lock of its state.
+- Each thread picks successors from a random generator of its own, rather
+  than from the global one of the `random` module.
+
+`ChattyMarkov` instances hold no state besides their database, and may be
+shared by several threads as long as their database may. Synchronous redis
+databases may be shared too, since redis-py connection pools are
+thread-safe. The cache and bounded wrappers, `JSONFileDatabase` and
+`SQLiteDatabase` may not.
+
+"""
+import random
+import threading
+
+from .databases import MemoryDatabase, Successors, _trim_successors
+
+
+# Default number of locks shared by the states of a database.
+STRIPES = 64
+
+
+class ThreadSafeMemoryDatabase(MemoryDatabase):
+    """Memory database class for chattymarkov, shared by several threads.
+
+    Args:
+        db: a pre-existing dict, as `MemoryDatabase` takes.
+        weighted: True to count how many times each successor is learned,
+            and pick successors proportionally to these counts.
+        stripes: the number of locks shared by the states of the database.
+
+    """
+
+    def __init__(self, db=None, *args, stripes=STRIPES, **kwargs):
+        super().__init__(db, *args, **kwargs)
+        self._locks = [threading.Lock() for _ in range(stripes)]
+        self._local = threading.local()
+
+    def _lock(self, key):
+        """Return the lock of the stripe of *key*."""
+        return self._locks[hash(key) % len(self._locks)]
+
+    @property
+    def _rng(self):
+        """The random generator of the calling thread."""
+        rng = getattr(self._local, "rng", None)
+        if rng is None:
+            rng = self._local.rng = random.Random()
+        return rng
+
+    def _add(self, key, element, count):
+        """Add an entry, holding the lock of *key*."""
+        successors = self.db.get(key)
+        if successors is None:
+            # Readers do not lock anything: only publish successors once
+            # they hold an element.
+            successors = self._successors()
+            successors.add(element, count)
+            self.db[key] = successors
+            return True
+        if not isinstance(successors, Successors):
+            return False
+        return successors.add(element, count)
+
+    def add(self, key, element, count=1):
+        with self._lock(key):
+            return self._add(key, element, count)
+
+    def add_many(self, items):
+        # Entries are grouped by stripe, so that each lock is taken once,
+        # and never while holding another one.
+        stripes = {}
+        for item in items:
+            stripes.setdefault(hash(item[0]) % len(self._locks), []).append(
+                item
+            )
+        for index, group in stripes.items():
+            with self._locks[index]:
+                for key, element, *count in group:
+                    self._add(key, element, count[0] if count else 1)
+
+    def _pick(self, key, rng):
+        """Pick up a random successor of *key* without locking it."""
+        successors = self.db.get(key)
+        if not isinstance(successors, Successors):
+            return None
+        try:
+            return successors.choice(rng)
+        except IndexError:
+            pass
+        # A concurrent trim shrank the successors during the pick.
+        with self._lock(key):
+            successors = self.db.get(key)
+            if not isinstance(successors, Successors) or not successors:
+                return None
+            return successors.choice(rng)
+
+    def random(self, key):
+        return self._pick(key, self._rng)
+
+    def random_many(self, keys):
+        rng = self._rng
+        return [self._pick(key, rng) for key in keys]
+
+    def members(self, key):
+        with self._lock(key):
+            return super().members(key)
+
+    def scan(self):
+        for key, value in list(self.db.items()):
+            if isinstance(value, Successors):
+                with self._lock(key):
+                    counts = value.counts()
+                yield key, counts
+
+    def delete(self, keys):
+        for key in keys:
+            with self._lock(key):
+                self.db.pop(key, None)
+
+    def trim(self, keys, max_successors):
+        removed = 0
+        for key in keys:
+            with self._lock(key):
+                successors = self.db.get(key)
+                if isinstance(successors, Successors):
+                    removed += len(
+                        _trim_successors(successors, max_successors)
+                    )
+        return removed
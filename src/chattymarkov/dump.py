@@ -0,0 +1,241 @@
+"""Export and import of chattymarkov models.
+
+`dump` streams the whole transition table of any database providing `scan`
+into a file, and `load` streams it back into any database, in batches of
+`add_many`, so that a model moves between backends without learning its
+sentences again. Redis databases are exported through SCAN and pipelined
+SMEMBERS or HGETALL, and loaded through pipelined SADD or Lua scripts
+counting successors.
+
+`to_resp` turns a dump into redis commands in the RESP protocol, for the
+fastest bulk loading of all, through ``redis-cli --pipe``:
+
+    chattymarkov resp model.ndjson | redis-cli --pipe
+
+File formats
+------------
+
+Both formats are made of one record per key, holding the key along with
+each of its successors and the number of times it has been learned.
+
+- NDJSON: each line is a JSON array made of the key and of an object
+  mapping its successors to their counts.
+- Binary: a header made of a magic number and a format version, then, for
+  each record, the length in bytes of the key and its number of successors,
+  the key in UTF-8, and for each successor its length in bytes and its
+  count followed by the successor in UTF-8. All integers are unsigned,
+  little-endian, 32 bits integers.
+
+`load` and `to_resp` recognize the format of their input by themselves.
+
+"""
+import itertools
+import json
+import struct
+
+from . import training
+from .database.databases import _INDEX_SUFFIX
+
+
+FORMAT_NDJSON = "ndjson"
+FORMAT_BINARY = "binary"
+FORMATS = (FORMAT_NDJSON, FORMAT_BINARY)
+
+MAGIC = b"CMKD"
+VERSION = 1
+
+_HEADER = struct.Struct("<4sH")
+_RECORD = struct.Struct("<II")
+
+# Maximum number of successors of a key sent through a single SADD.
+RESP_BATCH = 1024
+
+
+class DumpError(Exception):
+    """Exception class for invalid dumps."""
+
+
+def _write_ndjson(records, stream):
+    """Write *records* into *stream* as NDJSON."""
+    for key, successors in records:
+        line = json.dumps([key, successors], ensure_ascii=False)
+        stream.write(line.encode() + b"\n")
+
+
+def _write_binary(records, stream):
+    """Write *records* into *stream* in the binary format."""
+    stream.write(_HEADER.pack(MAGIC, VERSION))
+    pack = _RECORD.pack
+    for key, successors in records:
+        key = key.encode()
+        chunks = [pack(len(key), len(successors)), key]
+        for word, count in successors.items():
+            word = word.encode()
+            chunks.append(pack(len(word), count))
+            chunks.append(word)
+        stream.write(b"".join(chunks))
+
+
+def dump(db, stream, format=FORMAT_NDJSON):
+    """Export the content of *db* into *stream*.
+
+    Args:
+        db: the database to export, which must provide `scan`.
+        stream: a binary file object to write the dump to.
+        format: "ndjson" or "binary".
+
+    Returns:
+        The number of exported keys.
+    """
+    if format not in FORMATS:
+        raise ValueError("Unknown dump format '{}'.".format(format))
+    exported = 0
+
+    def records():
+        nonlocal exported
+        for record in db.scan():
+            exported += 1
+            yield record
+
+    if format == FORMAT_NDJSON:
+        _write_ndjson(records(), stream)
+    else:
+        _write_binary(records(), stream)
+    return exported
+
+
+def _read_exactly(stream, size):
+    """Read *size* bytes from *stream*."""
+    data = stream.read(size)
+    if len(data) != size:
+        raise DumpError("Truncated dump.")
+    return data
+
+
+def _read_binary(stream):
+    """Yield the records of a binary dump, past its magic number."""
+    version = _HEADER.unpack(MAGIC + _read_exactly(stream, 2))[1]
+    if version != VERSION:
+        raise DumpError("Unsupported dump version {}.".format(version))
+    unpack = _RECORD.unpack
+    size = _RECORD.size
+    while True:
+        header = stream.read(size)
+        if not header:
+            return
+        if len(header) != size:
+            raise DumpError("Truncated dump.")
+        key_length, count = unpack(header)
+        key = _read_exactly(stream, key_length).decode()
+        successors = {}
+        for _ in range(count):
+            word_length, word_count = unpack(_read_exactly(stream, size))
+            word = _read_exactly(stream, word_length).decode()
+            successors[word] = word_count
+        yield key, successors
+
+
+def _read_ndjson(lines):
+    """Yield the records of the *lines* of a NDJSON dump."""
+    for line in lines:
+        if not line.strip():
+            continue
+        try:
+            key, successors = json.loads(line)
+        except ValueError as exc:
+            raise DumpError("Invalid dump line: {}".format(exc)) from None
+        yield key, successors
+
+
+def read(stream):
+    """Iterate over the records of a dump.
+
+    Args:
+        stream: a binary file object to read the dump from, in either
+            format.
+
+    Yields:
+        A *(key, successors)* pair for each key, *successors* being a dict
+        mapping each of them to its count.
+
+    Raises:
+        DumpError: the dump is invalid.
+    """
+    head = stream.read(len(MAGIC))
+    if head == MAGIC:
+        return _read_binary(stream)
+    lines = itertools.chain([head + stream.readline()], stream)
+    return _read_ndjson(lines)
+
+
+def load(db, stream, merge=None, batch_size=10000):
+    """Import a dump into *db*.
+
+    Args:
+        db: the target database.
+        stream: a binary file object to read the dump from, in either
+            format.
+        merge: "sum" to add the counts of transitions to the ones already
+            in *db*, "union" to add each transition once. Defaults to "sum"
+            for weighted databases and to "union" otherwise.
+        batch_size: the number of transitions to write through each call to
+            the database's `add_many` method.
+
+    Returns:
+        The number of imported keys.
+    """
+    imported = 0
+
+    def records():
+        nonlocal imported
+        for record in read(stream):
+            imported += 1
+            yield record
+
+    training._Loader(db, merge, batch_size).load(records())
+    return imported
+
+
+def _resp_command(*args):
+    """Encode a redis command in the RESP protocol."""
+    chunks = [b"*%d\r\n" % len(args)]
+    for arg in args:
+        if not isinstance(arg, bytes):
+            arg = str(arg).encode()
+        chunks.append(b"$%d\r\n%s\r\n" % (len(arg), arg))
+    return b"".join(chunks)
+
+
+def to_resp(records, stream, weighted=False):
+    """Write the redis commands loading *records* into *stream*.
+
+    Unweighted databases get SADD commands, weighted ones HINCRBY commands,
+    which add counts to the ones already in redis, preceded by a DEL of the
+    index of the key, which the next pick rebuilds.
+
+    Args:
+        records: the *(key, successors)* records to load, as `read` yields
+            them.
+        stream: a binary file object to write the commands to.
+        weighted: True to load a weighted redis database.
+
+    Returns:
+        The number of written commands.
+    """
+    written = 0
+    for key, successors in records:
+        key = key.encode()
+        if weighted:
+            stream.write(_resp_command(b"DEL", key + _INDEX_SUFFIX.encode()))
+            written += 1
+            for word, count in successors.items():
+                stream.write(_resp_command(b"HINCRBY", key, word, count))
+                written += 1
+            continue
+        words = [word.encode() for word in successors]
+        for start in range(0, len(words), RESP_BATCH):
+            stream.write(
+                _resp_command(b"SADD", key, *words[start:start + RESP_BATCH])
+            )
+            written += 1
+    return written
@@ -0,0 +1,193 @@
+"""Frozen, generation-only chattymarkov models.
+
+Generating a sentence out of a database builds a key and looks it up for
+each word, and databases check the type of what they find on every lookup.
+Workers which never learn may compile the content of a database into a
+`FrozenModel` instead: states are numbered, and the successors of each
+state are stored next to each other in flat tuples, along with the number
+of the state each of them leads to, so that picking the next word of a
+sentence takes a couple of indexed lookups.
+
+Weighted models pick successors up through alias tables, which take
+constant time whatever the number of successors.
+
+"""
+import random
+
+from . import MAX_WORDS
+
+
+def _alias_table(counts):
+    """Build the alias table of *counts*, with Vose's method.
+
+    Returns:
+        A *(probabilities, aliases)* pair of lists: picking index *i*
+        uniformly, then keeping it with probability ``probabilities[i]`` and
+        taking ``aliases[i]`` otherwise, picks each index proportionally to
+        its count.
+    """
+    n = len(counts)
+    total = sum(counts)
+    scaled = [count * n / total for count in counts]
+    probabilities = [1.0] * n
+    aliases = list(range(n))
+    small = [i for i, p in enumerate(scaled) if p < 1.0]
+    large = [i for i, p in enumerate(scaled) if p >= 1.0]
+    while small and large:
+        less = small.pop()
+        more = large.pop()
+        probabilities[less] = scaled[less]
+        aliases[less] = more
+        scaled[more] -= 1.0 - scaled[less]
+        if scaled[more] < 1.0:
+            small.append(more)
+        else:
+            large.append(more)
+    return probabilities, aliases
+
+
+class FrozenModel:
+    """Immutable markov model, optimized for generating sentences.
+
+    Instances are built by `freeze`. State 0 is the state sentences start
+    from. The successors of state *s* are the transitions from
+    ``offsets[s]`` to ``offsets[s + 1]``, each made of a word along with the
+    state it leads to, -1 for the stop word.
+
+    """
+
+    __slots__ = (
+        "weighted",
+        "offsets",
+        "words",
+        "states",
+        "probabilities",
+        "aliases",
+    )
+
+    def __init__(self, offsets, words, states, probabilities=None,
+                 aliases=None):
+        self.offsets = tuple(offsets)
+        self.words = tuple(words)
+        self.states = tuple(states)
+        self.weighted = probabilities is not None
+        self.probabilities = tuple(probabilities or ())
+        self.aliases = tuple(aliases or ())
+
+    def __len__(self):
+        """Return the number of states of the model."""
+        return len(self.offsets) - 1
+
+    def generate(self, max_words=MAX_WORDS):
+        """Generate a sentence.
+
+        See also:
+            `ChattyMarkov.generate`
+
+        """
+        offsets = self.offsets
+        words = self.words
+        states = self.states
+        weighted = self.weighted
+        probabilities = self.probabilities
+        aliases = self.aliases
+        rand = random.random
+
+        out = []
+        state = 0
+        while state >= 0 and len(out) < max_words:
+            start = offsets[state]
+            count = offsets[state + 1] - start
+            if not count:
+                break
+            index = start + int(rand() * count)
+            if weighted and rand() >= probabilities[index]:
+                index = start + aliases[index]
+            state = states[index]
+            if state < 0:
+                break
+            out.append(words[index])
+        return " ".join(out)
+
+    def generate_many(self, n, max_words=MAX_WORDS):
+        """Generate *n* sentences.
+
+        See also:
+            `ChattyMarkov.generate_many`
+
+        """
+        return [self.generate(max_words) for _ in range(n)]
+
+
+def freeze(db, prefix, separator, stop_word, order):
+    """Compile the content of *db* into a `FrozenModel`.
+
+    Only the states reachable from the start of a sentence are compiled.
+    Databases providing `scan` are read at once, others are browsed state by
+    state through `members`.
+
+    Args:
+        db: the database to compile, which is not modified.
+        prefix: the prefix prepended to every state key.
+        separator: the separator joining the words of a state.
+        stop_word: the word which ends a sentence.
+        order: the number of words a state is made of.
+
+    Returns:
+        The frozen model.
+    """
+    table = None
+    if hasattr(db, "scan"):
+        try:
+            table = dict(db.scan())
+        except NotImplementedError:
+            pass
+    # Scanned keys are strings, whatever the database.
+    tuple_keys = table is None and getattr(db, "tuple_keys", False)
+
+    initial = ("",) * order
+    numbers = {initial: 0}
+    pending = [initial]
+    offsets = [0]
+    words = []
+    states = []
+    counts = []
+    weighted = False
+
+    # States are numbered in the order they are compiled, breadth first.
+    for state in pending:
+        if tuple_keys:
+            key = (prefix,) + state
+        else:
+            key = prefix + separator.join(state)
+        if table is None:
+            successors = db.members(key)
+        else:
+            successors = table.get(key, {})
+        for word, count in successors.items():
+            if not word or word == stop_word:
+                following = -1
+            else:
+                next_state = state[1:] + (word,)
+                following = numbers.get(next_state)
+                if following is None:
+                    following = numbers[next_state] = len(pending)
+                    pending.append(next_state)
+            words.append(word)
+            states.append(following)
+            counts.append(count)
+            weighted = weighted or count != 1
+        offsets.append(len(words))
+
+    if not weighted:
+        return FrozenModel(offsets, words, states)
+
+    probabilities = []
+    aliases = []
+    for start, end in zip(offsets, offsets[1:]):
+        if start == end:
+            continue
+        state_probabilities, state_aliases = _alias_table(counts[start:end])
+        probabilities.extend(state_probabilities)
+        aliases.extend(state_aliases)
+    return FrozenModel(offsets, words, states, probabilities, aliases)
@@ -0,0 +1,230 @@
+"""Parallel training of chattymarkov models.
+
+`ChattyMarkov.learn` runs on a single core. The `train` function splits the
+input files into shards of lines, and learns from the shards in a pool of
+processes: each worker builds a partial transition table, which the parent
+process merges into the target database as soon as it comes back.
+
+Partial tables map each key to a dict of its successors along with the
+number of times each of them has been seen, and are merged either by summing
+counts, for weighted databases, or as a plain union of transitions.
+
+"""
+import multiprocessing
+import os
+
+from . import ChattyMarkov, database
+
+
+# Merging semantics of partial tables.
+MERGE_SUM = "sum"
+MERGE_UNION = "union"
+MERGE_SEMANTICS = (MERGE_SUM, MERGE_UNION)
+
+# Default size, in bytes, of the shards of input files.
+SHARD_SIZE = 8 * 1024 * 1024
+
+
+def _shards(paths, shard_size):
+    """Yield the *(path, start, end)* byte ranges of the shards of *paths*."""
+    for path in paths:
+        size = os.path.getsize(path)
+        for start in range(0, size, shard_size):
+            yield path, start, min(start + shard_size, size)
+
+
+def _read_shard(path, start, end, encoding):
+    """Yield the lines of *path* starting within the *start*-*end* range.
+
+    A line overlapping two shards belongs to the one it starts in.
+    """
+    with open(path, "rb") as stream:
+        if start:
+            # Skip the end of a line started in the previous shard.
+            stream.seek(start - 1)
+            stream.readline()
+        while stream.tell() < end:
+            line = stream.readline()
+            if not line:
+                break
+            yield line.decode(encoding, errors="replace").rstrip("\r\n")
+
+
+def build_table(messages, extra_prefix="", **options):
+    """Build the partial transition table of *messages*.
+
+    Args:
+        messages: an iterable of sentences to learn from.
+        extra_prefix: an extra prefix to classify the learned sentences.
+        **options: the *prefix*, *separator*, *stop_word* and *order*
+            options of the `ChattyMarkov` instance the table is meant for.
+
+    Returns:
+        A dict mapping each key to a dict of its successors along with the
+        number of times each of them has been seen.
+
+    """
+    markov = ChattyMarkov("memory://", **options)
+    table = {}
+    for msg in messages:
+        if not msg:
+            continue
+        for key, word in markov._transitions(msg, extra_prefix):
+            successors = table.get(key)
+            if successors is None:
+                successors = table[key] = {}
+            successors[word] = successors.get(word, 0) + 1
+    return table
+
+
+def _train_shard(task):
+    """Build the partial table of a shard, in a worker process."""
+    path, start, end, encoding, extra_prefix, options = task
+    return build_table(
+        _read_shard(path, start, end, encoding), extra_prefix, **options
+    )
+
+
+def merge_tables(tables, merge=MERGE_SUM):
+    """Merge partial transition tables into a single one.
+
+    Args:
+        tables: an iterable of partial tables, as built by `build_table`.
+        merge: "sum" to sum the counts of transitions, "union" to count each
+            transition once.
+
+    Returns:
+        The merged table.
+
+    """
+    if merge not in MERGE_SEMANTICS:
+        raise ValueError("Unknown merge semantics '{}'.".format(merge))
+    merged = {}
+    for table in tables:
+        for key, successors in table.items():
+            target = merged.get(key)
+            if target is None:
+                target = merged[key] = {}
+            for word, count in successors.items():
+                if merge == MERGE_SUM:
+                    target[word] = target.get(word, 0) + count
+                else:
+                    target[word] = 1
+    return merged
+
+
+class _Loader:
+    """Load transitions into a database, in batches of `add_many`."""
+
+    def __init__(self, db, merge, batch_size):
+        weighted = getattr(db, "weighted", False)
+        if merge is None:
+            merge = MERGE_SUM if weighted else MERGE_UNION
+        if merge not in MERGE_SEMANTICS:
+            raise ValueError("Unknown merge semantics '{}'.".format(merge))
+        self.db = db
+        self.merge = merge
+        self.batch_size = batch_size
+        # A union into a weighted database must not count a transition
+        # seen by several workers more than once.
+        self._loaded = set() if merge == MERGE_UNION and weighted else None
+
+    def _items(self, records):
+        loaded = self._loaded
+        for key, successors in records:
+            for word, count in successors.items():
+                if self.merge == MERGE_SUM:
+                    yield key, word, count
+                elif loaded is None:
+                    yield key, word
+                elif (key, word) not in loaded:
+                    loaded.add((key, word))
+                    yield key, word
+
+    def load(self, records):
+        """Load *(key, successors)* records, as given by `dict.items`."""
+        batch = []
+        for item in self._items(records):
+            batch.append(item)
+            if len(batch) >= self.batch_size:
+                self.db.add_many(batch)
+                batch = []
+        if batch:
+            self.db.add_many(batch)
+
+
+def load_table(db, table, merge=None, batch_size=10000):
+    """Merge a transition table into *db*.
+
+    Args:
+        db: the target database.
+        table: a transition table, as built by `build_table`.
+        merge: "sum" to add the counts of transitions to the ones already
+            in *db*, "union" to add each transition once, however many
+            times it has been seen. Defaults to "sum" for weighted
+            databases and to "union" otherwise.
+        batch_size: the number of transitions to write through each call to
+            the database's `add_many` method.
+
+    """
+    _Loader(db, merge, batch_size).load(table.items())
+
+
+def train(
+    connect_string,
+    paths,
+    extra_prefix="",
+    processes=None,
+    merge=None,
+    shard_size=SHARD_SIZE,
+    batch_size=10000,
+    encoding="utf-8",
+    **options
+):
+    """Learn from the lines of *paths* in parallel.
+
+    Input files are split into shards of about *shard_size* bytes, each line
+    of which is learned as a message by a pool of *processes* workers. The
+    partial table of each shard is merged into the database as soon as it is
+    built, so that the parent process loads the database while workers keep
+    learning.
+
+    Args:
+        connect_string: the connection string of the target database, or
+            the target database itself.
+        paths: the paths of the files to learn from.
+        extra_prefix: an extra prefix to classify the learned sentences.
+        processes: the number of worker processes, defaults to the number
+            of CPUs. With 1, shards are learned in the current process.
+        merge: how partial tables are merged into the database, see
+            `load_table`.
+        shard_size: the size, in bytes, of the shards of input files.
+        batch_size: the number of transitions written to the database at
+            once.
+        encoding: the encoding of input files.
+        **options: the *prefix*, *separator*, *stop_word* and *order*
+            options of the `ChattyMarkov` instance which will generate
+            sentences from the database.
+
+    Returns:
+        The target database.
+
+    """
+    db = connect_string
+    if isinstance(connect_string, str):
+        db = database.build_database_connection(connect_string)
+    loader = _Loader(db, merge, batch_size)
+
+    tasks = (
+        (path, start, end, encoding, extra_prefix, options)
+        for path, start, end in _shards(paths, shard_size)
+    )
+    if processes == 1:
+        for task in tasks:
+            loader.load(_train_shard(task).items())
+        return db
+
+    with multiprocessing.Pool(processes) as pool:
+        for table in pool.imap_unordered(_train_shard, tasks):
+            loader.load(table.items())
+    return db
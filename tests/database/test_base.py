@@ -0,0 +1,54 @@
+import pytest
+
+from chattymarkov.database.base import AbstractDatabase
+
+
+class DictDatabase(AbstractDatabase):
+    """Database relying on the default implementations where possible."""
+
+    def __init__(self, weighted=False):
+        self.weighted = weighted
+        self.db = {}
+
+    def add(self, key, element, count=1):
+        successors = self.db.setdefault(key, {})
+        successors[element] = successors.get(element, 0) + count
+
+    def members(self, key):
+        return dict(self.db.get(key, {}))
+
+    def scan(self):
+        return iter(self.db.items())
+
+    def delete(self, keys):
+        for key in keys:
+            self.db.pop(key, None)
+
+
+class TestAbstractDatabase:
+    def test_optional(self):
+        """Test that databases need not implement scan and delete."""
+
+        class Minimal(AbstractDatabase):
+            def add(self, key, element, count=1):
+                pass
+
+        db = Minimal()
+        with pytest.raises(NotImplementedError):
+            list(db.scan())
+        with pytest.raises(NotImplementedError):
+            db.delete(["k"])
+
+    def test_trim(self):
+        """Test the default implementation of trim."""
+        db = DictDatabase(weighted=True)
+        db.add_many([("k", "a", 3), ("k", "b"), ("k", "c", 2), ("j", "a")])
+        assert db.trim(["k", "j", "nothing"], 2) == 1
+        assert db.members("k") == {"a": 3, "c": 2}
+        assert db.members("j") == {"a": 1}
+
+        db = DictDatabase()
+        db.add_many([("k", element) for element in "abcde"])
+        assert db.trim(["k"], 3) == 2
+        assert len(db.members("k")) == 3
+        assert set(db.members("k")) <= set("abcde")
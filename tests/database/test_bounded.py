@@ -0,0 +1,210 @@
+import asyncio
+
+import fakeredis
+import pytest
+
+from chattymarkov import ChattyMarkov, ChattyMarkovAsync
+from chattymarkov.database import (BoundedDatabase, BoundedDatabaseAsync,
+                                   CompactDatabase, MemoryDatabase,
+                                   build_database_connection)
+from chattymarkov.database.bounded import _LFU, _LRU
+
+
+class TestUsage:
+    def test_lru(self):
+        """Test that the least recently used key is popped first."""
+        usage = _LRU()
+        for key in "abc":
+            usage.touch(key)
+        usage.touch("a")
+        assert [usage.pop(), usage.pop(), usage.pop()] == ["b", "c", "a"]
+
+    def test_lfu(self):
+        """Test that the least frequently used key is popped first."""
+        usage = _LFU()
+        for key in "abcabacd":
+            usage.touch(key)
+        assert len(usage) == 4
+        # Ties are broken in least recently used order, and the key used
+        # last is popped last.
+        assert [usage.pop() for _ in range(4)] == ["b", "c", "a", "d"]
+        assert len(usage) == 0
+
+    def test_lfu_new_key(self):
+        """Test that a new key outlives the next one."""
+        usage = _LFU()
+        for key in "aabb":
+            usage.touch(key)
+        usage.touch("c")
+        assert usage.pop() == "a"
+        usage.touch("d")
+        assert usage.pop() == "c"
+
+    def test_lfu_aging(self):
+        """Test that uses are halved every window uses."""
+        usage = _LFU(window=10)
+        for key in "aaaaaaaaab":
+            usage.touch(key)
+        assert usage._uses == {"a": 5, "b": 1}
+        for _ in range(5):
+            usage.touch("b")
+        usage.touch("c")
+        # "a" was used more than "b", but a long time ago.
+        assert usage.pop() == "a"
+
+
+class TestBoundedDatabase:
+    def test_build(self):
+        """Test the max_states, max_successors and eviction parameters."""
+        db = build_database_connection(
+            "memory://;max_states=10;max_successors=3;eviction=lfu"
+        )
+        assert isinstance(db, BoundedDatabase)
+        assert isinstance(db.database, MemoryDatabase)
+        assert (db.max_states, db.max_successors) == (10, 3)
+        assert db.eviction == "lfu"
+        assert db.tuple_keys
+
+        db = build_database_connection("memory_async://;max_states=10")
+        assert isinstance(db, BoundedDatabaseAsync)
+
+        assert not isinstance(
+            build_database_connection("memory://"), BoundedDatabase
+        )
+        with pytest.raises(ValueError):
+            build_database_connection("memory://;max_states=1;eviction=fifo")
+
+    def test_max_states(self):
+        """Test that each namespace keeps at most max_states states."""
+        markov = ChattyMarkov("memory://;max_states=4")
+        markov.learn("a b c d e f", "one")
+        markov.learn("a b", "two")
+        keys = list(markov.db.database.db)
+        assert len([k for k in keys if k.startswith("chattymarkov-one-")]) == 4
+        assert len([k for k in keys if k.startswith("chattymarkov-two-")]) == 3
+        assert markov.db.stats() == {
+            "namespaces": 2,
+            "states": 7,
+            "evictions": 3,
+            "trimmed": 0,
+        }
+
+    def test_lru_eviction(self):
+        """Test that generating sentences keeps their states around."""
+        markov = ChattyMarkov("memory://;max_states=6")
+        markov.learn("a b", "chan")
+        markov.learn("c d", "chan")
+        assert markov.generate(namespace="chan") in ("a b", "c d")
+        markov.learn("e", "chan")
+        markov.learn("f", "chan")
+        # The first states of both sentences were used by generate.
+        start = markov._make_key("chan", "\x01")
+        assert start in markov.db.database.db
+        assert len(markov.db.database.db) == 6
+
+    def test_separator(self):
+        """Test splitting keys on the separator of the connection string or
+        of the ChattyMarkov instance."""
+        db = build_database_connection("memory://;max_states=1;separator=%7C")
+        assert db.separator == "|"
+        db = build_database_connection("memory://;max_states=1", separator="|")
+        assert db.separator == "|"
+
+        markov = ChattyMarkov("memory://;max_states=2", separator="|")
+        markov.learn("a b", "chan")
+        markov.learn("c", "other")
+        assert markov.db.stats()["namespaces"] == 2
+        assert set(markov.db.database.db) == {
+            "chattymarkov-chan-|a",
+            "chattymarkov-chan-a|b",
+            "chattymarkov-other-|",
+            "chattymarkov-other-|c",
+        }
+
+    def test_max_successors(self):
+        """Test that states keep at most max_successors successors."""
+        markov = ChattyMarkov("memory://;max_successors=2;weighted=1")
+        for msg in ["a", "a", "a", "b", "b", "c"]:
+            markov.learn(msg)
+        members = markov.db.members(("chattymarkov-", "", ""))
+        assert members == {"a": 3, "b": 2}
+        assert markov.db.stats()["trimmed"] == 1
+        # Uses are not tracked without a limit of states.
+        markov.generate_many(2)
+        assert markov.db.stats()["states"] == 0
+        assert markov.db._namespaces == {}
+
+        db = BoundedDatabase(MemoryDatabase(), max_successors=2)
+        db.add_many([("k", "a"), ("k", "b"), ("k", "c")])
+        assert len(db.members("k")) == 2
+
+    def test_compact(self):
+        """Test bounding a database taking tuple keys."""
+        db = BoundedDatabase(CompactDatabase(), max_states=1)
+        db.add(("p-", "", "a"), "b")
+        db.add(("q-", "", "a"), "b")
+        db.add(("q-", "a", "b"), "c")
+        assert db.members(("p-", "", "a")) == {"b": 1}
+        assert db.members(("q-", "", "a")) == {}
+        assert db.members(("q-", "a", "b")) == {"c": 1}
+
+    def test_redis(self):
+        """Test bounding a redis database."""
+        markov = ChattyMarkov(
+            "redis://localhost;max_states=3;max_successors=1"
+        )
+        markov.db.database.handle = fakeredis.FakeStrictRedis()
+        markov.learn("a b c d", "chan")
+        markov.learn("x y", "other")
+        markov.learn("x z", "other")
+        handle = markov.db.database.handle
+        keys = {key.decode() for key in handle.keys()}
+        assert len([k for k in keys if k.startswith("chattymarkov-chan-")]) \
+            == 3
+        assert all(handle.scard(key) == 1 for key in keys)
+        assert markov.generate(namespace="other") in ("x y", "x z")
+        assert markov.generate_many(2, namespace="nothing") == ["", ""]
+
+    def test_redis_separator(self):
+        """Test walks of a redis database with another separator."""
+        markov = ChattyMarkov("redis://localhost;max_states=8", separator="|")
+        markov.db.database.handle = fakeredis.FakeStrictRedis()
+        markov.learn("a b c", "chan")
+        assert markov.db.database.handle.exists("chattymarkov-chan-a|b")
+        assert markov.generate(namespace="chan") == "a b c"
+        assert markov.db.stats()["states"] == 4
+
+
+class TestBoundedDatabaseAsync:
+    def test_redis(self):
+        """Test bounding an asynchronous redis database."""
+
+        async def run():
+            markov = ChattyMarkovAsync(
+                "redis_async://localhost;max_states=2;eviction=lfu;weighted=1"
+            )
+            markov.db.database.handle = fakeredis.FakeAsyncRedis()
+            await markov.learn("a b c", "chan")
+            await markov.learn("a", "chan")
+            sentences = await markov.generate_many(3, namespace="chan")
+            keys = await markov.db.database.handle.keys()
+            return sentences, {key.decode() for key in keys}
+
+        sentences, keys = asyncio.run(run())
+        # The states of the last sentence evicted the ones of the first.
+        assert keys == {
+            "chattymarkov-chan-\x01",
+            "chattymarkov-chan-\x01a",
+        }
+        assert sentences == ["a", "a", "a"]
+
+    def test_memory(self):
+        """Test bounding an asynchronous memory database."""
+
+        async def run():
+            markov = ChattyMarkovAsync("memory_async://;max_successors=1")
+            await markov.learn_many(["a", "b", "c"], "chan")
+            return markov.db.database.db
+
+        db = asyncio.run(run())
+        assert len(db["chattymarkov-chan-\x01"]) == 1
@@ -0,0 +1,121 @@
+import asyncio
+import time
+
+import fakeredis
+
+from chattymarkov.database import (CachedDatabase, CachedDatabaseAsync,
+                                   MemoryDatabaseAsync, RedisDatabase,
+                                   build_database_connection)
+
+
+class TestCachedDatabase:
+    def setup_method(self, method):
+        self.redis = RedisDatabase(unix_socket_path="/path/to/redis.sock")
+        self.redis.handle = fakeredis.FakeStrictRedis()
+        self.db = CachedDatabase(self.redis, maxsize=2, ttl=60)
+
+    def test_build(self):
+        """Test that the `cache_size` parameter wraps databases."""
+        db = build_database_connection("memory://;cache_size=10;cache_ttl=5")
+        assert isinstance(db, CachedDatabase)
+        assert db.database.db == {}
+
+    def test_random(self):
+        """Test that random picks are served from the cache."""
+        self.redis.add("foo", "bar")
+        assert self.db.random("foo") == "bar"
+        assert self.db.random("foo") == "bar"
+        self.redis.add("foo", "baz")
+        assert self.db.random("foo") == "bar"
+        assert self.db.random("spam") is None
+        assert self.db.random("spam") is None
+        assert self.db.random("spam") is None
+        assert self.db.stats() == {
+            "hits": 2,
+            "misses": 4,
+            "evictions": 0,
+            "size": 2,
+            "successors": 2,
+        }
+
+    def test_admission(self):
+        """Test that keys are only cached on their second miss."""
+        self.redis.add_many([("foo", "bar"), ("foo", "baz")])
+        assert self.db.members("foo") == {"bar": 1, "baz": 1}
+        assert self.db.stats()["size"] == 0
+        self.db._cache.ttl = 0
+        assert self.db.random("foo") in ("bar", "baz")
+        assert self.db.stats()["size"] == 0
+
+        self.db._cache.ttl = 60
+        assert self.db.random("foo") in ("bar", "baz")
+        assert self.db.members("foo") == {"bar": 1, "baz": 1}
+        assert self.db.stats()["size"] == 1
+        assert self.db.stats()["hits"] == 1
+
+    def test_add_invalidates(self):
+        """Test that adding successors invalidates the cached key."""
+        self.db.add("foo", "bar")
+        assert self.db.members("foo") == {"bar": 1}
+        assert self.db.members("foo") == {"bar": 1}
+        self.db.add_many([("foo", "baz")])
+        assert self.db.members("foo") == {"bar": 1, "baz": 1}
+
+    def test_eviction(self):
+        """Test the LRU eviction and the time to live."""
+        for key in ("foo", "bar", "foo", "bar", "baz", "baz"):
+            self.db.random(key)
+        assert self.db.stats()["evictions"] == 1
+        self.db.random("bar")
+        assert self.db.stats()["hits"] == 1
+
+        self.db._cache.ttl = 0
+        self.db.random("qux")
+        self.db.random("qux")
+        time.sleep(0.01)
+        self.db.random("qux")
+        assert self.db.stats()["hits"] == 1
+        assert self.db.stats()["misses"] == 9
+
+    def test_successors_bound(self):
+        """Test that the cache holds at most maxsize successors."""
+        db = CachedDatabase(self.redis, maxsize=3, ttl=60)
+        self.redis.add_many(
+            [("foo", "a"), ("foo", "b"), ("bar", "c"), ("big", "a")]
+            + [("big", str(i)) for i in range(3)]
+        )
+        for key in ("foo", "bar", "big") * 2:
+            db.members(key)
+        assert db.stats() == {
+            "hits": 0,
+            "misses": 6,
+            "evictions": 0,
+            "size": 2,
+            "successors": 3,
+        }
+        db.random("spam")
+        db.random("spam")
+        assert db.stats()["evictions"] == 1
+        assert db.stats()["successors"] == 2
+        assert db.members("bar") == {"c": 1}
+        assert db.stats()["hits"] == 1
+
+
+class TestCachedDatabaseAsync:
+    def test_random(self):
+        """Test the asynchronous cache."""
+        db = CachedDatabaseAsync(MemoryDatabaseAsync())
+
+        async def run():
+            await db.add("foo", "bar")
+            await db.set("spam", "eggs")
+            return [
+                await db.random("foo"),
+                await db.random("foo"),
+                await db.random("foo"),
+                await db.get("spam"),
+            ]
+
+        assert asyncio.run(run()) == ["bar", "bar", "bar", "eggs"]
+        assert db.stats()["hits"] == 1
+        assert db.stats()["misses"] == 2
@@ -0,0 +1,249 @@
+import asyncio
+import gc
+import random
+
+import pytest
+
+from chattymarkov import ChattyMarkovAsync
+from chattymarkov.database import (CoalescingDatabaseAsync, MemoryDatabase,
+                                   MemoryDatabaseAsync,
+                                   build_database_connection)
+
+
+WORDS = ["hello", "world", "there"]
+
+
+class SlowDatabase(MemoryDatabaseAsync):
+    """Memory database answering after a delay, counting its calls."""
+
+    def __init__(self, delay=0.01):
+        super().__init__(weighted=True)
+        self.delay = delay
+        self.calls = []
+        self.inflight = 0
+        self.max_inflight = 0
+
+    async def _slow(self, name):
+        self.calls.append(name)
+        self.inflight += 1
+        self.max_inflight = max(self.max_inflight, self.inflight)
+        try:
+            await asyncio.sleep(self.delay)
+        finally:
+            self.inflight -= 1
+
+    async def members(self, key):
+        await self._slow("members")
+        return await super().members(key)
+
+    async def random(self, key):
+        await self._slow("random")
+        return await super().random(key)
+
+    async def random_many(self, keys):
+        await self._slow("random_many")
+        return [await MemoryDatabaseAsync.random(self, key) for key in keys]
+
+
+class WalkingDatabase(SlowDatabase):
+    """Slow database generating sentences of a single word server side."""
+
+    async def walk(self, prefix, separator, stop_word, order, max_words):
+        await self._slow("walk")
+        return [random.choice(WORDS)][:max_words]
+
+    async def walk_many(
+        self, n, prefix, separator, stop_word, order, max_words
+    ):
+        await self._slow(("walk_many", n))
+        return [[random.choice(WORDS)][:max_words] for _ in range(n)]
+
+
+class TestCoalescingDatabaseAsync:
+    def setup_method(self, method):
+        self.database = SlowDatabase()
+        self.db = CoalescingDatabaseAsync(self.database)
+
+    def test_build(self):
+        """Test the coalesce and max_inflight parameters."""
+        db = build_database_connection(
+            "memory_async://;coalesce=1;max_inflight=4;cache_size=10", True
+        )
+        assert isinstance(db.database, CoalescingDatabaseAsync)
+        assert db.database.coalesce
+        assert db.database.max_inflight == 4
+
+        db = build_database_connection("memory_async://;max_inflight=4", True)
+        assert not db.coalesce
+        assert isinstance(
+            build_database_connection("memory://;coalesce=1"), MemoryDatabase
+        )
+
+    def test_coalesce(self):
+        """Test that concurrent lookups of a key share a single call."""
+
+        async def run():
+            await self.db.add_many([("k", "a", 3), ("k", "b")])
+            picks = await asyncio.gather(
+                *[self.db.random("k") for _ in range(50)],
+                self.db.members("k"),
+                self.db.random("nothing"),
+            )
+            # Lookups made once the call completed make calls of their own.
+            picks.append(await self.db.random("k"))
+            return picks
+
+        picks = asyncio.run(run())
+        # Each lookup picks its own successor.
+        assert set(picks[:50]) == {"a", "b"}
+        assert picks[50:52] == [{"a": 3, "b": 1}, None]
+        assert picks[52] in ("a", "b")
+        assert self.database.calls == [
+            "random_many", "members", "random", "random"
+        ]
+        assert self.db.stats() == {"calls": 5, "coalesced": 49}
+
+    def test_members(self):
+        """Test that concurrent fetches of a key share the call in flight."""
+
+        async def run():
+            await self.db.add_many([("k", "a", 3), ("k", "b")])
+            fetch = asyncio.ensure_future(self.db.members("k"))
+            await asyncio.sleep(0)
+            members = await asyncio.gather(
+                self.db.members("k"), self.db.members("k")
+            )
+            members.append(await fetch)
+            members[0]["c"] = 1
+            return members
+
+        members = asyncio.run(run())
+        assert members[1:] == [{"a": 3, "b": 1}] * 2
+        assert self.database.calls == ["members"]
+        assert self.db.stats() == {"calls": 2, "coalesced": 2}
+
+    def test_random_many(self):
+        """Test that batches join the lookups in flight."""
+
+        async def run():
+            await self.db.add_many([("k", "a"), ("l", "b")])
+            lookup = asyncio.ensure_future(self.db.random("k"))
+            await asyncio.sleep(0)
+            elements = await self.db.random_many(["k", "l", "k", "m"])
+            return elements, await lookup
+
+        elements, element = asyncio.run(run())
+        assert elements == ["a", "b", "a", None]
+        assert element == "a"
+        assert self.database.calls == ["random_many"] * 2
+        assert self.db.stats() == {"calls": 3, "coalesced": 2}
+
+    def test_cancel(self):
+        """Test that cancelled lookups do not cancel the shared call."""
+
+        async def run():
+            await self.db.add("k", "a")
+            lookups = [
+                asyncio.ensure_future(self.db.random("k")) for _ in range(3)
+            ]
+            await asyncio.sleep(0)
+            lookups[0].cancel()
+            return await asyncio.gather(*lookups[1:])
+
+        assert asyncio.run(run()) == ["a", "a"]
+        assert self.database.calls == ["random_many"]
+
+    def test_max_inflight(self):
+        """Test that at most max_inflight calls are in flight at once."""
+        db = CoalescingDatabaseAsync(
+            self.database, coalesce=False, max_inflight=3
+        )
+
+        async def run():
+            await db.add("k", "a")
+            return await asyncio.gather(*[db.random("k") for _ in range(10)])
+
+        assert asyncio.run(run()) == ["a"] * 10
+        assert self.database.calls == ["random"] * 10
+        assert self.database.max_inflight == 3
+
+    def test_event_loops(self):
+        """Test limiting calls in flight from several event loops."""
+        db = CoalescingDatabaseAsync(
+            self.database, coalesce=False, max_inflight=2
+        )
+
+        async def run():
+            await db.add("k", "a")
+            return await asyncio.gather(*[db.random("k") for _ in range(5)])
+
+        assert asyncio.run(run()) == ["a"] * 5
+        assert asyncio.run(run()) == ["a"] * 5
+        assert self.database.max_inflight == 2
+
+    def test_random_many_error(self, caplog):
+        """Test that a failing batch leaves no unretrieved exception."""
+
+        class Error(Exception):
+            pass
+
+        async def fail(keys):
+            await asyncio.sleep(0.01)
+            raise Error()
+
+        async def run():
+            await self.db.add("k", "a")
+            lookup = asyncio.ensure_future(self.db.random("k"))
+            await asyncio.sleep(0)
+            self.database.random_many = fail
+            with pytest.raises(Error):
+                await self.db.random_many(["k", "l"])
+            with pytest.raises(Error):
+                await lookup
+
+        asyncio.run(run())
+        gc.collect()
+        assert "never retrieved" not in caplog.text
+
+    def test_generate(self):
+        """Test generating sentences at once through coalesced lookups."""
+
+        async def run():
+            markov = ChattyMarkovAsync(
+                "memory_async://;coalesce=1;max_inflight=2"
+            )
+            await markov.learn_many(["hello world", "hello there"])
+            return await asyncio.gather(
+                *[markov.generate() for _ in range(20)],
+                markov.generate_many(5, deadline=10),
+            )
+
+        *sentences, many = asyncio.run(run())
+        assert set(sentences) <= {"hello world", "hello there"}
+        assert set(many) <= {"hello world", "hello there"}
+
+    def test_walk(self):
+        """Test that concurrent walks with the same arguments share a call."""
+        database = WalkingDatabase()
+
+        async def run():
+            markov = ChattyMarkovAsync("memory_async://")
+            markov.db = CoalescingDatabaseAsync(database)
+            sentences = await asyncio.gather(
+                *[markov.generate() for _ in range(20)],
+                markov.generate_many(5),
+                markov.generate(max_words=0),
+            )
+            # Walks made once the call completed make calls of their own.
+            sentences.append(await markov.generate_many(2))
+            return sentences, markov.db.stats()
+
+        (*sentences, many, empty, alone), stats = asyncio.run(run())
+        # Each walk generates its own sentence.
+        assert set(sentences) == set(WORDS)
+        assert set(many + alone) <= set(WORDS)
+        assert empty == ""
+        assert database.calls == [
+            ("walk_many", 25), "walk", ("walk_many", 2)
+        ]
+        assert stats == {"calls": 3, "coalesced": 24}
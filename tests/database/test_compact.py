@@ -0,0 +1,84 @@
+from chattymarkov import ChattyMarkov
+from chattymarkov.database import CompactDatabase, build_database_connection
+
+
+class TestCompactDatabase:
+    def setup_method(self, method):
+        self.db = CompactDatabase()
+
+    def test_build(self):
+        """Test that `compact://` builds a CompactDatabase instance."""
+        db = build_database_connection("compact://")
+        assert isinstance(db, CompactDatabase)
+
+    def test_add(self):
+        """Test the `add` method from the CompactDatabase class."""
+        assert self.db.add('p-foo\x01bar', 'baz')
+        assert not self.db.add('p-foo\x01bar', 'baz')
+        assert self.db.add('p-foo\x01bar', 'qux')
+        assert not self.db.add('p-foo\x01bar', 'qux')
+        assert self.db.add('p-foo\x01bar', 'bar')
+
+    def test_many_successors(self):
+        """Test adding, picking and trimming many successors of a state."""
+        elements = [str(i) for i in range(100)]
+        for element in elements:
+            assert self.db.add('p-foo', element)
+        assert not any(self.db.add('p-foo', element) for element in elements)
+        assert list(self.db.members('p-foo')) == elements
+        assert self.db.random('p-foo') in elements
+
+        assert self.db.trim(['p-foo'], 20) == 80
+        kept = list(self.db.members('p-foo'))
+        assert len(kept) == 20
+        assert not any(self.db.add('p-foo', element) for element in kept)
+        assert self.db.add('p-foo', next(
+            element for element in elements if element not in kept
+        ))
+
+    def test_random(self):
+        """Test the `random` method from the CompactDatabase class."""
+        self.db.add('p-foo\x01bar', 'baz')
+        assert self.db.random('p-foo\x01bar') == 'baz'
+        self.db.add('p-foo\x01bar', 'qux')
+        assert self.db.random('p-foo\x01bar') in ('baz', 'qux')
+        assert self.db.random('p-foo\x01baz') is None
+        assert self.db.random('p-spam\x01eggs') is None
+
+    def test_delete_trim(self):
+        """Test the `delete` and `trim` methods from CompactDatabase."""
+        for element in 'abcd':
+            self.db.add('p-foo', element)
+        self.db.add('p-bar', 'baz')
+        assert self.db.trim(['p-foo', 'p-bar', 'p-nothing'], 1) == 3
+        assert len(self.db.members('p-foo')) == 1
+        self.db.delete(['p-foo'])
+        assert self.db.members('p-foo') == {}
+        assert self.db.members('p-bar') == {'baz': 1}
+
+    def test_get_set(self):
+        """Test the `get` and `set` methods from CompactDatabase."""
+        assert self.db.get('foo', 'default') == 'default'
+        self.db.set('foo', 'bar')
+        assert self.db.get('foo') == 'bar'
+
+    def test_tuple_keys(self):
+        """Test that tuple keys match their string counterpart."""
+        self.db.add(('p-', 'foo', 'bar'), 'baz')
+        self.db.add(('p-', 'well-known', 'bar'), 'qux')
+        assert self.db.random('p-foo\x01bar') == 'baz'
+        assert self.db.random('p-well-known\x01bar') == 'qux'
+        assert self.db.random(('p-', 'well-known', 'bar')) == 'qux'
+        assert dict(self.db.scan()) == {
+            'p-foo\x01bar': {'baz': 1},
+            'p-well-known\x01bar': {'qux': 1},
+        }
+
+    def test_separator(self):
+        """Test that the separator of the instance joins scanned keys."""
+        markov = ChattyMarkov("compact://", separator="|")
+        assert markov.db.separator == "|"
+        markov.learn("a b c")
+        assert markov.generate() == "a b c"
+        assert markov.freeze().generate() == "a b c"
+        assert "chattymarkov-a|b" in dict(markov.db.scan())
@@ -17,3 +17,21 @@ class TestDatabase(unittest.TestCase):
         self.assertEquals(redis_socket_connection.db, 3)
         self.assertEquals(redis_socket_connection.host, "localhost")
         self.assertEquals(redis_socket_connection.port, 12345)
+
+        redis_url_connection = database.build_database_connection(
+            "redis://:secret@example.com:6380/2")
+        self.assertEqual(redis_url_connection.host, "example.com")
+        self.assertEqual(redis_url_connection.port, 6380)
+        self.assertEqual(redis_url_connection.password, "secret")
+        self.assertEqual(redis_url_connection.db, 2)
+
+    def test_weighted_connection(self):
+        """Test the `weighted` connection string parameter."""
+        memory = database.build_database_connection("memory://;weighted=1")
+        self.assertTrue(memory.weighted)
+        memory = database.build_database_connection("memory://")
+        self.assertFalse(memory.weighted)
+
+        redis = database.build_database_connection(
+            "redis:///path/to/redis/unix_socket.sock;weighted=true")
+        self.assertTrue(redis.weighted)
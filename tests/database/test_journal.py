@@ -0,0 +1,164 @@
+import json
+import os
+import tempfile
+import time
+
+from chattymarkov.database import (JournaledJSONFileDatabase,
+                                   build_database_connection)
+
+
+class TestJournaledJSONFileDatabase:
+    def setup_method(self, method):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'db.json')
+        self.databases = []
+
+    def teardown_method(self, method):
+        for db in self.databases:
+            db.cleanup()
+        self.directory.cleanup()
+
+    def open(self, **kwargs):
+        db = JournaledJSONFileDatabase(self.path, **kwargs)
+        self.databases.append(db)
+        return db
+
+    def crash(self, db):
+        """Stop *db* without storing its snapshot, as if the process died."""
+        db._closing.set()
+        db._thread.join()
+        self.databases.remove(db)
+
+    def test_build(self):
+        """Test that the `journal` parameter builds a journaled database."""
+        db = build_database_connection(
+            'json://{};journal=1;fsync=always'.format(self.path))
+        self.databases.append(db)
+        assert isinstance(db, JournaledJSONFileDatabase)
+        assert db.fsync == 'always'
+
+    def test_replay(self):
+        """Test that flushed changes survive a crash."""
+        db = self.open(weighted=True)
+        db.add('foo', 'bar')
+        db.add('foo', 'bar')
+        db.set('spam', 'eggs')
+        db.flush()
+        self.crash(db)
+
+        db = self.open(weighted=True)
+        assert db.db['foo'].count('bar') == 2
+        assert db.get('spam') == 'eggs'
+
+    def test_replay_removals(self):
+        """Test that deleted keys and trimmed successors stay removed."""
+        db = self.open()
+        for element in 'abcd':
+            db.add('foo', element)
+        db.add('spam', 'eggs')
+        db.trim(['foo'], 1)
+        db.delete(['spam'])
+        members = db.members('foo')
+        db.flush()
+        self.crash(db)
+
+        db = self.open()
+        assert db.members('foo') == members
+        assert db.members('spam') == {}
+
+    def test_cleanup(self):
+        """Test that exiting syncs the journal, not a new snapshot."""
+        db = self.open()
+        db.add('foo', 'bar')
+        db.compact()
+        with open(self.path) as stream:
+            snapshot = stream.read()
+        db.add('foo', 'baz')
+        db.cleanup()
+        with open(self.path) as stream:
+            assert stream.read() == snapshot
+        with open(db.journal_path) as stream:
+            assert 'baz' in stream.read()
+
+        db = self.open()
+        assert db.members('foo') == {'bar': 1, 'baz': 1}
+
+    def test_truncated_journal(self):
+        """Test that a partially written change is ignored."""
+        db = self.open()
+        db.add('foo', 'bar')
+        db.flush()
+        self.crash(db)
+        with open(db.journal_path, 'a') as stream:
+            stream.write('["a", "foo", "ba')
+
+        db = self.open()
+        assert list(db.db['foo']) == ['bar']
+        db.add('foo', 'baz')
+        db.flush()
+        self.crash(db)
+
+        db = self.open()
+        assert list(db.db['foo']) == ['bar', 'baz']
+
+    def test_compact(self):
+        """Test that compaction stores a snapshot and empties the journal."""
+        db = self.open(weighted=True)
+        db.add('foo', 'bar')
+        db.flush()
+        db.compact()
+        with open(self.path) as stream:
+            assert json.load(stream) == {'foo': {'bar': 1}}
+        with open(db.journal_path) as stream:
+            assert len(stream.readlines()) == 1
+
+        # A journal outliving its snapshot is not replayed.
+        db.add('foo', 'bar')
+        db.flush()
+        with open(db.journal_path) as stream:
+            stale_journal = stream.read()
+        db.compact()
+        self.crash(db)
+        with open(db.journal_path, 'w') as stream:
+            stream.write(stale_journal)
+
+        db = self.open(weighted=True)
+        assert db.db['foo'].count('bar') == 2
+
+    def test_flusher_survives_errors(self):
+        """Test that the flusher logs errors and keeps journaling."""
+        db = self.open(weighted=True, flush_interval=0.01)
+        failures = []
+        writelines = db._journal.writelines
+
+        def fail_once(lines):
+            if not failures:
+                failures.append(True)
+                raise OSError("No space left on device")
+            writelines(lines)
+
+        db._journal.writelines = fail_once
+        db.add('foo', 'bar')
+        while not failures:
+            time.sleep(0.01)
+        db.add('foo', 'baz')
+        time.sleep(0.1)
+        assert db._thread.is_alive()
+        db.flush()
+        self.crash(db)
+
+        # The changes of the failed write were kept for the next one.
+        db = self.open(weighted=True)
+        assert db.db['foo'].counts() == {'bar': 1, 'baz': 1}
+
+    def test_compact_while_flushing(self):
+        """Test compacting while the flusher reads the journal size."""
+        db = self.open(flush_interval=0.001)
+        for i in range(200):
+            db.add('foo', str(i))
+            db.compact()
+        assert db._thread.is_alive()
+        db.flush()
+        self.crash(db)
+        db = self.open()
+        assert len(db.db['foo']) == 200
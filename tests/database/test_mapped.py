@@ -0,0 +1,109 @@
+import multiprocessing
+import os
+import tempfile
+
+import pytest
+
+from chattymarkov import ChattyMarkov
+from chattymarkov.database import (MappedDatabase, MappedDatabaseError,
+                                   MemoryDatabase, SharedMappedDatabase,
+                                   build_database_connection,
+                                   build_mapped_file, share_mapped_model)
+
+
+class TestMappedDatabase:
+    def setup_method(self, method):
+        fd, self.path = tempfile.mkstemp(suffix='.cmkv')
+        os.close(fd)
+
+    def teardown_method(self, method):
+        os.unlink(self.path)
+
+    def test_round_trip(self):
+        """Test that a mapped database serves what it was built from."""
+        source = MemoryDatabase()
+        for i in range(100):
+            source.add('key{}'.format(i), 'foo')
+            source.add('key{}'.format(i), 'bär{}'.format(i))
+        source.set('spam', 'eggs')
+        build_mapped_file(source, self.path)
+
+        db = build_database_connection('mmap://{}'.format(self.path))
+        assert isinstance(db, MappedDatabase)
+        assert not db.weighted
+        assert db.random('key42') in ('foo', 'bär42')
+        assert db.random('unknown') is None
+        assert dict(db.scan()) == dict(source.scan())
+        with pytest.raises(MappedDatabaseError):
+            db.add('key1', 'foo')
+        db.close()
+
+    def test_weighted(self):
+        """Test that weighted mapped databases honor counts."""
+        source = MemoryDatabase(weighted=True)
+        source.add('foo', 'bar', 1000)
+        source.add('foo', 'baz')
+        build_mapped_file(source, self.path)
+
+        db = MappedDatabase(self.path)
+        assert db.weighted
+        picks = [db.random('foo') for _ in range(100)]
+        assert picks.count('bar') > 90
+        assert dict(db.scan()) == {'foo': {'bar': 1000, 'baz': 1}}
+        db.close()
+
+
+def generate_in_worker(name, queue):
+    """Generate sentences out of a shared model, in another process."""
+    markov = ChattyMarkov('shm://{}'.format(name))
+    queue.put(markov.generate_many(5))
+    markov.db.close()
+
+
+class TestSharedMappedDatabase:
+    def setup_method(self, method):
+        self.markov = ChattyMarkov('memory://;weighted=1')
+        self.markov.learn_many(['hello wörld', 'hello world', 'hello world'])
+        self.shared = share_mapped_model(self.markov.db)
+
+    def teardown_method(self, method):
+        self.shared.close()
+        self.shared.unlink()
+
+    def test_round_trip(self):
+        """Test that a shared database serves what it was built from."""
+        assert self.shared.weighted
+        db = build_database_connection('shm://{}'.format(self.shared.name))
+        assert isinstance(db, SharedMappedDatabase)
+        assert dict(db.scan()) == dict(self.markov.db.scan())
+        key = self.markov._make_key('', '\x01hello')
+        assert db.members(key) == {'wörld': 1, 'world': 2}
+        assert db.random(key) in ('wörld', 'world')
+        with pytest.raises(MappedDatabaseError):
+            db.add(key, 'foo')
+        db.close()
+
+    @pytest.mark.skipif(
+        'fork' not in multiprocessing.get_all_start_methods(),
+        reason='fork is not available',
+    )
+    def test_workers(self):
+        """Test generating sentences in forked workers."""
+        context = multiprocessing.get_context('fork')
+        queue = context.Queue()
+        workers = [
+            context.Process(
+                target=generate_in_worker, args=(self.shared.name, queue)
+            )
+            for _ in range(2)
+        ]
+        for worker in workers:
+            worker.start()
+        results = [queue.get(timeout=10) for _ in workers]
+        for worker in workers:
+            worker.join()
+            assert worker.exitcode == 0
+        for sentences in results:
+            assert set(sentences) <= {'hello wörld', 'hello world'}
+        # Workers leave the segment to its owner.
+        assert self.shared.random(self.markov._make_key('', '\x01hello'))
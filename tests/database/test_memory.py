@@ -1,4 +1,8 @@
-from chattymarkov.database import MemoryDatabase
+import json
+import os
+import tempfile
+
+from chattymarkov.database import JSONFileDatabase, MemoryDatabase
 
 
 class TestMemoryDatabase:
@@ -10,3 +14,104 @@ class TestMemoryDatabase:
         self.db.add('foo', 'bar')
         assert 'foo' in self.db.db
         assert 'bar' in self.db.db['foo']
+
+    def test_add_duplicate(self):
+        """Test that `add` keeps a single copy of each element."""
+        assert self.db.add('foo', 'bar')
+        assert not self.db.add('foo', 'bar')
+        assert list(self.db.db['foo']) == ['bar']
+        assert self.db.random('foo') == 'bar'
+
+    def test_delete_trim(self):
+        """Test removing keys and successors."""
+        for element in 'abcde':
+            self.db.add('foo', element)
+        self.db.add('spam', 'eggs')
+        assert self.db.trim(['foo', 'spam', 'nothing'], 2) == 3
+        assert len(self.db.members('foo')) == 2
+        assert set(self.db.members('foo')) <= set('abcde')
+        assert self.db.random('foo') in self.db.members('foo')
+        self.db.delete(['foo', 'nothing'])
+        assert self.db.members('foo') == {}
+        assert self.db.members('spam') == {'eggs': 1}
+
+    def test_get_set(self):
+        """Test that `set` and `get` take and return lists of successors."""
+        self.db.set('foo', ['bar', 'baz'])
+        self.db.set('spam', 'eggs')
+        assert self.db.random('foo') in ('bar', 'baz')
+        assert self.db.get('foo') == ['bar', 'baz']
+        assert self.db.get('spam') == 'eggs'
+        assert self.db.get('nothing', 'default') == 'default'
+
+    def test_copy(self):
+        """Test that the given dict is left untouched."""
+        db = {'foo': ['bar']}
+        self.db = MemoryDatabase(db)
+        self.db.add('foo', 'baz')
+        assert db == {'foo': ['bar']}
+        assert self.db.members('foo') == {'bar': 1, 'baz': 1}
+
+
+class TestWeightedMemoryDatabase:
+    def setup_method(self, method):
+        self.db = MemoryDatabase(weighted=True)
+
+    def test_add(self):
+        """Test that weighted databases count the added elements."""
+        assert self.db.add('foo', 'bar')
+        assert not self.db.add('foo', 'bar', 2)
+        self.db.add('foo', 'baz')
+        assert self.db.db['foo'].count('bar') == 3
+        assert self.db.db['foo'].dump() == {'bar': 3, 'baz': 1}
+
+    def test_random(self):
+        """Test that random picks are proportional to counts."""
+        self.db.add('foo', 'bar', 1000)
+        self.db.add('foo', 'baz')
+        picks = [self.db.random('foo') for _ in range(100)]
+        assert picks.count('bar') > 90
+        assert self.db.random('spam') is None
+
+    def test_trim(self):
+        """Test that the least counted successors are trimmed first."""
+        self.db.add('foo', 'bar', 3)
+        self.db.add('foo', 'baz')
+        self.db.add('foo', 'qux', 2)
+        assert self.db.trim(['foo'], 2) == 1
+        assert self.db.members('foo') == {'bar': 3, 'qux': 2}
+        picks = {self.db.random('foo') for _ in range(100)}
+        assert picks == {'bar', 'qux'}
+
+
+class TestJSONFileDatabase:
+    def setup_method(self, method):
+        fd, self.path = tempfile.mkstemp(suffix='.json')
+        os.close(fd)
+        with open(self.path, 'w') as stream:
+            json.dump({'foo': ['bar', 'baz'], 'spam': 'eggs'}, stream)
+
+    def teardown_method(self, method):
+        os.unlink(self.path)
+
+    def test_round_trip(self):
+        """Test that JSONFileDatabase stores back what it loaded."""
+        db = JSONFileDatabase(self.path)
+        assert 'baz' in db.db['foo']
+        db.add('foo', 'qux')
+        db.cleanup()
+
+        with open(self.path) as stream:
+            assert json.load(stream) == {
+                'foo': ['bar', 'baz', 'qux'],
+                'spam': 'eggs',
+            }
+
+    def test_weighted_round_trip(self):
+        """Test that weighted JSONFileDatabase stores counts."""
+        db = JSONFileDatabase(self.path, weighted=True)
+        db.add('foo', 'bar')
+        db.cleanup()
+
+        with open(self.path) as stream:
+            assert json.load(stream)['foo'] == {'bar': 2, 'baz': 1}
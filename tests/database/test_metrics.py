@@ -0,0 +1,124 @@
+import asyncio
+
+import fakeredis
+import pytest
+
+from chattymarkov import ChattyMarkov, ChattyMarkovAsync
+from chattymarkov.database import (BoundedDatabase, InstrumentedDatabase,
+                                   MemoryDatabase, Metrics,
+                                   build_database_connection)
+
+
+class TestInstrumentedDatabase:
+    def test_build(self):
+        """Test the `metrics` connection string parameter."""
+        db = build_database_connection("memory://;metrics=1")
+        assert isinstance(db, InstrumentedDatabase)
+        assert isinstance(db.database, MemoryDatabase)
+        db = build_database_connection("memory://")
+        assert isinstance(db, MemoryDatabase)
+
+    def test_record(self):
+        """Test that calls made by learn and generate are recorded."""
+        calls = []
+        markov = ChattyMarkov("memory://;metrics=1")
+        markov.db.metrics.callback = (
+            lambda operation, seconds, error: calls.append(operation))
+        markov.learn("hello world")
+        assert markov.generate() == "hello world"
+
+        snapshot = markov.db.metrics.snapshot()
+        assert snapshot["add_many"]["calls"] == 1
+        assert snapshot["add_many"]["sent"] > len("hello world")
+        assert snapshot["random"]["calls"] == 3
+        assert snapshot["random"]["received"] == len("hello world\x02") - 1
+        assert sum(snapshot["random"]["buckets"].values()) == 3
+        assert calls == ["add_many", "random", "random", "random"]
+
+    def test_errors(self):
+        """Test that failing calls are recorded."""
+        class FailingDatabase(MemoryDatabase):
+            def add(self, key, element, count=1):
+                raise ValueError("read-only")
+
+        db = InstrumentedDatabase(FailingDatabase())
+        with pytest.raises(ValueError):
+            db.add("foo", "bar")
+        assert db.metrics.snapshot()["add"]["errors"] == 1
+
+    def test_walk(self):
+        """Test that the wrapper provides the operations of the database."""
+        db = InstrumentedDatabase(MemoryDatabase())
+        assert not hasattr(db, "walk")
+        assert db.weighted is False
+
+        markov = ChattyMarkov("redis://localhost;metrics=1")
+        markov.db.database.handle = fakeredis.FakeStrictRedis()
+        markov.learn("hello world")
+        assert markov.generate() == "hello world"
+        assert markov.db.metrics.snapshot()["walk"]["calls"] == 1
+
+    def test_async(self):
+        """Test instrumenting an asynchronous database."""
+        markov = ChattyMarkovAsync("memory_async://;metrics=1;cache_size=8")
+
+        async def run():
+            await markov.learn("hello world")
+            return await markov.generate()
+
+        assert asyncio.run(run()) == "hello world"
+        snapshot = markov.db.metrics.snapshot()
+        assert snapshot["random"]["calls"] == 3
+        assert snapshot["cache"]["misses"] == 3
+
+    def test_wrapped_cache(self):
+        """Test reporting the statistics of a cache behind other wrappers."""
+        markov = ChattyMarkov(
+            "memory://;metrics=1;cache_size=8;max_states=100"
+        )
+        assert isinstance(markov.db.database, BoundedDatabase)
+        markov.learn("hello world")
+        for _ in range(3):
+            assert markov.generate() == "hello world"
+        stats = markov.db.metrics.snapshot()["cache"]
+        assert (stats["misses"], stats["hits"]) == (6, 3)
+        assert "cache_events_total" in markov.db.metrics.prometheus()
+
+    def test_tracing(self):
+        """Test that a span is recorded per call."""
+        spans = []
+
+        class Span:
+            def __init__(self, name):
+                self.name = name
+                self.ended = False
+
+            def end(self):
+                self.ended = True
+
+        class Tracer:
+            def start_span(self, name):
+                spans.append(Span(name))
+                return spans[-1]
+
+        db = InstrumentedDatabase(MemoryDatabase(), tracer=Tracer())
+        db.add("foo", "bar")
+        assert db.random("foo") == "bar"
+        assert [span.name for span in spans] == [
+            "chattymarkov.db.add", "chattymarkov.db.random"]
+        assert all(span.ended for span in spans)
+
+    def test_prometheus(self):
+        """Test the Prometheus text dump."""
+        metrics = Metrics()
+        metrics.record("random", 0.0003, 10, 5)
+        metrics.record("random", 2.0, 10, 5, error=ValueError())
+        dump = metrics.prometheus()
+        assert 'chattymarkov_db_calls_total{operation="random"} 2\n' in dump
+        assert 'chattymarkov_db_errors_total{operation="random"} 1\n' in dump
+        assert ('chattymarkov_db_bytes_total{operation="random",'
+                'direction="sent"} 20\n') in dump
+        assert ('chattymarkov_db_latency_seconds_bucket{operation="random",'
+                'le="0.0005"} 1\n') in dump
+        assert ('chattymarkov_db_latency_seconds_bucket{operation="random",'
+                'le="+Inf"} 2\n') in dump
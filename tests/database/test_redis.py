@@ -0,0 +1,439 @@
+import asyncio
+
+import aioredis
+import fakeredis
+import fakeredis.aioredis
+import pytest
+import redis
+
+from chattymarkov import ChattyMarkovAsync
+from chattymarkov.database import (RedisAsyncioDatabase, RedisDatabase,
+                                   RedisDatabaseAsync,
+                                   build_database_connection)
+from chattymarkov.database.databases import _INDEX_SUFFIX
+
+
+class FakeConnection:
+    """aioredis connection running its commands on fakeredis."""
+
+    def __init__(self, server):
+        self.handle = fakeredis.FakeStrictRedis(server=server)
+        self.closed = False
+        self.healthy = True
+
+    async def execute(self, *args):
+        if not self.healthy:
+            raise aioredis.ConnectionClosedError("Connection lost")
+        try:
+            reply = self.handle.execute_command(*args)
+        except redis.exceptions.NoScriptError as exc:
+            raise aioredis.ReplyError("NOSCRIPT {}".format(exc))
+        if isinstance(reply, dict):
+            # aioredis returns hashes as flat lists.
+            reply = [item for pair in reply.items() for item in pair]
+        return reply
+
+    def close(self):
+        self.closed = True
+
+
+class FakePool:
+    """Minimal aioredis pool of `FakeConnection` instances."""
+
+    def __init__(self, maxsize):
+        self.server = fakeredis.FakeServer()
+        self.maxsize = maxsize
+        self.free = []
+        self.used = set()
+        self.created = 0
+        self.released = asyncio.Event()
+
+    @property
+    def size(self):
+        return len(self.free) + len(self.used)
+
+    @property
+    def freesize(self):
+        return len(self.free)
+
+    async def acquire(self):
+        while not self.free and self.size >= self.maxsize:
+            self.released.clear()
+            await self.released.wait()
+        if self.free:
+            conn = self.free.pop()
+        else:
+            conn = FakeConnection(self.server)
+            self.created += 1
+        self.used.add(conn)
+        return conn
+
+    def release(self, conn):
+        self.used.discard(conn)
+        if not conn.closed:
+            self.free.append(conn)
+        self.released.set()
+
+
+class TestRedisDatabase:
+    def setup_method(self, method):
+        self.db = RedisDatabase(unix_socket_path="/path/to/redis.sock")
+        self.db.handle = fakeredis.FakeStrictRedis()
+
+    def test_add_many(self):
+        """Test the `add_many` method from the RedisDatabase class."""
+        self.db.add_many([("foo", "bar"), ("foo", "baz"), ("spam", "eggs")])
+        assert self.db.handle.smembers("foo") == {b"bar", b"baz"}
+        assert self.db.random("spam") == "eggs"
+
+    def test_walk(self):
+        """Test the `walk` method from the RedisDatabase class."""
+        self.db.add_many([
+            ("p-\x01", "hello"),
+            ("p-\x01hello", "world"),
+            ("p-hello\x01world", "\x02"),
+        ])
+        assert self.db.walk("p-", "\x01", "\x02", 2, 10) == ["hello", "world"]
+        assert self.db.walk("p-", "\x01", "\x02", 2, 1) == ["hello"]
+
+    def test_scan(self):
+        """Test the `scan` method from the RedisDatabase class."""
+        self.db.add_many([("foo", "bar"), ("foo", "baz"), ("spam", "eggs")])
+        self.db.set("value", "1")
+        assert dict(self.db.scan(batch_size=1)) == {
+            "foo": {"bar": 1, "baz": 1},
+            "spam": {"eggs": 1},
+        }
+
+    def test_delete_trim(self):
+        """Test the `delete` and `trim` methods of the RedisDatabase class."""
+        self.db.add_many([("foo", element) for element in "abcde"])
+        self.db.add("spam", "eggs")
+        assert self.db.trim(["foo", "spam", "nothing"], 2) == 3
+        assert self.db.handle.scard("foo") == 2
+        self.db.delete(["foo", "nothing"])
+        assert self.db.handle.keys() == [b"spam"]
+
+
+class TestWeightedRedisDatabase:
+    def setup_method(self, method):
+        self.db = RedisDatabase(
+            unix_socket_path="/path/to/redis.sock", weighted=True
+        )
+        self.db.handle = fakeredis.FakeStrictRedis()
+
+    def test_add_many(self):
+        """Test that weighted redis databases count transitions."""
+        self.db.add_many([("foo", "bar"), ("foo", "bar"), ("foo", "baz")])
+        assert self.db.add("foo", "baz", 3) is False
+        assert self.db.handle.hgetall("foo") == {b"bar": b"2", b"baz": b"4"}
+
+    def test_random(self):
+        """Test that random picks are proportional to counts."""
+        self.db.add("foo", "bar", 1000)
+        self.db.add("foo", "baz")
+        picks = [self.db.random("foo") for _ in range(100)]
+        assert picks.count("bar") > 90
+        assert self.db.random("spam") is None
+
+    def test_walk(self):
+        """Test the `walk` method on weighted redis databases."""
+        self.db.add("p-\x01", "hello")
+        self.db.add("p-\x01hello", "world")
+        assert self.db.walk("p-", "\x01", "\x02", 2, 10) == ["hello", "world"]
+
+    def test_scan(self):
+        """Test the `scan` method on weighted redis databases."""
+        self.db.add("foo", "bar", 3)
+        self.db.add("foo", "baz")
+        assert dict(self.db.scan()) == {"foo": {"bar": 3, "baz": 1}}
+
+    def test_random_many(self):
+        """Test the `random_many` method on weighted redis databases."""
+        self.db.add("foo", "bar")
+        assert self.db.random_many(["foo", "spam"]) == ["bar", None]
+
+    def test_trim(self):
+        """Test that the least counted successors are trimmed first."""
+        self.db.add("foo", "bar", 3)
+        self.db.add("foo", "baz")
+        self.db.add("foo", "qux", 2)
+        assert self.db.trim(["foo"], 2) == 1
+        assert self.db.members("foo") == {"bar": 3, "qux": 2}
+
+    def test_index(self):
+        """Test picks through the index of keys with many successors."""
+        counts = {"w{}".format(i): 1 + i % 7 for i in range(200)}
+        self.db.add_many(
+            [("foo", word, count) for word, count in counts.items()]
+        )
+        index = "foo" + _INDEX_SUFFIX
+        assert not self.db.handle.exists(index)
+        assert self.db.random("foo") in counts
+        assert self.db.handle.hget(index, "n") == b"200"
+
+        # The index is kept up to date by new and counted successors.
+        self.db.add("foo", "w3", 5000)
+        self.db.add_many([("foo", "new", 3000), ("foo", "new")])
+        counts["w3"] += 5000
+        counts["new"] = 3001
+        tree = {
+            int(field[1:]): int(value)
+            for field, value in self.db.handle.hgetall(index).items()
+            if field.startswith(b"t")
+        }
+        values = [counts[self.db.handle.hget(index, "w{}".format(i)).decode()]
+                  for i in range(1, 202)]
+        for i, value in tree.items():
+            assert value == sum(values[i - (i & -i):i])
+
+        picks = self.db.random_many(["foo"] * 200)
+        assert 100 < picks.count("w3") + picks.count("new") < 200
+        assert dict(self.db.scan()) == {"foo": counts}
+
+        # Removing successors drops the index, rebuilt by the next pick.
+        self.db.trim(["foo"], 100)
+        assert not self.db.handle.exists(index)
+        assert self.db.walk("foo", "", "\x02", 1, 1)[0] in counts
+        assert self.db.handle.hget(index, "n") == b"100"
+        self.db.delete(["foo"])
+        assert self.db.handle.keys() == []
+
+
+class TestRedisDatabaseAsync:
+    def make_db(self, **kwargs):
+        db = RedisDatabaseAsync(**kwargs)
+        db._connection_pool = FakePool(db.pool_max)
+        return db
+
+    def test_build(self):
+        """Test the pool parameters of the connection string."""
+        db = build_database_connection(
+            "aioredis://example.com:1234;db=2;pool_min=2;pool_max=64;"
+            "pool_timeout=0.5;pool_idle=30;health_check_interval=5", True)
+        assert (db.host, db.port, db.db) == ("example.com", 1234, 2)
+        assert (db.pool_min, db.pool_max) == (2, 64)
+        assert db.pool_timeout == 0.5
+        assert db.pool_idle == 30
+        assert db.health_check_interval == 5
+
+        db = build_database_connection("aioredis:///tmp/redis.sock", True)
+        assert isinstance(db, RedisDatabaseAsync)
+        assert db.unix_socket_path == "/tmp/redis.sock"
+        assert db._url is None
+
+    def test_operations(self):
+        """Test learning and generating through the pool."""
+        db = self.make_db(weighted=True)
+
+        async def run():
+            await db.add_many([("p-\x01", "hello"), ("p-\x01hello", "world")])
+            await db.add("p-\x01", "hello", 2)
+            return (
+                await db.members("p-\x01"),
+                await db.walk("p-", "\x01", "\x02", 2, 10),
+            )
+
+        assert asyncio.run(run()) == ({"hello": 3}, ["hello", "world"])
+        stats = db.stats()
+        assert stats["acquired"] == 4
+        assert stats["in_use"] == 0
+        assert db._connection_pool.created == 1
+
+    def test_connection(self):
+        """Test that a held connection is reused by operations."""
+        db = self.make_db()
+
+        async def run():
+            async with db.connection() as conn:
+                await db.add("foo", "bar")
+                assert await db.random("foo") == "bar"
+                assert db.stats()["in_use"] == 1
+                return conn
+
+        conn = asyncio.run(run())
+        assert db.stats()["acquired"] == 1
+        assert db._connection_pool.free == [conn]
+
+    def test_pool_full(self):
+        """Test waiting for, and timing out on, a full pool."""
+        db = self.make_db(pool_max=1, pool_timeout=0.01)
+
+        async def run():
+            async with db.connection():
+                try:
+                    await db._acquire()
+                except asyncio.TimeoutError:
+                    return True
+
+        assert asyncio.run(run())
+        assert db.stats()["waits"] == 1
+
+    def test_recycling(self):
+        """Test that idle and unhealthy connections are not reused."""
+        db = self.make_db(pool_idle=60, health_check_interval=1)
+        pool = db._connection_pool
+
+        async def run():
+            await db.set("foo", "bar")
+            conn, = pool.free
+            db._released_at[conn] -= 2
+            conn.healthy = False
+            assert await db.get("foo") == "bar"
+            conn, = pool.free
+            db._released_at[conn] -= 60
+            assert await db.get("foo") == "bar"
+
+        asyncio.run(run())
+        assert db.stats()["recycled"] == 2
+        assert pool.created == 3
+
+
+class TestRedisAsyncioDatabase:
+    def make_db(self, **kwargs):
+        db = RedisAsyncioDatabase(**kwargs)
+        pool = db.handle.connection_pool
+        pool.connection_class = fakeredis.aioredis.FakeAsyncRedisConnection
+        pool.connection_kwargs["server"] = fakeredis.FakeServer()
+        return db
+
+    def test_build(self):
+        """Test that redis_async connection strings use redis.asyncio."""
+        db = build_database_connection(
+            "redis_async://localhost:6380;pool_max=64;weighted=1", True)
+        assert isinstance(db, RedisAsyncioDatabase)
+        assert (db.host, db.port, db.pool_max) == ("localhost", 6380, 64)
+        assert db.weighted
+        pool = db.handle.connection_pool
+        assert pool.max_connections == 64
+
+        db = build_database_connection("redis:///tmp/redis.sock", True)
+        assert isinstance(db, RedisAsyncioDatabase)
+        assert db.unix_socket_path == "/tmp/redis.sock"
+
+    def test_build_pool(self):
+        """Test the pool parameters of the connection string."""
+        db = build_database_connection(
+            "redis://example.com:1234;db=2;pool_min=2;pool_max=64;"
+            "pool_timeout=0.5;pool_idle=30;health_check_interval=5", True)
+        assert isinstance(db, RedisAsyncioDatabase)
+        assert (db.host, db.port, db.db) == ("example.com", 1234, 2)
+        assert (db.pool_min, db.pool_max) == (2, 64)
+        assert db.pool_timeout == 0.5
+        assert db.pool_idle == 30
+        assert db.health_check_interval == 5
+        pool = db.handle.connection_pool
+        assert (pool.timeout, pool.pool_idle) == (0.5, 30)
+
+        with pytest.raises(ValueError):
+            RedisAsyncioDatabase(pool_min=3, pool_max=2)
+
+    def test_connect(self):
+        """Test that connecting opens pool_min connections."""
+        db = self.make_db(pool_min=3)
+        asyncio.run(db.connect())
+        stats = db.stats()
+        assert (stats["size"], stats["free"], stats["in_use"]) == (3, 3, 0)
+
+    def test_connection(self):
+        """Test that a held connection is reused by operations."""
+        db = self.make_db(weighted=True)
+
+        async def run():
+            async with db.connection() as conn:
+                await db.add_many([("foo", "bar"), ("foo", "baz")])
+                assert await db.random("foo") in ("bar", "baz")
+                async with db.connection() as nested:
+                    assert nested is conn
+                # Tasks started meanwhile share it one at a time.
+                picks = await asyncio.gather(
+                    *(db.random_many(["foo"] * 3) for _ in range(5))
+                )
+                assert db.stats()["in_use"] == 1
+            return picks
+
+        picks = asyncio.run(run())
+        assert all(pick in ("bar", "baz") for pick in sum(picks, []))
+        stats = db.stats()
+        assert (stats["acquired"], stats["size"], stats["in_use"]) == (
+            1, 1, 0)
+
+    def test_pool_full(self):
+        """Test waiting for, and timing out on, a full pool."""
+        db = self.make_db(pool_max=1, pool_timeout=0.01)
+
+        async def run():
+            async with db.connection():
+                with pytest.raises(redis.ConnectionError):
+                    await db.handle.connection_pool.acquire()
+
+        asyncio.run(run())
+        assert db.stats()["waits"] == 1
+
+    def test_recycling(self):
+        """Test that idle connections are opened again before reuse."""
+        db = self.make_db(pool_idle=60)
+        pool = db.handle.connection_pool
+
+        async def run():
+            await db.set("foo", "bar")
+            conn, = pool._available_connections
+            pool._released_at[conn] -= 30
+            assert await db.get("foo") == "bar"
+            pool._released_at[conn] -= 60
+            assert await db.get("foo") == "bar"
+
+        asyncio.run(run())
+        assert db.stats()["recycled"] == 1
+        assert db.stats()["size"] == 1
+
+    def test_operations(self):
+        """Test learning and picking successors up."""
+        db = self.make_db()
+
+        async def run():
+            await db.add_many([("foo", "bar"), ("foo", "baz")])
+            await db.add_many([])
+            assert await db.add("spam", "eggs") is True
+            assert await db.members("foo") == {"bar": 1, "baz": 1}
+            assert await db.random("nothing") is None
+            assert await db.random_many(["spam", "nothing"], raw=True) == [
+                b"eggs", None]
+            await db.set("key", "value")
+            assert await db.get("key") == "value"
+
+        asyncio.run(run())
+
+    def test_weighted(self):
+        """Test weighted picks and server side walks."""
+        db = self.make_db(weighted=True)
+
+        async def run():
+            await db.add_many([("p-\x01", "hello", 1000), ("p-\x01", "bye")])
+            await db.add("p-\x01hello", "world")
+            assert await db.members("p-\x01") == {"hello": 1000, "bye": 1}
+            picks = await db.random_many(["p-\x01"] * 100)
+            assert picks.count("hello") > 90
+            assert await db.random("p-\x01hello", raw=True) == b"world"
+            return await db.walk_many(
+                2, "p-", "\x01", "\x02", 2, 1, raw=True)
+
+        assert asyncio.run(run()) in (
+            [[b"hello"], [b"hello"]],
+            [[b"hello"], [b"bye"]],
+            [[b"bye"], [b"hello"]],
+            [[b"bye"], [b"bye"]],
+        )
+
+    def test_chattymarkov(self):
+        """Test generating sentences through ChattyMarkovAsync."""
+        markov = ChattyMarkovAsync("redis_async://localhost")
+        markov.db = self.make_db()
+
+        async def run():
+            await markov.connect()
+            await markov.learn("hello big world")
+            return await markov.generate(), await markov.generate_many(2)
+
+        assert asyncio.run(run()) == (
+            "hello big world", ["hello big world"] * 2)
@@ -0,0 +1,105 @@
+import asyncio
+
+import fakeredis
+import pytest
+
+from chattymarkov import ChattyMarkov, ChattyMarkovAsync
+from chattymarkov.database import (HashRing, InvalidConnectionStringError,
+                                   ShardedRedisDatabase,
+                                   ShardedRedisDatabaseAsync,
+                                   build_database_connection)
+
+
+CONNECT_STRING = "redis_cluster://localhost:7000,localhost:7001,/tmp/r.sock"
+
+
+def use_fake_servers(db, is_async=False):
+    """Point each node of *db* to its own fake redis server."""
+    if is_async:
+        client = fakeredis.FakeAsyncRedis
+    else:
+        client = fakeredis.FakeStrictRedis
+    servers = []
+    for node in db.nodes:
+        servers.append(fakeredis.FakeServer())
+        node.handle = client(server=servers[-1])
+    return servers
+
+
+class TestHashRing:
+    def test_balance(self):
+        """Test that keys are spread evenly across nodes."""
+        ring = HashRing(["a", "b", "c", "d"])
+        counts = [0] * 4
+        for i in range(10000):
+            counts[ring.index("key{}".format(i))] += 1
+        assert min(counts) > 1800
+
+    def test_consistency(self):
+        """Test that removing a node only moves its own keys."""
+        before = HashRing(["a", "b", "c", "d"])
+        after = HashRing(["a", "b", "c"])
+        for i in range(1000):
+            key = "key{}".format(i)
+            if before.node(key) != "d":
+                assert after.node(key) == before.node(key)
+
+
+class TestShardedRedisDatabase:
+    def test_build(self):
+        """Test the redis_cluster connection string."""
+        db = build_database_connection(CONNECT_STRING + ";db=2;weighted=1")
+        assert isinstance(db, ShardedRedisDatabase)
+        assert [node.db for node in db.nodes] == [2, 2, 2]
+        assert db.nodes[1].port == 7001
+        assert db.nodes[2].unix_socket_path == "/tmp/r.sock"
+        assert db.weighted
+        assert db.ring.nodes == [
+            "localhost:7000", "localhost:7001", "/tmp/r.sock"]
+
+        with pytest.raises(InvalidConnectionStringError):
+            build_database_connection("redis_cluster://;db=2")
+
+    def test_sharding(self):
+        """Test that keys are routed to their node."""
+        db = build_database_connection(CONNECT_STRING)
+        servers = use_fake_servers(db)
+        items = [("key{}".format(i), "word{}".format(i)) for i in range(300)]
+        db.add_many(items)
+        for node in db.nodes:
+            keys = {key.decode() for key in node.handle.keys()}
+            assert keys
+            assert all(db._node(key) is node for key in keys)
+        assert db.random_many(["key1", "nothing", "key2"]) == [
+            "word1", None, "word2"]
+        assert dict(db.scan()) == {key: {word: 1} for key, word in items}
+        db.set("foo", "bar")
+        assert db.get("foo") == "bar"
+        assert len(servers) == 3
+
+    def test_generate(self):
+        """Test learning and generating sentences across nodes."""
+        markov = ChattyMarkov(CONNECT_STRING + ";weighted=1")
+        use_fake_servers(markov.db)
+        markov.learn_many(["a b c d e f g h", "a b c d e f g h"])
+        assert markov.generate() == "a b c d e f g h"
+        assert markov.generate_many(3) == ["a b c d e f g h"] * 3
+        assert markov.db.members("chattymarkov-a\x01b") == {"c": 2}
+        assert markov.freeze().generate() == "a b c d e f g h"
+        used = [node for node in markov.db.nodes if node.handle.keys()]
+        assert len(used) > 1
+
+    def test_async(self):
+        """Test the asynchronous sharded database."""
+        markov = ChattyMarkovAsync(CONNECT_STRING)
+        assert isinstance(markov.db, ShardedRedisDatabaseAsync)
+        use_fake_servers(markov.db, is_async=True)
+
+        async def run():
+            await markov.connect()
+            await markov.learn("a b c d e f g h")
+            assert await markov.db.members("chattymarkov-a\x01b") == {"c": 1}
+            return await markov.generate(), await markov.generate_many(2)
+
+        assert asyncio.run(run()) == (
+            "a b c d e f g h", ["a b c d e f g h"] * 2)
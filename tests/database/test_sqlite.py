@@ -0,0 +1,212 @@
+import asyncio
+import os
+import random
+import tempfile
+
+from chattymarkov import ChattyMarkov, ChattyMarkovAsync
+from chattymarkov.database import (SQLiteDatabase, SQLiteDatabaseAsync,
+                                   build_database_connection, sqlite)
+from chattymarkov.database.sqlite import _SPANS, _STATE
+
+
+class TestSQLiteDatabase:
+    def setup_method(self, method):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, "model.db")
+        self.db = SQLiteDatabase(self.path)
+
+    def teardown_method(self, method):
+        self.db.close()
+        self.directory.cleanup()
+
+    def test_build(self):
+        """Test the sqlite connection string."""
+        db = build_database_connection(
+            "sqlite://{};weighted=1;timeout=1".format(self.path)
+        )
+        assert isinstance(db, SQLiteDatabase)
+        assert db.weighted
+        journal_mode, = db.connection.execute("PRAGMA journal_mode").fetchone()
+        assert journal_mode == "wal"
+        db.close()
+
+    def test_add(self):
+        """Test that each successor is stored once."""
+        assert self.db.add("foo", "bar")
+        assert not self.db.add("foo", "bar")
+        self.db.add_many([("foo", "baz"), ("foo", "bar"), ("spam", "eggs")])
+        assert self.db.members("foo") == {"bar": 1, "baz": 1}
+        assert self.db.random_many(["spam", "nothing"]) == ["eggs", None]
+        assert {self.db.random("foo") for _ in range(50)} == {"bar", "baz"}
+        assert dict(self.db.scan()) == {
+            "foo": {"bar": 1, "baz": 1},
+            "spam": {"eggs": 1},
+        }
+
+    def test_persistence(self):
+        """Test that learned transitions survive reopening the file."""
+        self.db.add_many([("foo", "bar"), ("foo", "baz")])
+        self.db.set("spam", "eggs")
+        self.db.close()
+        self.db = SQLiteDatabase(self.path)
+        assert self.db.members("foo") == {"bar": 1, "baz": 1}
+        assert self.db.get("spam") == "eggs"
+        assert self.db.get("nothing", "default") == "default"
+
+    def test_delete_trim(self):
+        """Test the `delete` and `trim` methods."""
+        self.db.add_many([("foo", element) for element in "abcde"])
+        self.db.add("spam", "eggs")
+        assert self.db.trim(["foo", "spam", "nothing"], 2) == 3
+        members = self.db.members("foo")
+        assert len(members) == 2
+        assert {self.db.random("foo") for _ in range(50)} == set(members)
+        assert self.db.connection.execute(
+            "SELECT position FROM transitions ORDER BY position"
+        ).fetchall() == [(0,), (0,), (1,)]
+        self.db.delete(["foo"])
+        assert dict(self.db.scan()) == {"spam": {"eggs": 1}}
+
+    def test_generate(self):
+        """Test learning and generating sentences."""
+        markov = ChattyMarkov("sqlite://" + self.path)
+        markov.learn_many(["hello world", "hello there"])
+        assert markov.generate() in ("hello world", "hello there")
+        assert markov.freeze().generate() in ("hello world", "hello there")
+        markov.db.close()
+
+
+class TestWeightedSQLiteDatabase:
+    def setup_method(self, method):
+        self.directory = tempfile.TemporaryDirectory()
+        self.db = SQLiteDatabase(
+            os.path.join(self.directory.name, "model.db"), weighted=True
+        )
+
+    def teardown_method(self, method):
+        self.db.close()
+        self.directory.cleanup()
+
+    def test_add(self):
+        """Test that weighted databases count transitions."""
+        assert self.db.add("foo", "bar")
+        assert not self.db.add("foo", "bar", 2)
+        self.db.add_many([("foo", "baz"), ("foo", "bar"), ("foo", "baz", 4)])
+        assert self.db.members("foo") == {"bar": 4, "baz": 5}
+
+    def test_random(self):
+        """Test that random picks are proportional to counts."""
+        self.db.add("foo", "baz")
+        self.db.add("foo", "bar", 1000)
+        self.db.add("foo", "qux")
+        picks = [self.db.random("foo") for _ in range(100)]
+        assert picks.count("bar") > 90
+
+    def test_trim(self):
+        """Test that the least counted successors are trimmed first."""
+        self.db.add_many(
+            [("foo", "bar", 3), ("foo", "baz"), ("foo", "qux", 2)]
+        )
+        assert self.db.trim(["foo"], 2) == 1
+        assert self.db.members("foo") == {"bar": 3, "qux": 2}
+        assert {self.db.random("foo") for _ in range(100)} == {"bar", "qux"}
+
+    def check_blocks(self, key):
+        """Check the positions and the sums of the successors of *key*."""
+        execute = self.db.connection.execute
+        state, size, total = execute(_STATE, (key,)).fetchone()
+        rows = execute(
+            "SELECT position, count FROM transitions WHERE state = ? "
+            "ORDER BY position", (state,)
+        ).fetchall()
+        assert [position for position, _ in rows] == list(range(size))
+        assert sum(count for _, count in rows) == total
+        for span in _SPANS:
+            sums = {}
+            for position, count in rows:
+                sums[position // span] = sums.get(position // span, 0) + count
+            assert dict(
+                execute(
+                    "SELECT block, total FROM blocks "
+                    "WHERE state = ? AND span = ?", (state, span)
+                )
+            ) == sums
+
+    def test_blocks(self, monkeypatch):
+        """Test picks and trims of keys spanning several blocks."""
+        counts = {"w{}".format(i): 1 + i % 7 for i in range(5000)}
+        self.db.add_many(
+            [("foo", word, count) for word, count in counts.items()]
+        )
+        self.db.add("foo", "w3", 50000)
+        self.db.add_many([("foo", "new", 30000), ("foo", "new")])
+        counts["w3"] += 50000
+        counts["new"] = 30001
+        self.check_blocks("foo")
+        assert self.db.members("foo") == counts
+
+        # Every number drawn below the total picks up the successor whose
+        # cumulative counts it falls in.
+        upper, expected = 0, []
+        for word, count in self.db.members("foo").items():
+            upper += count
+            expected.append((upper, word))
+        for drawn in sorted({0, upper - 1} | set(range(0, upper, 997))):
+            monkeypatch.setattr(random, "randrange", lambda stop: drawn)
+            assert self.db.random("foo") == next(
+                word for bound, word in expected if drawn < bound
+            )
+        monkeypatch.undo()
+
+        picks = self.db.random_many(["foo"] * 300)
+        assert 150 < picks.count("w3") + picks.count("new") < 300
+        assert set(picks) <= set(counts)
+
+        assert self.db.trim(["foo"], 100) == 4901
+        self.check_blocks("foo")
+        kept = self.db.members("foo")
+        assert len(kept) == 100
+        assert min(kept.values()) >= max(
+            count for word, count in counts.items() if word not in kept
+        )
+        assert set(self.db.random_many(["foo"] * 100)) <= set(kept)
+
+    def test_concurrent_delete(self, monkeypatch):
+        """Test that picks read a single snapshot of the file."""
+        other = SQLiteDatabase(self.db.filepath, weighted=True)
+        words = {"w{}".format(i) for i in range(100)}
+        self.db.add_many([("foo", word) for word in words])
+        cumulate = sqlite._cumulate
+
+        def racing_cumulate(numbers):
+            # Another process deletes the state in the middle of the pick.
+            other.delete(["foo"])
+            return cumulate(numbers)
+
+        monkeypatch.setattr(sqlite, "_cumulate", racing_cumulate)
+        assert self.db.random("foo") in words
+        assert self.db.random_many(["foo", "foo"]) == [None, None]
+        other.close()
+
+
+class TestSQLiteDatabaseAsync:
+    def test_generate(self):
+        """Test learning and generating sentences asynchronously."""
+        directory = tempfile.TemporaryDirectory()
+        connect_string = "sqlite://{};weighted=1".format(
+            os.path.join(directory.name, "model.db")
+        )
+
+        async def run():
+            markov = ChattyMarkovAsync(connect_string)
+            assert isinstance(markov.db, SQLiteDatabaseAsync)
+            await markov.learn_many(["hello world", "hello world"])
+            members = await markov.db.members(markov._make_key("", "\x01"))
+            sentences = await markov.generate_many(2)
+            await markov.db.close()
+            return members, sentences
+
+        members, sentences = asyncio.run(run())
+        directory.cleanup()
+        assert members == {"hello": 2}
+        assert sentences == ["hello world", "hello world"]
@@ -0,0 +1,156 @@
+import random
+import sys
+import threading
+
+import pytest
+
+from chattymarkov import ChattyMarkov
+from chattymarkov.database import (MemoryDatabase, ThreadSafeMemoryDatabase,
+                                   build_database_connection)
+
+
+WORDS = ["w{}".format(i) for i in range(30)]
+THREADS = 16
+
+
+def sentences(seed, n=200):
+    """Return *n* random sentences made of a few common words."""
+    rng = random.Random(seed)
+    return [
+        " ".join(rng.choice(WORDS) for _ in range(rng.randint(1, 8)))
+        for _ in range(n)
+    ]
+
+
+@pytest.fixture
+def switch_often():
+    """Switch threads as often as possible, to make races likely."""
+    interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)
+    yield
+    sys.setswitchinterval(interval)
+
+
+def run_threads(target, n=THREADS):
+    """Run *target(index)* in *n* threads at once, return their errors."""
+    barrier = threading.Barrier(n)
+    errors = []
+
+    def run(index):
+        barrier.wait()
+        try:
+            target(index)
+        except BaseException as exc:
+            errors.append(exc)
+
+    threads = [threading.Thread(target=run, args=(i,)) for i in range(n)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return errors
+
+
+class TestThreadSafeMemoryDatabase:
+    def test_build(self):
+        """Test the threadsafe and stripes parameters."""
+        db = build_database_connection(
+            "memory://;threadsafe=1;weighted=1;stripes=8"
+        )
+        assert isinstance(db, ThreadSafeMemoryDatabase)
+        assert db.weighted
+        assert len(db._locks) == 8
+        assert type(build_database_connection("memory://;stripes=8")) \
+            is MemoryDatabase
+
+    def test_rng(self):
+        """Test that each thread picks from a random generator of its own."""
+        db = ThreadSafeMemoryDatabase()
+        generators = [None] * 4
+
+        def target(index):
+            generators[index] = db._rng
+            assert db._rng is generators[index]
+
+        assert run_threads(target, 4) == []
+        assert len({id(rng) for rng in generators}) == 4
+
+    @pytest.mark.parametrize("weighted", [False, True])
+    def test_learn_generate(self, weighted, switch_often):
+        """Test many threads learning and generating at once."""
+        connect_string = "memory://;threadsafe=1;weighted={:d}".format(
+            weighted
+        )
+        markov = ChattyMarkov(connect_string)
+        corpora = [sentences(i) for i in range(THREADS)]
+        generated = []
+
+        def target(index):
+            for i, msg in enumerate(corpora[index]):
+                if i % 2:
+                    markov.learn(msg)
+                else:
+                    markov.learn_many([msg, msg], batch_size=4)
+                generated.append(markov.generate())
+                generated.extend(markov.generate_many(2))
+
+        assert run_threads(target) == []
+        assert all(
+            word in WORDS for sentence in generated
+            for word in sentence.split()
+        )
+
+        # Not a single transition, nor a single count, may be lost.
+        expected = ChattyMarkov(
+            "memory://;weighted={:d}".format(weighted)
+        )
+        for corpus in corpora:
+            for i, msg in enumerate(corpus):
+                expected.learn_many([msg] if i % 2 else [msg, msg])
+        assert dict(markov.db.scan()) == dict(expected.db.scan())
+
+    def test_trim(self, switch_often):
+        """Test picking successors while other threads trim them."""
+        db = ThreadSafeMemoryDatabase(weighted=True)
+
+        def target(index):
+            for i in range(300):
+                if index % 2:
+                    db.add_many([("k", "w{}".format(i % 30), index)])
+                    db.trim(["k"], 1 + i % 5)
+                else:
+                    assert db.random("k") in WORDS + [None]
+                    assert all(
+                        element in WORDS + [None]
+                        for element in db.random_many(["k", "nothing"])
+                    )
+
+        assert run_threads(target) == []
+        assert len(db.members("k")) <= 5
+
+    def test_increment(self, switch_often):
+        """Test picking successors while other threads count them again."""
+        db = ThreadSafeMemoryDatabase(weighted=True)
+        db.add("k", WORDS[0])
+
+        def target(index):
+            for i in range(300):
+                if index % 2:
+                    db.add("k", WORDS[i % 30], index)
+                    db.add_many([("k", WORDS[(i + index) % 30])])
+                else:
+                    assert db.random("k") in WORDS
+                    assert all(
+                        element in WORDS
+                        for element in db.random_many(["k", "k"])
+                    )
+
+        assert run_threads(target) == []
+        # Not a single increment may be lost either.
+        expected = {word: 0 for word in WORDS}
+        expected[WORDS[0]] = 1
+        for index in range(1, THREADS, 2):
+            for i in range(300):
+                expected[WORDS[i % 30]] += index
+                expected[WORDS[(i + index) % 30]] += 1
+        assert db.members("k") == expected
@@ -1,12 +1,17 @@
+import asyncio
+import contextlib
 import json
 import os
 import tempfile
+import time
 import unittest
 
+import fakeredis
 import six
 
-from chattymarkov import ChattyMarkov
-from chattymarkov.database import (JSONFileDatabase, MemoryDatabase,
+from chattymarkov import ChattyMarkov, ChattyMarkovAsync
+from chattymarkov.database import (CachedDatabaseAsync, JSONFileDatabase,
+                                   MemoryDatabase, MemoryDatabaseAsync,
                                    RedisDatabase)
 
 
@@ -41,3 +46,251 @@ class TestChattyMarkov(unittest.TestCase):
         self.assertEquals(c.db.port, 8765)
         self.assertEquals(c.db.password, "foobar")
         self.assertEquals(c.db.db, 3)
+
+    def test_learn(self):
+        """Test the learn method of ChattyMarkov."""
+        c = ChattyMarkov("memory://")
+        c.learn("hello world", "channel")
+        self.assertEqual(
+            {key: list(value) for key, value in c.db.db.items()},
+            {
+                "chattymarkov-channel-\x01": ["hello"],
+                "chattymarkov-channel-\x01hello": ["world"],
+                "chattymarkov-channel-hello\x01world": ["\x02"],
+            },
+        )
+
+        c.learn("hello world")
+        self.assertEqual(c.generate(), "hello world")
+
+    def test_learn_many(self):
+        """Test the learn_many method of ChattyMarkov."""
+        c = ChattyMarkov("memory://")
+        c.learn_many(["hello world", "", "hello there"], batch_size=2)
+        self.assertEqual(list(c.db.db["chattymarkov-\x01"]), ["hello"])
+        self.assertEqual(
+            list(c.db.db["chattymarkov-\x01hello"]), ["world", "there"]
+        )
+        self.assertEqual(len(c.db.db), 4)
+
+    def test_learn_stream(self):
+        """Test the learn_stream method of ChattyMarkov."""
+        with open(self.json_file.name, "w") as stream:
+            stream.write("hello world\n\nhello there\n")
+        c = ChattyMarkov("memory://")
+        c.learn_stream(self.json_file.name, batch_size=2)
+        self.assertEqual(
+            list(c.db.db["chattymarkov-\x01hello"]), ["world", "there"]
+        )
+
+        c = ChattyMarkov("memory://")
+        c.learn_stream(iter(["hello world"]))
+        self.assertEqual(c.generate(), "hello world")
+
+    def test_generate(self):
+        """Test the generate method of ChattyMarkov."""
+        c = ChattyMarkov("memory://")
+        c.learn_many(["hello big world"])
+        self.assertEqual(c.generate(), "hello big world")
+        self.assertEqual(c.generate(max_words=2), "hello big")
+
+        c = ChattyMarkov("redis:///path/to/socket.sock")
+        c.db.handle = fakeredis.FakeStrictRedis()
+        c.learn_many(["hello big world"])
+        self.assertEqual(c.generate(), "hello big world")
+
+    def test_order(self):
+        """Test the order parameter of ChattyMarkov."""
+        c = ChattyMarkov("memory://", order=1)
+        c.learn("a b c")
+        self.assertEqual(
+            sorted(c.db.db),
+            ["chattymarkov-", "chattymarkov-a", "chattymarkov-b",
+             "chattymarkov-c"],
+        )
+        self.assertEqual(c.generate(), "a b c")
+
+        for connect_string in ("memory://", "compact://"):
+            c = ChattyMarkov(connect_string, order=3)
+            c.learn("a b c d")
+            c.learn("x b c e")
+            self.assertIn(c.generate(), ("a b c d", "x b c e"))
+            self.assertIn(c.generate_many(1)[0], ("a b c d", "x b c e"))
+
+        c = ChattyMarkov("redis:///path/to/socket.sock", order=3)
+        c.db.handle = fakeredis.FakeStrictRedis()
+        c.learn("a b c d")
+        self.assertEqual(c.generate(), "a b c d")
+
+        with self.assertRaises(ValueError):
+            ChattyMarkov("memory://", order=0)
+
+    def test_generate_many(self):
+        """Test the generate_many method of ChattyMarkov."""
+        c = ChattyMarkov("memory://")
+        c.learn_many(["hello big world", "goodbye"])
+        sentences = c.generate_many(20)
+        self.assertEqual(len(sentences), 20)
+        self.assertLessEqual(set(sentences), {"hello big world", "goodbye"})
+        self.assertLessEqual(
+            set(c.generate_many(5, max_words=1)), {"hello", "goodbye"}
+        )
+
+        c = ChattyMarkov("redis:///path/to/socket.sock")
+        c.db.handle = fakeredis.FakeStrictRedis()
+        c.learn_many(["hello big world"])
+        self.assertEqual(c.generate_many(3), ["hello big world"] * 3)
+
+
+class TestChattyMarkovAsync(unittest.TestCase):
+    def test_generate_many(self):
+        """Test the generate_many method of ChattyMarkovAsync."""
+        c = ChattyMarkovAsync("memory_async://")
+
+        async def run():
+            await c.learn_many(["hello big world"])
+            return await c.generate_many(3)
+
+        self.assertEqual(asyncio.run(run()), ["hello big world"] * 3)
+
+    def test_learn_stream(self):
+        """Test that learn_stream stops reading while the database lags."""
+        c = ChattyMarkovAsync("memory_async://")
+        read = []
+        written = []
+
+        async def messages():
+            for i in range(100):
+                read.append(i)
+                yield "message {}".format(i)
+
+        async def run():
+            unblock = asyncio.Event()
+            add_many = c.db.add_many
+
+            async def slow_add_many(items):
+                await unblock.wait()
+                written.append(len(items))
+                await add_many(items)
+
+            c.db.add_many = slow_add_many
+            task = asyncio.ensure_future(
+                c.learn_stream(messages(), batch_size=3, max_pending=2)
+            )
+            for _ in range(10):
+                await asyncio.sleep(0)
+            # One batch being written, two waiting, one being built.
+            self.assertLessEqual(len(read), 4)
+            unblock.set()
+            await task
+            return await c.generate()
+
+        self.assertRegex(asyncio.run(run()), r"^message \d+$")
+        self.assertEqual(len(read), 100)
+        self.assertEqual(sum(written), 300)
+
+    def test_learn_stream_blocking(self):
+        """Test that learn_stream reads iterables off the event loop."""
+        c = ChattyMarkovAsync("memory_async://")
+
+        def messages():
+            for i in range(5):
+                time.sleep(0.02)
+                yield "message {}".format(i)
+
+        async def run():
+            ticks = 0
+
+            async def tick():
+                nonlocal ticks
+                while True:
+                    await asyncio.sleep(0.005)
+                    ticks += 1
+
+            ticker = asyncio.ensure_future(tick())
+            await c.learn_stream(messages())
+            ticker.cancel()
+            self.assertGreaterEqual(ticks, 5)
+            return await c.generate()
+
+        self.assertRegex(asyncio.run(run()), r"^message \d+$")
+
+    def test_learn_stream_error(self):
+        """Test that errors of the source are raised by learn_stream."""
+        c = ChattyMarkovAsync("memory_async://")
+
+        async def messages():
+            yield "hello world"
+            raise OSError("broken stream")
+
+        with self.assertRaises(OSError):
+            asyncio.run(c.learn_stream(messages()))
+
+    def test_deadline(self):
+        """Test that sentences are cut short past their deadline."""
+        c = ChattyMarkovAsync("memory_async://")
+
+        async def run():
+            await c.learn("a b c d e")
+            random, random_many = c.db.random, c.db.random_many
+            calls = []
+
+            async def slow_random(key):
+                calls.append(key)
+                if len(calls) > 2:
+                    await asyncio.sleep(10)
+                return await random(key)
+
+            async def slow_random_many(keys):
+                calls.append(keys)
+                if len(calls) > 2:
+                    await asyncio.sleep(10)
+                return await random_many(keys)
+
+            c.db.random, c.db.random_many = slow_random, slow_random_many
+            sentence = await c.generate(deadline=0.05)
+            calls.clear()
+            c.db.random = random
+            sentences = await c.generate_many(2, deadline=0.05)
+            return sentence, sentences, await c.generate(deadline=10)
+
+        sentence, sentences, full = asyncio.run(run())
+        self.assertEqual(sentence, "a b")
+        self.assertEqual(sentences, ["a b", "a b"])
+        self.assertEqual(full, "a b c d e")
+
+    def test_connection(self):
+        """Test that sentences hold a single connection of the database."""
+
+        class HeldDatabase(MemoryDatabaseAsync):
+            def __init__(self):
+                super().__init__()
+                self.held = 0
+                self.picks = []
+
+            @contextlib.asynccontextmanager
+            async def connection(self):
+                self.held += 1
+                yield
+                self.held -= 1
+
+            async def random(self, key):
+                self.picks.append(self.held)
+                return await super().random(key)
+
+            async def members(self, key):
+                self.picks.append(self.held)
+                return await super().members(key)
+
+        async def run(c):
+            await c.learn("a b c")
+            return await c.generate(deadline=10), await c.generate_many(2)
+
+        for wrap in (lambda db: db, CachedDatabaseAsync):
+            db = HeldDatabase()
+            c = ChattyMarkovAsync("memory_async://")
+            c.db = wrap(db)
+            self.assertEqual(asyncio.run(run(c)), ("a b c", ["a b c"] * 2))
+            self.assertEqual(db.held, 0)
+            self.assertTrue(db.picks)
+            self.assertTrue(all(db.picks))
@@ -0,0 +1,138 @@
+import io
+import json
+import os
+import tempfile
+
+import fakeredis
+import pytest
+
+from chattymarkov import ChattyMarkov, dump
+from chattymarkov.cli import main
+from chattymarkov.database import MemoryDatabase, RedisDatabase
+
+
+MESSAGES = ["hello world", "hello there", "héllo wörld", "hello world"]
+
+
+def parse_resp(data):
+    """Parse the commands of a RESP stream."""
+    commands = []
+    lines = iter(data.split(b"\r\n"))
+    for line in lines:
+        if not line:
+            continue
+        assert line.startswith(b"*")
+        args = []
+        for _ in range(int(line[1:])):
+            length = int(next(lines)[1:])
+            arg = next(lines)
+            assert len(arg) == length
+            args.append(arg)
+        commands.append(args)
+    return commands
+
+
+class TestDump:
+    def setup_method(self, method):
+        self.markov = ChattyMarkov("memory://;weighted=1")
+        self.markov.learn_many(MESSAGES)
+        self.table = dict(self.markov.db.scan())
+
+    @pytest.mark.parametrize("format", dump.FORMATS)
+    def test_round_trip(self, format):
+        """Test that a dump loads back into another database."""
+        stream = io.BytesIO()
+        assert dump.dump(self.markov.db, stream, format) == len(self.table)
+        assert list(dump.read(io.BytesIO(stream.getvalue()))) == list(
+            self.table.items()
+        )
+
+        db = MemoryDatabase(weighted=True)
+        stream.seek(0)
+        assert dump.load(db, stream) == len(self.table)
+        assert dict(db.scan()) == self.table
+
+    def test_ndjson(self):
+        """Test that NDJSON dumps hold a record per line."""
+        stream = io.BytesIO()
+        dump.dump(self.markov.db, stream)
+        lines = stream.getvalue().decode().splitlines()
+        assert len(lines) == len(self.table)
+        key, successors = json.loads(lines[0])
+        assert successors == self.table[key]
+
+    def test_redis(self):
+        """Test loading into redis and exporting from it."""
+        stream = io.BytesIO()
+        dump.dump(self.markov.db, stream, dump.FORMAT_BINARY)
+        stream.seek(0)
+        db = RedisDatabase(weighted=True)
+        db.handle = fakeredis.FakeStrictRedis()
+        dump.load(db, stream, batch_size=2)
+
+        exported = io.BytesIO()
+        dump.dump(db, exported)
+        exported.seek(0)
+        assert dict(dump.read(exported)) == self.table
+
+    def test_union(self):
+        """Test that unweighted databases get each transition once."""
+        stream = io.BytesIO()
+        dump.dump(self.markov.db, stream)
+        stream.seek(0)
+        db = MemoryDatabase()
+        dump.load(db, stream)
+        assert db.members("chattymarkov-\x01hello") == {
+            "world": 1,
+            "there": 1,
+        }
+
+    def test_resp(self):
+        """Test that RESP streams replay the dump into redis."""
+        for weighted in (False, True):
+            stream = io.BytesIO()
+            written = dump.to_resp(self.table.items(), stream, weighted)
+            commands = parse_resp(stream.getvalue())
+            assert len(commands) == written
+
+            db = RedisDatabase(weighted=weighted)
+            db.handle = fakeredis.FakeStrictRedis()
+            for command in commands:
+                db.handle.execute_command(*command)
+            if weighted:
+                assert dict(db.scan()) == self.table
+            else:
+                assert {key: set(members) for key, members in db.scan()} == {
+                    key: set(members) for key, members in self.table.items()
+                }
+
+    def test_invalid(self):
+        """Test that truncated and invalid dumps are rejected."""
+        stream = io.BytesIO()
+        dump.dump(self.markov.db, stream, dump.FORMAT_BINARY)
+        with pytest.raises(dump.DumpError):
+            list(dump.read(io.BytesIO(stream.getvalue()[:-1])))
+        with pytest.raises(dump.DumpError):
+            list(dump.read(io.BytesIO(b'["key", {"word": 1}]\nnot json\n')))
+
+    def test_cli(self):
+        """Test the dump, load and resp commands."""
+        with tempfile.TemporaryDirectory() as directory:
+            source = os.path.join(directory, "source.json")
+            target = os.path.join(directory, "target.json")
+            path = os.path.join(directory, "model.cmkd")
+            resp = os.path.join(directory, "model.resp")
+            with open(source, "w") as stream:
+                json.dump(
+                    {key: dict(value) for key, value in self.table.items()},
+                    stream,
+                )
+
+            main(["dump", "json://{};weighted=1".format(source), "-o", path,
+                  "--format", "binary"])
+            main(["load", "json://{};weighted=1".format(target), path])
+            main(["resp", path, "-o", resp])
+            with open(target) as stream:
+                assert json.load(stream) == self.table
+            with open(resp, "rb") as stream:
+                assert parse_resp(stream.read())[0][0] == b"SADD"
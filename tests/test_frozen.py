@@ -0,0 +1,57 @@
+import collections
+
+import fakeredis
+import pytest
+
+from chattymarkov import ChattyMarkov
+from chattymarkov.frozen import FrozenModel, _alias_table
+
+
+class TestFrozenModel:
+    @pytest.mark.parametrize("connect_string", [
+        "memory://", "compact://", "memory://;weighted=1", "redis://",
+        "redis://;weighted=1", "memory://;cache_size=8;metrics=1",
+    ])
+    def test_freeze(self, connect_string):
+        """Test that frozen models generate what has been learned."""
+        markov = ChattyMarkov(connect_string)
+        if connect_string.startswith("redis"):
+            markov.db.handle = fakeredis.FakeStrictRedis()
+        markov.learn_many(["hello big world", "goodbye", "hello  there"])
+        markov.learn("other channel", "channel")
+        model = markov.freeze()
+        assert isinstance(model, FrozenModel)
+        sentences = set(model.generate_many(50))
+        assert sentences == {"hello big world", "goodbye", "hello"}
+        assert model.generate(max_words=1) in ("hello", "goodbye")
+
+        assert markov.freeze("channel").generate() == "other channel"
+        assert markov.freeze("nothing").generate() == ""
+
+    def test_order(self):
+        """Test freezing models of other orders."""
+        markov = ChattyMarkov("memory://", order=3)
+        markov.learn("a b c d")
+        markov.learn("x b c e")
+        assert set(markov.freeze().generate_many(20)) == {
+            "a b c d", "x b c e"}
+        assert len(markov.freeze()) == 9
+
+    def test_weighted(self):
+        """Test that frozen weighted models keep the learned frequencies."""
+        markov = ChattyMarkov("memory://;weighted=1", order=1)
+        markov.db.add("chattymarkov-", "rare", 1)
+        markov.db.add("chattymarkov-", "common", 9)
+        counts = collections.Counter(
+            markov.freeze().generate_many(2000, max_words=1))
+        assert 0.85 < counts["common"] / 2000 < 0.95
+
+    def test_alias_table(self):
+        """Test that alias tables preserve the distribution."""
+        counts = [1, 2, 3, 4]
+        probabilities, aliases = _alias_table(counts)
+        weights = [0.0] * len(counts)
+        for i, (p, alias) in enumerate(zip(probabilities, aliases)):
+            weights[i] += p / len(counts)
+            weights[alias] += (1 - p) / len(counts)
+        assert weights == pytest.approx([c / 10 for c in counts])
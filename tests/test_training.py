@@ -0,0 +1,89 @@
+import json
+import os
+import tempfile
+
+import fakeredis
+
+from chattymarkov import ChattyMarkov, training
+from chattymarkov.cli import main
+from chattymarkov.database import MemoryDatabase, RedisDatabase
+
+
+MESSAGES = [
+    "hello world",
+    "hello there",
+    "héllo wörld",
+    "",
+    "hello world",
+] * 50
+
+
+def learned(db):
+    return {key: dict(successors) for key, successors in db.scan()}
+
+
+class TestTraining:
+    def setup_method(self, method):
+        self.directory = tempfile.TemporaryDirectory()
+        self.paths = []
+        for i in range(3):
+            path = os.path.join(self.directory.name, "corpus{}.txt".format(i))
+            with open(path, "w", encoding="utf-8") as stream:
+                stream.write("\n".join(MESSAGES) + "\n")
+            self.paths.append(path)
+
+    def teardown_method(self, method):
+        self.directory.cleanup()
+
+    def expected(self, weighted):
+        markov = ChattyMarkov(
+            "memory://;weighted={}".format(int(weighted)))
+        markov.learn_many(MESSAGES * len(self.paths))
+        return learned(markov.db)
+
+    def test_read_shard(self):
+        """Test that shards cover every line exactly once."""
+        lines = []
+        for shard in training._shards(self.paths[:1], 7):
+            lines.extend(training._read_shard(*shard, "utf-8"))
+        assert lines == MESSAGES
+
+    def test_merge_tables(self):
+        """Test the sum and union semantics of `merge_tables`."""
+        tables = [{"a": {"b": 2}}, {"a": {"b": 1, "c": 1}, "d": {"e": 3}}]
+        assert training.merge_tables(tables) == {
+            "a": {"b": 3, "c": 1}, "d": {"e": 3}}
+        assert training.merge_tables(tables, "union") == {
+            "a": {"b": 1, "c": 1}, "d": {"e": 1}}
+
+    def test_train_sum(self):
+        """Test that parallel training sums counts into weighted databases."""
+        db = training.train(
+            "memory://;weighted=1", self.paths, processes=2, shard_size=64)
+        assert learned(db) == self.expected(weighted=True)
+
+    def test_train_union(self):
+        """Test that union merges count each transition once."""
+        db = MemoryDatabase(weighted=True)
+        training.train(
+            db, self.paths, processes=1, merge="union", shard_size=64)
+        assert learned(db) == self.expected(weighted=False)
+
+    def test_train_redis(self):
+        """Test bulk loading partial tables into redis."""
+        db = RedisDatabase(weighted=True)
+        db.handle = fakeredis.FakeStrictRedis()
+        training.train(
+            db, self.paths, processes=2, shard_size=64, batch_size=7)
+        expected = self.expected(weighted=True)
+        for key, successors in expected.items():
+            assert db.members(key) == successors
+
+    def test_cli(self):
+        """Test the train command."""
+        path = os.path.join(self.directory.name, "model.json")
+        main(["train", "json://{};weighted=1".format(path), *self.paths,
+              "-j", "2", "--prefix", "bot", "--order", "1"])
+        with open(path) as stream:
+            model = json.load(stream)
+        assert model["bot-hello"] == {"world": 300, "there": 150}